@@ -6,9 +6,50 @@ according to the specified DGP.
 """
 
 import numpy as np
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from grouped_data import GroupedData, GroupView
 
 
-def generate_calibration_data(number_groups, lambda_Poisson, dgp_specification):
+_VECTORIZED_KEYS = (
+    'mean_X_given_U_matrix',
+    'regression_Y_matrix',
+    'noise_sd_Y_matrix',
+    'covariance_X_cholesky'
+)
+
+
+def _is_vectorized(dgp_specification):
+    """Whether the specification provides the matrix (vectorized) contract."""
+    return all(key in dgp_specification for key in _VECTORIZED_KEYS)
+
+
+def _draw_observations(dgp_specification, U_groups, N, rng):
+    """
+    Draw X and Y for groups with covariates U_groups (m, d) and sizes N (m,)
+    in one pass: X = mean(U) + Z L^T with the cached Cholesky factor L, and
+    Y = regression(X, U) + sd(U) * eps.
+
+    Returns:
+    --------
+    tuple : (X of shape (sum(N), d), Y of shape (sum(N),))
+    """
+    d = dgp_specification['dimension']
+    L = dgp_specification['covariance_X_cholesky'](d)
+    n_total = int(np.sum(N))
+
+    U_rows = np.repeat(U_groups, N, axis=0)
+    mu_X = np.repeat(dgp_specification['mean_X_given_U_matrix'](U_groups), N, axis=0)
+    X = mu_X + rng.standard_normal(size=(n_total, d)) @ L.T
+
+    mu_Y = dgp_specification['regression_Y_matrix'](X, U_rows)
+    sd_Y = np.repeat(dgp_specification['noise_sd_Y_matrix'](U_groups), N)
+    Y = mu_Y + sd_Y * rng.standard_normal(size=n_total)
+    return X, Y
+
+
+def generate_calibration_data(number_groups, lambda_Poisson, dgp_specification, rng=None):
     """
     Generate calibration data with hierarchical structure.
 
@@ -20,31 +61,45 @@ def generate_calibration_data(number_groups, lambda_Poisson, dgp_specification):
         Parameter for Poisson distribution of group sizes
     dgp_specification : dict
         DGP specification object
+    rng : numpy.random.Generator, optional
+        Random number generator (default: the global np.random state)
 
     Returns:
     --------
     dict with keys:
         - 'U_calibration': ndarray of shape (K, d) - group-level covariates
-        - 'Z_calibration': list of lists - observations for each group
+        - 'Z_calibration': GroupedData - observations for each group
         - 'sample_size_vector': array of group sizes
     """
+    if rng is None:
+        rng = np.random
     d = dgp_specification['dimension']
 
     # Generate group-level covariates U ~ Unif(u_min, u_max)^d
-    U_cal = np.random.uniform(
+    U_cal = rng.uniform(
         low=dgp_specification['u_min'],
         high=dgp_specification['u_max'],
         size=(number_groups, d)
     )
 
     # Generate group sizes: 1 + Poisson(lambda)
-    N = 1 + np.random.poisson(lam=lambda_Poisson, size=number_groups)
+    N = 1 + rng.poisson(lam=lambda_Poisson, size=number_groups)
+
+    if _is_vectorized(dgp_specification):
+        X_all, Y_all = _draw_observations(dgp_specification, U_cal, N, rng)
+        offsets = np.concatenate([[0], np.cumsum(N)])
+        return {
+            'U_calibration': U_cal,
+            'Z_calibration': GroupedData(X_all, Y_all, offsets, U_cal),
+            'sample_size_vector': N
+        }
 
     # Get covariance matrix for X
     Sigma_X = dgp_specification['covariance_X'](d)
 
     # Generate observations for each group
-    Z_cal = []
+    X_blocks = []
+    Y_blocks = []
     for j in range(number_groups):
         Uj = U_cal[j, :]
         Nj = N[j]
@@ -53,23 +108,24 @@ def generate_calibration_data(number_groups, lambda_Poisson, dgp_specification):
         mu_X = dgp_specification['mean_X_given_U'](Uj)
 
         # Generate X ~ N(mu_X, Sigma_X)
-        X_mat = np.random.multivariate_normal(
+        X_mat = rng.multivariate_normal(
             mean=mu_X,
             cov=Sigma_X,
             size=Nj
         )
 
         # Generate Y for each observation
-        group_obs = []
+        Y_vec = np.empty(Nj)
         for i in range(Nj):
             x = X_mat[i, :]
             mu_Y = dgp_specification['regression_Y'](x, Uj)
             sd_Y = dgp_specification['noise_sd_Y'](Uj)
-            y = np.random.normal(loc=mu_Y, scale=sd_Y)
+            Y_vec[i] = rng.normal(loc=mu_Y, scale=sd_Y)
 
-            group_obs.append({'X': x, 'Y': y})
+        X_blocks.append(X_mat)
+        Y_blocks.append(Y_vec)
 
-        Z_cal.append(group_obs)
+    Z_cal = GroupedData.from_groups(X_blocks, Y_blocks, U_cal)
 
     return {
         'U_calibration': U_cal,
@@ -78,7 +134,7 @@ def generate_calibration_data(number_groups, lambda_Poisson, dgp_specification):
     }
 
 
-def generate_test_group(lambda_Poisson, dgp_specification, o_observed):
+def generate_test_group(lambda_Poisson, dgp_specification, o_observed, rng=None):
     """
     Generate a test group.
 
@@ -90,28 +146,40 @@ def generate_test_group(lambda_Poisson, dgp_specification, o_observed):
         DGP specification object
     o_observed : int
         Number of observed points (ensures N_test > o_observed)
+    rng : numpy.random.Generator, optional
+        Random number generator (default: the global np.random state)
 
     Returns:
     --------
     dict with keys:
         - 'U_test': ndarray of shape (1, d) - group-level covariate
-        - 'Z_test': list - observations for test group
+        - 'Z_test': GroupView - observations for test group
         - 'N_test': int - size of test group
     """
+    if rng is None:
+        rng = np.random
     d = dgp_specification['dimension']
 
     # Generate group-level covariate U ~ Unif(u_min, u_max)^d
-    U_test = np.random.uniform(
+    U_test = rng.uniform(
         low=dgp_specification['u_min'],
         high=dgp_specification['u_max'],
         size=(1, d)
     )
 
     # Generate group size: 1 + Poisson(lambda), ensuring N_test > o_observed
-    N_test = 1 + np.random.poisson(lam=lambda_Poisson)
+    N_test = 1 + rng.poisson(lam=lambda_Poisson)
     if N_test <= o_observed:
         N_test = o_observed + 1
 
+    if _is_vectorized(dgp_specification):
+        X_mat, Y_vec = _draw_observations(dgp_specification, U_test, np.array([N_test]), rng)
+        return {
+            'U_test': U_test,
+            'Z_test': GroupView(X_mat, Y_vec),
+            'N_test': N_test
+        }
+
     # Get covariance matrix for X
     Sigma_X = dgp_specification['covariance_X'](d)
 
@@ -119,21 +187,21 @@ def generate_test_group(lambda_Poisson, dgp_specification, o_observed):
     mu_X = dgp_specification['mean_X_given_U'](U_test[0, :])
 
     # Generate X ~ N(mu_X, Sigma_X)
-    X_mat = np.random.multivariate_normal(
+    X_mat = rng.multivariate_normal(
         mean=mu_X,
         cov=Sigma_X,
         size=N_test
     )
 
     # Generate Y for each observation
-    Z_test = []
+    Y_vec = np.empty(N_test)
     for i in range(N_test):
         x = X_mat[i, :]
         mu_Y = dgp_specification['regression_Y'](x, U_test[0, :])
         sd_Y = dgp_specification['noise_sd_Y'](U_test[0, :])
-        y = np.random.normal(loc=mu_Y, scale=sd_Y)
+        Y_vec[i] = rng.normal(loc=mu_Y, scale=sd_Y)
 
-        Z_test.append({'X': x, 'Y': y})
+    Z_test = GroupView(X_mat, Y_vec)
 
     return {
         'U_test': U_test,
@@ -8,6 +8,47 @@ All experiments use U ~ Unif(0,1)^d.
 import numpy as np
 
 
+# Vectorized contract
+# -------------------
+# A specification holds per-observation functions ('mean_X_given_U',
+# 'regression_Y', 'noise_sd_Y', 'covariance_X') and may provide matrix
+# versions that the data generators use to draw whole groups (or whole
+# calibration sets) with a handful of NumPy calls:
+#   'mean_X_given_U_matrix'(U)      : (m, d) -> (m, d)
+#   'regression_Y_matrix'(X, U)     : (n, d), (n, d) -> (n,)   (row-wise U)
+#   'noise_sd_Y_matrix'(U)          : (m, d) -> (m,)
+#   'covariance_X_cholesky'(d)      : lower Cholesky factor of covariance_X(d)
+# Specifications without them fall back to the per-observation loop. The
+# specifications below write each formula once, in its matrix version, and
+# evaluate the per-observation function as a one-row matrix.
+
+
+def cached_cholesky(covariance_X):
+    """
+    Cholesky factor of covariance_X(d), computed once per dimension.
+
+    Parameters:
+    -----------
+    covariance_X : callable
+        Function d -> (d, d) covariance matrix
+
+    Returns:
+    --------
+    callable : d -> read-only lower-triangular factor L with L L^T = covariance_X(d)
+    """
+    # plain dict rather than functools.lru_cache so the closure pickles
+    # (by value) into experiment worker processes
+    factors = {}
+
+    def covariance_X_cholesky(dimension_inner):
+        if dimension_inner not in factors:
+            L = np.linalg.cholesky(covariance_X(dimension_inner))
+            L.flags.writeable = False
+            factors[dimension_inner] = L
+        return factors[dimension_inner]
+    return covariance_X_cholesky
+
+
 def create_dgp_specification_default(dimension, u_min=0, u_max=1, rho_X=0.7):
     """
     Create a default DGP specification.
@@ -38,18 +79,26 @@ def create_dgp_specification_default(dimension, u_min=0, u_max=1, rho_X=0.7):
               rho_X * np.ones((dimension_inner, dimension_inner))
         return cov
 
-    def regression_Y(x_vector, u_vector):
+    def regression_Y_matrix(X_matrix, U_matrix):
         """
-        Regression function for Y given X and U:
+        Regression function for Y given X and U, row-wise for (n, d) arrays:
         10 * sin(pi * x1 * x2) + 2 * u1^2 * x1^2
         """
-        term1 = 10 * np.sin(np.pi * x_vector[0] * x_vector[1])
-        term2 = 2 * u_vector[0]**2 * x_vector[0]**2
+        term1 = 10 * np.sin(np.pi * X_matrix[:, 0] * X_matrix[:, 1])
+        term2 = 2 * U_matrix[:, 0]**2 * X_matrix[:, 0]**2
         return term1 + term2
 
+    def noise_sd_Y_matrix(U_matrix):
+        """Standard deviation of noise for Y, row-wise: 0.5 * (1 + 0.3 * u1)"""
+        return 0.5 * (1 + 0.3 * U_matrix[:, 0])
+
+    def regression_Y(x_vector, u_vector):
+        """regression_Y_matrix for one observation."""
+        return regression_Y_matrix(np.asarray(x_vector)[None], np.asarray(u_vector)[None])[0]
+
     def noise_sd_Y(u_vector):
-        """Standard deviation of noise for Y: 0.5 * (1 + 0.3 * u1)"""
-        return 0.5 * (1 + 0.3 * u_vector[0])
+        """noise_sd_Y_matrix for one observation."""
+        return noise_sd_Y_matrix(np.asarray(u_vector)[None])[0]
 
     return {
         'dimension': dimension,
@@ -58,7 +107,11 @@ def create_dgp_specification_default(dimension, u_min=0, u_max=1, rho_X=0.7):
         'mean_X_given_U': mean_X_given_U,
         'covariance_X': covariance_X,
         'regression_Y': regression_Y,
-        'noise_sd_Y': noise_sd_Y
+        'noise_sd_Y': noise_sd_Y,
+        'mean_X_given_U_matrix': mean_X_given_U,  # elementwise already
+        'regression_Y_matrix': regression_Y_matrix,
+        'noise_sd_Y_matrix': noise_sd_Y_matrix,
+        'covariance_X_cholesky': cached_cholesky(covariance_X)
     }
 
 
@@ -98,31 +151,39 @@ def create_dgp_specification_nonlinear(dimension, u_min=0, u_max=1, rho_X=0.5):
             base_matrix[i, i] *= (1 + (i + 1) / 5)
         return base_matrix
 
-    def regression_Y(x_vector, u_vector):
+    def regression_Y_matrix(X_matrix, U_matrix):
         """
-        Complex nonlinear regression function:
+        Complex nonlinear regression function, row-wise for (n, d) arrays:
         - 5 * sin(pi * x1 * u2)
         - 3 * x2^2 * sign(u3 - 0.5)
         - 2 * exp(-(x3 - u3)^2)
         - x4^3 * (u1 - 0.3)
         - sin(3*x5 + 2*u5)
         """
-        term1 = 5 * np.sin(np.pi * x_vector[0] * u_vector[1])
-        term2 = 3 * (x_vector[1]**2) * np.sign(u_vector[2] - 0.5)
-        term3 = 2 * np.exp(-(x_vector[2] - u_vector[2])**2)
-        term4 = (x_vector[3]**3) * (u_vector[0] - 0.3)
-        term5 = np.sin(3 * x_vector[4] + 2 * u_vector[4])
+        term1 = 5 * np.sin(np.pi * X_matrix[:, 0] * U_matrix[:, 1])
+        term2 = 3 * (X_matrix[:, 1]**2) * np.sign(U_matrix[:, 2] - 0.5)
+        term3 = 2 * np.exp(-(X_matrix[:, 2] - U_matrix[:, 2])**2)
+        term4 = (X_matrix[:, 3]**3) * (U_matrix[:, 0] - 0.3)
+        term5 = np.sin(3 * X_matrix[:, 4] + 2 * U_matrix[:, 4])
         return term1 + term2 + term3 + term4 + term5
 
-    def noise_sd_Y(u_vector):
+    def noise_sd_Y_matrix(U_matrix):
         """
-        Heteroskedastic noise standard deviation:
+        Heteroskedastic noise standard deviation, row-wise:
         0.2 + 0.8 * |u1 - 0.5| + 0.4 * I(u2 > 0.5)
         """
-        sd = 0.2 + 0.8 * np.abs(u_vector[0] - (u_max + u_min) / 2)
-        sd += 0.4 * (u_vector[1] > (u_min + u_max) / 2)
+        sd = 0.2 + 0.8 * np.abs(U_matrix[:, 0] - (u_max + u_min) / 2)
+        sd += 0.4 * (U_matrix[:, 1] > (u_min + u_max) / 2)
         return sd
 
+    def regression_Y(x_vector, u_vector):
+        """regression_Y_matrix for one observation."""
+        return regression_Y_matrix(np.asarray(x_vector)[None], np.asarray(u_vector)[None])[0]
+
+    def noise_sd_Y(u_vector):
+        """noise_sd_Y_matrix for one observation."""
+        return noise_sd_Y_matrix(np.asarray(u_vector)[None])[0]
+
     return {
         'dimension': dimension,
         'u_min': u_min,
@@ -130,5 +191,9 @@ def create_dgp_specification_nonlinear(dimension, u_min=0, u_max=1, rho_X=0.5):
         'mean_X_given_U': mean_X_given_U,
         'covariance_X': covariance_X,
         'regression_Y': regression_Y,
-        'noise_sd_Y': noise_sd_Y
+        'noise_sd_Y': noise_sd_Y,
+        'mean_X_given_U_matrix': mean_X_given_U,  # elementwise already
+        'regression_Y_matrix': regression_Y_matrix,
+        'noise_sd_Y_matrix': noise_sd_Y_matrix,
+        'covariance_X_cholesky': cached_cholesky(covariance_X)
     }
@@ -9,23 +9,20 @@ import numpy as np
 import pandas as pd
 import sys
 from pathlib import Path
+from joblib import Parallel, delayed
 sys.path.append(str(Path(__file__).parent.parent))
 from DGP.data_generation import generate_calibration_data, generate_test_group
-from .baseline_hcp import (
-    compute_hcp_interval_radius,
-    compute_pooling_interval_radius,
-    compute_subsampling_once_interval_radius,
-    compute_repeated_subsampling_interval_radius
-)
-from .hcp_plus import compute_hcp_plus_interval
-from .hcp_sample import compute_hcp_sample_interval
-from scores import absolute_residual_score
+from methods.baseline_hcp import BaselineCalibration
+from methods.hcp_plus import compute_hcp_plus_intervals
+from methods.hcp_sample import compute_hcp_sample_interval
+from methods.model_cache import GlobalModelCache
+from resources import get_resources, resource_scope, worker_budget
 
 
 def run_one_experiment(number_groups_k, lambda_Poisson, dgp_specification,
                        o_observed, alpha, number_subsampling_repetitions,
                        alpha_selection, number_test_groups,
-                       mu_method_baseline, mu_method_hcp):
+                       mu_method_baseline, mu_method_hcp, rng=None):
     """
     Run one experiment comparing different methods.
 
@@ -51,6 +48,9 @@ def run_one_experiment(number_groups_k, lambda_Poisson, dgp_specification,
         μ-method for baseline methods
     mu_method_hcp : dict
         μ-method for HCP++ and HCP.sample
+    rng : numpy.random.Generator, optional
+        Random number generator for data generation and all randomized
+        methods (default: the global np.random state)
 
     Returns:
     --------
@@ -60,47 +60,26 @@ def run_one_experiment(number_groups_k, lambda_Poisson, dgp_specification,
     cal = generate_calibration_data(
         number_groups=number_groups_k,
         lambda_Poisson=lambda_Poisson,
-        dgp_specification=dgp_specification
+        dgp_specification=dgp_specification,
+        rng=rng
     )
     U_cal = cal['U_calibration']
     Z_cal = cal['Z_calibration']
 
-    # Split calibration groups for baseline methods
-    K0 = number_groups_k // 2
-    train_idx = list(range(K0))
-    calib_idx = list(range(K0, number_groups_k))
-
-    # Fit baseline model
-    model_baseline = mu_method_baseline['fit_global'](
-        U_matrix=U_cal,
-        Z_list=Z_cal,
-        group_index_vector=train_idx
+    # Baseline model (first half of the groups), scores and radii
+    baseline = BaselineCalibration(
+        U_cal, Z_cal, mu_method_baseline,
+        number_repetitions=number_subsampling_repetitions, rng=rng
     )
+    radii = baseline.radii(alpha)
+    T_hcp = radii['HCP']
+    T_pool = radii['Pooling']
+    T_sub = radii['Subsampling']
+    T_rep = radii['Repeated']
 
-    # Compute scores for baseline methods
-    scores_list = []
-    for j in calib_idx:
-        Zj = Z_cal[j]
-        Uj = U_cal[j, :]
-        yj = np.array([z['Y'] for z in Zj])
-        Xj = np.array([z['X'] for z in Zj])
-
-        muj = np.array([
-            mu_method_baseline['predict_global'](
-                model_global=model_baseline,
-                x_vector=Xj[i],
-                u_vector=Uj
-            ) for i in range(len(Xj))
-        ])
-        scores_list.append(absolute_residual_score(yj, muj))
-
-    # Compute interval radii for baseline methods
-    T_hcp = compute_hcp_interval_radius(scores_list, alpha)
-    T_pool = compute_pooling_interval_radius(scores_list, alpha)
-    T_sub = compute_subsampling_once_interval_radius(scores_list, alpha)
-    T_rep = compute_repeated_subsampling_interval_radius(
-        scores_list, alpha, number_subsampling_repetitions
-    )
+    # Global models depend only on (calibration data, S_comp), so they are
+    # shared across test groups (HCP.sample uses the same S_comp for all of them)
+    model_cache = GlobalModelCache()
 
     # Initialize result arrays
     cov_hcppp = np.zeros(number_test_groups, dtype=bool)
@@ -124,42 +103,47 @@ def run_one_experiment(number_groups_k, lambda_Poisson, dgp_specification,
     inf_sub = 0
     inf_rep = 0
 
-    # Evaluate on test groups
+    # Generate test groups (those too small to hold the target are skipped)
+    test_groups = []
     for t in range(number_test_groups):
         test = generate_test_group(
             lambda_Poisson=lambda_Poisson,
             dgp_specification=dgp_specification,
-            o_observed=o_observed
-        )
-        U_test = test['U_test']
-        Z_test = test['Z_test']
-        N_test = test['N_test']
-
-        Y_test = np.array([z['Y'] for z in Z_test])
-        test_index = o_observed  # 0-indexed
-        if N_test < test_index + 1:
-            continue
-
-        true_target = Y_test[test_index]
-        X_target = Z_test[test_index]['X']
-        mu_test_hat = mu_method_baseline['predict_global'](
-            model_global=model_baseline,
-            x_vector=X_target,
-            u_vector=U_test[0, :]
+            o_observed=o_observed,
+            rng=rng
         )
+        if test['N_test'] >= o_observed + 1:
+            test_groups.append((t, test))
 
-        # HCP++
-        res_pp = compute_hcp_plus_interval(
+    test_index = o_observed  # 0-indexed
+
+    # HCP++ for all test groups at once (donor selection done once, one global
+    # fit per distinct donor)
+    if len(test_groups) > 0:
+        res_pp = compute_hcp_plus_intervals(
             U_calibration=U_cal,
             Z_calibration=Z_cal,
-            U_test=U_test,
-            Z_test=Z_test,
+            U_test_matrix=np.vstack([test['U_test'] for _, test in test_groups]),
+            Z_test_list=[test['Z_test'] for _, test in test_groups],
             o_observed=o_observed,
             alpha=alpha,
             alpha_selection=alpha_selection,
-            mu_method=mu_method_hcp
+            mu_method=mu_method_hcp,
+            model_cache=model_cache,
+            rng=rng
         )
-        int_pp = res_pp['interval']
+
+    # Evaluate on test groups
+    for i, (t, test) in enumerate(test_groups):
+        U_test = test['U_test']
+        Z_test = test['Z_test']
+
+        true_target = Z_test.Y[test_index]
+        X_target = Z_test.X[test_index]
+        mu_test_hat = baseline.predict(X_target, U_test[0, :])
+
+        # HCP++
+        int_pp = (res_pp['lower'][i], res_pp['upper'][i])
         cov_hcppp[t] = (int_pp[0] <= true_target <= int_pp[1])
         if np.isfinite(int_pp[0]) and np.isfinite(int_pp[1]):
             wid_hcppp[t] = int_pp[1] - int_pp[0]
@@ -176,7 +160,9 @@ def run_one_experiment(number_groups_k, lambda_Poisson, dgp_specification,
             alpha=alpha,
             test_index_target=test_index,
             alpha_selection=alpha_selection,
-            mu_method=mu_method_hcp
+            mu_method=mu_method_hcp,
+            model_cache=model_cache,
+            rng=rng
         )
         int_hs = res_hs['interval']
         cov_hcpsamp[t] = (int_hs[0] <= true_target <= int_hs[1])
@@ -257,10 +243,14 @@ def run_experiments_outer(number_experiments, number_groups_k, lambda_Poisson,
                           number_subsampling_repetitions=50,
                           alpha_selection=0.1, number_test_groups=100,
                           mu_method_baseline=None, mu_method_hcp=None,
-                          show_progress=True):
+                          show_progress=True, n_workers=None, seed=None):
     """
     Run multiple experiments (outer loop).
 
+    Every experiment draws from its own np.random.Generator, spawned from
+    SeedSequence(seed), so results are identical for any n_workers and any
+    scheduling order.
+
     Parameters:
     -----------
     number_experiments : int
@@ -287,19 +277,25 @@ def run_experiments_outer(number_experiments, number_groups_k, lambda_Poisson,
         μ-method for HCP++ and HCP.sample
     show_progress : bool
         Whether to print progress (default: True)
+    n_workers : int or None
+        Number of worker processes (1 runs in-process; -1 uses all cores;
+        default: the n_workers of resources.configure_resources). Each worker
+        gets an equal share of the cores for its RF and BLAS threads.
+    seed : int or None
+        Root seed of the per-experiment streams (default: None draws it from
+        the global np.random state, so np.random.seed still controls the run)
 
     Returns:
     --------
     DataFrame : Combined results from all experiments
     """
-    if show_progress:
-        print(f"Running {number_experiments} experiments sequentially...")
-
-    results_list = []
-    for e in range(number_experiments):
-        if show_progress and (e + 1) % 5 == 0:
-            print(f"  Completed {e + 1}/{number_experiments} experiments")
+    if n_workers is None:
+        n_workers = get_resources()['n_workers']
+    if seed is None:
+        seed = int(np.random.randint(0, 2**31 - 1))
+    streams = np.random.SeedSequence(seed).spawn(number_experiments)
 
+    def one(e):
         res = run_one_experiment(
             number_groups_k=number_groups_k,
             lambda_Poisson=lambda_Poisson,
@@ -310,10 +306,35 @@ def run_experiments_outer(number_experiments, number_groups_k, lambda_Poisson,
             alpha_selection=alpha_selection,
             number_test_groups=number_test_groups,
             mu_method_baseline=mu_method_baseline,
-            mu_method_hcp=mu_method_hcp
+            mu_method_hcp=mu_method_hcp,
+            rng=np.random.default_rng(streams[e])
         )
         res['experiment'] = e + 1
-        results_list.append(res)
+        return res
+
+    if n_workers == 1:
+        if show_progress:
+            print(f"Running {number_experiments} experiments sequentially...")
+
+        results_list = []
+        for e in range(number_experiments):
+            if show_progress and (e + 1) % 5 == 0:
+                print(f"  Completed {e + 1}/{number_experiments} experiments")
+            results_list.append(one(e))
+    else:
+        if show_progress:
+            print(f"Running {number_experiments} experiments on {n_workers} workers...")
+
+        budget = worker_budget(n_workers)
+
+        def one_in_worker(e):
+            with resource_scope(**budget):
+                return one(e)
+
+        # Results come back in experiment order whatever the scheduling
+        results_list = Parallel(n_jobs=n_workers, verbose=5 if show_progress else 0)(
+            delayed(one_in_worker)(e) for e in range(number_experiments)
+        )
 
     combined = pd.concat(results_list, ignore_index=True)
     # Reorder columns to put experiment first
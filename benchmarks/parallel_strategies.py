@@ -0,0 +1,131 @@
+"""
+Benchmark: Outer vs Inner vs Mixed Parallelism
+
+Runs the same DGP experiment batch under different splits of the cores
+between worker processes (outer) and Random Forest / BLAS threads (inner) and
+reports the throughput of each. Results are checked to be identical across
+strategies (per-experiment seed streams, fixed RF random_state).
+
+Strategies:
+- outer:      one worker per core, 1 RF/BLAS thread per worker
+- inner:      1 worker, RF/BLAS use all cores
+- mixed:      ~sqrt(cores) workers, cores / workers threads each
+- nested:     one worker per core AND n_jobs=-1 RF in every worker (the
+              oversubscribed setup the resource budget avoids)
+
+Usage:
+    python benchmarks/parallel_strategies.py --experiments 16 --ntree 50
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent))
+from DGP.dgp_specification import create_dgp_specification_default
+from DGP.experiments import run_experiments_outer
+from methods.mu_methods import (
+    create_mu_method_random_forest_offset,
+    create_mu_method_random_forest_global_only
+)
+from resources import available_cores, configure_resources, resource_scope
+
+
+def run_strategy(name, n_workers, threads, args, rf_n_jobs=None):
+    """Run the benchmark batch once and return (seconds, results)."""
+    dgp = create_dgp_specification_default(dimension=5, u_min=0, u_max=1)
+    mu_baseline = create_mu_method_random_forest_global_only(
+        ntree=args.ntree, nodesize=5, n_jobs=rf_n_jobs
+    )
+    mu_hcp = create_mu_method_random_forest_offset(
+        ntree=args.ntree, nodesize=5, n_jobs=rf_n_jobs
+    )
+
+    common = dict(
+        number_groups_k=args.groups,
+        lambda_Poisson=20,
+        dgp_specification=dgp,
+        o_observed=args.o,
+        alpha=0.1,
+        number_subsampling_repetitions=50,
+        alpha_selection=0.5,
+        mu_method_baseline=mu_baseline,
+        mu_method_hcp=mu_hcp,
+        show_progress=False,
+        n_workers=n_workers,
+        seed=args.seed
+    )
+
+    with resource_scope(rf_n_jobs=threads, blas_threads=threads):
+        # warm-up: start the worker processes and their imports untimed
+        run_experiments_outer(number_experiments=n_workers, number_test_groups=1, **common)
+
+        start = time.perf_counter()
+        res = run_experiments_outer(
+            number_experiments=args.experiments,
+            number_test_groups=args.test_groups,
+            **common
+        )
+        seconds = time.perf_counter() - start
+    return seconds, res
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parallelization strategies')
+    parser.add_argument('--cores', type=int, default=None,
+                        help='Cores to use (default: all)')
+    parser.add_argument('--experiments', type=int, default=16,
+                        help='Number of experiments per strategy (default: 16)')
+    parser.add_argument('--groups', type=int, default=20,
+                        help='Calibration groups per experiment (default: 20)')
+    parser.add_argument('--test_groups', type=int, default=50,
+                        help='Test groups per experiment (default: 50)')
+    parser.add_argument('--o', type=int, default=15,
+                        help='Observed points in test groups (default: 15)')
+    parser.add_argument('--ntree', type=int, default=50,
+                        help='Random Forest trees (default: 50)')
+    parser.add_argument('--seed', type=int, default=123,
+                        help='Random seed')
+    args = parser.parse_args()
+
+    if args.cores is not None:
+        configure_resources(total_cores=args.cores)
+    cores = available_cores()
+    mixed_workers = max(1, int(round(np.sqrt(cores))))
+
+    strategies = [
+        ('outer', cores, 1, None),
+        ('inner', 1, cores, None),
+        ('mixed', mixed_workers, max(1, cores // mixed_workers), None),
+        ('nested', cores, cores, -1),
+    ]
+
+    print(f"{cores} cores, {args.experiments} experiments, {args.test_groups} test groups, "
+          f"{args.ntree} trees")
+    rows = []
+    reference = None
+    for name, n_workers, threads, rf_n_jobs in strategies:
+        seconds, res = run_strategy(name, n_workers, threads, args, rf_n_jobs=rf_n_jobs)
+        if reference is None:
+            reference = res
+        identical = res.equals(reference)
+        rows.append({
+            'strategy': name,
+            'workers': n_workers,
+            'threads_per_worker': 'all' if rf_n_jobs == -1 else threads,
+            'seconds': round(seconds, 2),
+            'experiments_per_second': round(args.experiments / seconds, 3),
+            'identical_results': identical
+        })
+        print(f"  {name:>7}: {seconds:8.2f}s")
+
+    print()
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Benchmark: Pickled vs Shared-Memory Calibration Data
+
+Measures what it costs to hand the same calibration set to every task of a
+process pool:
+
+- list:     legacy list-of-lists of {'X', 'Y'} dicts, pickled per task
+- columnar: GroupedData (X, Y, offsets, U), pickled per task
+- shared:   GroupedData published once with SharedGroupedData; tasks get a
+            SharedDataHandle and attach to the block without copying
+
+Pool transfers run with joblib's automatic memmapping of large arrays turned
+off (max_nbytes=None) so the pickled variants pay their full pickling cost.
+Every task returns a checksum of the data it received; the checksums are
+verified to agree across variants.
+
+Usage:
+    python benchmarks/shared_calibration.py --groups 200 --group_size 200 --tasks 32
+"""
+
+import argparse
+import pickle
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+sys.path.append(str(Path(__file__).parent.parent))
+from grouped_data import GroupedData, as_grouped_data
+from shared_data import SharedGroupedData, SharedDataHandle
+
+
+def make_calibration(n_groups, group_size, n_features, seed):
+    """Columnar calibration set with Poisson group sizes."""
+    rng = np.random.default_rng(seed)
+    sizes = np.maximum(1, rng.poisson(group_size, n_groups))
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    n = int(offsets[-1])
+    return GroupedData(
+        rng.normal(size=(n, n_features)),
+        rng.normal(size=n),
+        offsets,
+        rng.normal(size=(n_groups, 2))
+    )
+
+
+def checksum_task(Z_calibration, task):
+    """Worker task: resolve the calibration data and touch all of it."""
+    if isinstance(Z_calibration, SharedDataHandle):
+        Z_calibration = Z_calibration.attach()
+    Z_calibration = as_grouped_data(Z_calibration)
+    j = task % Z_calibration.n_groups
+    return float(Z_calibration.X.sum() + Z_calibration.Y.sum() + Z_calibration.group_Y(j).sum())
+
+
+def time_serialization(payload, repeats):
+    """Seconds per pickle.dumps + pickle.loads round trip and pickled bytes."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        blob = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.loads(blob)
+    return (time.perf_counter() - start) / repeats, len(blob)
+
+
+def time_pool(payload, n_tasks, n_workers):
+    """Seconds for n_tasks pool tasks that each receive payload, and the results."""
+    start = time.perf_counter()
+    results = Parallel(n_jobs=n_workers, max_nbytes=None)(
+        delayed(checksum_task)(payload, task) for task in range(n_tasks)
+    )
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pickled vs shared calibration data')
+    parser.add_argument('--groups', type=int, default=200,
+                        help='Calibration groups (default: 200)')
+    parser.add_argument('--group_size', type=int, default=200,
+                        help='Mean observations per group (default: 200)')
+    parser.add_argument('--features', type=int, default=20,
+                        help='Observation-level features (default: 20)')
+    parser.add_argument('--tasks', type=int, default=32,
+                        help='Pool tasks receiving the calibration data (default: 32)')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Worker processes (default: 2)')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Repetitions of the serialization timing (default: 3)')
+    parser.add_argument('--seed', type=int, default=123,
+                        help='Random seed')
+    args = parser.parse_args()
+
+    Z_calibration = make_calibration(args.groups, args.group_size, args.features, args.seed)
+    Z_list = Z_calibration.to_lists()
+    print(f"{Z_calibration.n_groups} groups, {Z_calibration.n_obs} observations, "
+          f"{Z_calibration.nbytes / 1e6:.1f} MB columnar, {args.tasks} tasks on {args.workers} workers")
+
+    # warm-up: start the worker processes and their imports untimed
+    time_pool(make_calibration(1, 1, 1, args.seed), args.workers, args.workers)
+
+    rows = []
+    reference = None
+    start = time.perf_counter()
+    shared = SharedGroupedData(Z_calibration)
+    publish_seconds = time.perf_counter() - start
+    with shared:
+        variants = [
+            ('list', Z_list, 0.0),
+            ('columnar', Z_calibration, 0.0),
+            ('shared', shared.handle, publish_seconds)
+        ]
+
+        for name, payload, setup_seconds in variants:
+            per_transfer, nbytes = time_serialization(payload, args.repeats)
+            pool_seconds, results = time_pool(payload, args.tasks, args.workers)
+            if reference is None:
+                reference = results
+            rows.append({
+                'variant': name,
+                'pickled_bytes': nbytes,
+                'pickle_roundtrip_ms': round(1e3 * per_transfer, 3),
+                'publish_ms': round(1e3 * setup_seconds, 3),
+                'pool_seconds': round(pool_seconds, 3),
+                'ms_per_task': round(1e3 * pool_seconds / args.tasks, 3),
+                'identical_results': np.allclose(results, reference)
+            })
+            print(f"  {name:>8}: {pool_seconds:8.3f}s")
+
+    print()
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""
+Columnar Storage for Hierarchical (Grouped) Data
+
+This module defines the GroupedData container used throughout the package.
+All observations of all groups are stored in one contiguous float64 design
+matrix X and one response vector Y; group j owns rows
+offsets[j]:offsets[j + 1] (CSR layout). Group-level covariates are kept in the
+(K, d) matrix U. The arrays can be saved as .npy files and reopened as
+memory maps, so several processes share one physical copy of a large data set
+through the page cache.
+
+For backward compatibility every group can still be viewed as a list of
+{'X': ndarray, 'Y': float} dicts through GroupView, and all methods accept
+either representation.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+
+
+def _readonly(array):
+    """Return a read-only view of an array (the caller's array is untouched)."""
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+class GroupView:
+    """
+    Thin list-of-dict view over the observations of a single group.
+
+    Indexing with an integer returns {'X': x_row, 'Y': y} exactly like the
+    legacy representation; indexing with a slice returns another GroupView.
+    The underlying arrays are exposed as `X` (n, p) and `Y` (n,).
+    """
+
+    __slots__ = ('X', 'Y')
+
+    def __init__(self, X, Y):
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(Y, dtype=float).ravel()
+        if X.ndim == 1:
+            X = X.reshape(0, 0) if Y.shape[0] == 0 else X.reshape(Y.shape[0], -1)
+        if X.shape[0] != Y.shape[0]:
+            raise ValueError("GroupView: X and Y must have the same number of rows")
+        self.X = X
+        self.Y = Y
+
+    def __len__(self):
+        return self.Y.shape[0]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return GroupView(self.X[i], self.Y[i])
+        return {'X': self.X[i], 'Y': float(self.Y[i])}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield {'X': self.X[i], 'Y': float(self.Y[i])}
+
+    def to_list(self):
+        """Materialize the legacy list of {'X', 'Y'} dicts."""
+        return list(self)
+
+
+def group_arrays(Z_group):
+    """
+    Return (X, Y) arrays for one group given in any supported representation.
+
+    Parameters:
+    -----------
+    Z_group : GroupView or list of dict
+        Observations of one group
+
+    Returns:
+    --------
+    tuple : (X of shape (n, p), Y of shape (n,))
+    """
+    if isinstance(Z_group, GroupView):
+        return Z_group.X, Z_group.Y
+    if len(Z_group) == 0:
+        return np.zeros((0, 0)), np.zeros(0)
+    X = np.asarray([z['X'] for z in Z_group], dtype=float)
+    Y = np.asarray([z['Y'] for z in Z_group], dtype=float)
+    return X.reshape(len(Z_group), -1), Y
+
+
+class GroupedData:
+    """
+    Columnar hierarchical data set.
+
+    Attributes:
+    -----------
+    X : ndarray of shape (n, p)
+        Stacked observation-level covariates of all groups (float64, read-only)
+    Y : ndarray of shape (n,)
+        Stacked responses (float64, read-only)
+    offsets : ndarray of shape (K + 1,)
+        CSR group offsets; group j owns rows offsets[j]:offsets[j + 1]
+    U : ndarray of shape (K, d)
+        Group-level covariates (float64, read-only)
+    """
+
+    def __init__(self, X, Y, offsets, U=None):
+        offsets = np.asarray(offsets, dtype=np.int64).ravel()
+        if offsets.shape[0] < 1 or offsets[0] != 0 or np.any(np.diff(offsets) < 0):
+            raise ValueError("GroupedData: offsets must start at 0 and be non-decreasing")
+        n = int(offsets[-1])
+        K = offsets.shape[0] - 1
+
+        X = np.ascontiguousarray(X, dtype=float)
+        if X.ndim == 1:
+            X = X.reshape(n, -1) if n > 0 else X.reshape(0, 0)
+        Y = np.ascontiguousarray(Y, dtype=float).ravel()
+        if X.shape[0] != n or Y.shape[0] != n:
+            raise ValueError("GroupedData: X and Y must have offsets[-1] rows")
+
+        if U is None:
+            U = np.zeros((K, 0))
+        U = np.ascontiguousarray(U, dtype=float)
+        if U.ndim == 1:
+            U = U.reshape(K, -1)
+        if U.shape[0] != K:
+            raise ValueError("GroupedData: U must have one row per group")
+
+        self.X = _readonly(X)
+        self.Y = _readonly(Y)
+        self.offsets = _readonly(offsets)
+        self.U = _readonly(U)
+        self._fingerprint = None
+
+    # ------------------------------------------------------------------
+    # Construction
+    # ------------------------------------------------------------------
+    @classmethod
+    def from_groups(cls, X_blocks, Y_blocks, U=None):
+        """
+        Build from per-group arrays.
+
+        Parameters:
+        -----------
+        X_blocks : list of ndarray
+            X_blocks[j] has shape (n_j, p)
+        Y_blocks : list of ndarray
+            Y_blocks[j] has shape (n_j,)
+        U : ndarray of shape (K, d), optional
+            Group-level covariates
+        """
+        sizes = np.array([len(y) for y in Y_blocks], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        p = 0
+        for Xb in X_blocks:
+            Xb = np.asarray(Xb)
+            if Xb.ndim == 2 and Xb.shape[0] > 0:
+                p = Xb.shape[1]
+                break
+        X = np.empty((int(offsets[-1]), p), dtype=float)
+        Y = np.empty(int(offsets[-1]), dtype=float)
+        for j, (Xb, Yb) in enumerate(zip(X_blocks, Y_blocks)):
+            if sizes[j] > 0:
+                X[offsets[j]:offsets[j + 1]] = Xb
+                Y[offsets[j]:offsets[j + 1]] = Yb
+        return cls(X, Y, offsets, U)
+
+    @classmethod
+    def from_rows(cls, X, Y, row_blocks, U=None):
+        """
+        Build by gathering rows of full-data arrays, one index array per group
+        (a single fancy-indexing pass over X and Y).
+
+        Parameters:
+        -----------
+        X : ndarray of shape (n, p)
+            Covariates of the full data set
+        Y : ndarray of shape (n,)
+            Responses of the full data set
+        row_blocks : list of array-like of int
+            row_blocks[j] holds the (positional) rows of group j
+        U : ndarray of shape (K, d), optional
+            Group-level covariates
+        """
+        row_blocks = [np.asarray(rows, dtype=np.int64).ravel() for rows in row_blocks]
+        sizes = np.array([rows.shape[0] for rows in row_blocks], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        rows = np.concatenate(row_blocks) if len(row_blocks) > 0 else np.zeros(0, dtype=np.int64)
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(Y, dtype=float).ravel()
+        if rows.shape[0] > 1 and rows[-1] - rows[0] == rows.shape[0] - 1 and np.all(np.diff(rows) == 1):
+            # one contiguous run of rows (e.g. adjacent groups of a
+            # group-sorted layout): slice instead of copying
+            window = slice(int(rows[0]), int(rows[-1]) + 1)
+            return cls(X[window], Y[window], offsets, U)
+        return cls(X[rows], Y[rows], offsets, U)
+
+    @classmethod
+    def from_lists(cls, Z_list, U=None):
+        """
+        Build from the legacy list-of-lists of {'X', 'Y'} dicts.
+
+        Parameters:
+        -----------
+        Z_list : list
+            Z_list[j] holds the observations of group j (list of dict or GroupView)
+        U : ndarray of shape (K, d), optional
+            Group-level covariates
+        """
+        blocks = [group_arrays(Z_group) for Z_group in Z_list]
+        return cls.from_groups([b[0] for b in blocks], [b[1] for b in blocks], U)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Open a data set written by save().
+
+        Parameters:
+        -----------
+        directory : str or Path
+            Directory holding X.npy, Y.npy, offsets.npy and U.npy
+        mmap_mode : str or None
+            np.load memory-map mode (default: 'r' = read-only memory maps,
+            shared between processes through the page cache; None reads the
+            arrays into memory)
+        """
+        directory = Path(directory)
+        arrays = [np.load(directory / f'{name}.npy', mmap_mode=mmap_mode)
+                  for name in ('X', 'Y', 'offsets', 'U')]
+        data = cls(*arrays)
+        meta_path = directory / 'grouped_data.json'
+        if meta_path.exists():
+            data._fingerprint = json.loads(meta_path.read_text()).get('fingerprint')
+        return data
+
+    def save(self, directory):
+        """
+        Write X, Y, offsets and U as .npy files (plus the fingerprint) to
+        directory, to be reopened with GroupedData.load.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, array in (('X', self.X), ('Y', self.Y), ('offsets', self.offsets), ('U', self.U)):
+            np.save(directory / f'{name}.npy', array)
+        (directory / 'grouped_data.json').write_text(json.dumps({
+            'n_groups': self.n_groups,
+            'n_obs': self.n_obs,
+            'n_features': self.n_features,
+            'fingerprint': self.fingerprint()
+        }, indent=1))
+        return directory
+
+    def with_U(self, U):
+        """Return the same observations with different group-level covariates."""
+        return GroupedData(self.X, self.Y, self.offsets, U)
+
+    # ------------------------------------------------------------------
+    # Shape information
+    # ------------------------------------------------------------------
+    @property
+    def n_groups(self):
+        return self.offsets.shape[0] - 1
+
+    @property
+    def n_obs(self):
+        return self.Y.shape[0]
+
+    @property
+    def n_features(self):
+        return self.X.shape[1]
+
+    @property
+    def group_sizes(self):
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return self.X.nbytes + self.Y.nbytes + self.offsets.nbytes + self.U.nbytes
+
+    def fingerprint(self):
+        """
+        Content hash (hex digest) of X, Y, offsets and U.
+
+        Computed once and memoized; the arrays are read-only, so the hash stays
+        valid as long as nobody writes to the caller's original buffers.
+        """
+        if self._fingerprint is None:
+            h = hashlib.blake2b(digest_size=16)
+            for array in (self.offsets, self.X, self.Y, self.U):
+                h.update(str(array.shape).encode())
+                h.update(np.ascontiguousarray(array).data)
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
+    # ------------------------------------------------------------------
+    # Access
+    # ------------------------------------------------------------------
+    def group_X(self, j):
+        """Observation covariates of group j (zero-copy view)."""
+        return self.X[self.offsets[j]:self.offsets[j + 1]]
+
+    def group_Y(self, j):
+        """Responses of group j (zero-copy view)."""
+        return self.Y[self.offsets[j]:self.offsets[j + 1]]
+
+    def rows(self, group_index_vector):
+        """
+        Row indices (into X and Y) of the selected groups, in the given order.
+        """
+        groups = np.asarray(group_index_vector, dtype=np.int64).ravel()
+        if groups.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64)
+        starts = self.offsets[groups]
+        sizes = self.offsets[groups + 1] - starts
+        total = int(sizes.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64)
+        # arange within each group shifted to the group start
+        shift = np.repeat(starts - np.concatenate([[0], np.cumsum(sizes)[:-1]]), sizes)
+        return np.arange(total, dtype=np.int64) + shift
+
+    def design(self, group_index_vector):
+        """
+        Stacked feature matrix [X | U_group] and responses for the selected groups.
+
+        Parameters:
+        -----------
+        group_index_vector : array-like of int
+            Groups to stack (0-indexed), in order
+
+        Returns:
+        --------
+        tuple : (features of shape (m, p + d), y of shape (m,))
+        """
+        groups = np.asarray(group_index_vector, dtype=np.int64).ravel()
+        rows = self.rows(groups)
+        sizes = self.offsets[groups + 1] - self.offsets[groups]
+        features = np.empty((rows.shape[0], self.n_features + self.U.shape[1]), dtype=float)
+        features[:, :self.n_features] = self.X[rows]
+        features[:, self.n_features:] = np.repeat(self.U[groups], sizes, axis=0)
+        return features, self.Y[rows]
+
+    def __len__(self):
+        return self.n_groups
+
+    def __getitem__(self, j):
+        if j < 0:
+            j += self.n_groups
+        if not 0 <= j < self.n_groups:
+            raise IndexError("GroupedData: group index out of range")
+        return GroupView(self.group_X(j), self.group_Y(j))
+
+    def __iter__(self):
+        for j in range(self.n_groups):
+            yield self[j]
+
+    def to_lists(self):
+        """Materialize the legacy list-of-lists of {'X', 'Y'} dicts."""
+        return [self[j].to_list() for j in range(self.n_groups)]
+
+
+def as_grouped_data(Z_list, U_matrix=None):
+    """
+    Coerce calibration data to GroupedData.
+
+    Parameters:
+    -----------
+    Z_list : GroupedData or list
+        Columnar data or the legacy list-of-lists of {'X', 'Y'} dicts
+    U_matrix : ndarray of shape (K, d), optional
+        Group-level covariates; overrides the ones stored in Z_list if they differ
+
+    Returns:
+    --------
+    GroupedData
+    """
+    if isinstance(Z_list, GroupedData):
+        if U_matrix is None:
+            return Z_list
+        U_matrix = np.asarray(U_matrix, dtype=float)
+        if U_matrix.shape == Z_list.U.shape and np.array_equal(U_matrix, Z_list.U):
+            return Z_list
+        return Z_list.with_U(U_matrix)
+    return GroupedData.from_lists(Z_list, U_matrix)
@@ -8,6 +8,7 @@ including HCP++, HCP.sample, and baseline methods.
 from .mu_methods import (
     create_mu_method_random_forest_offset,
     create_mu_method_random_forest_global_only,
+    create_mu_method_random_forest_group_bagged,
     create_mu_method_ols_offset,
     create_mu_method_ols_global_only
 )
@@ -15,20 +16,28 @@ from .baseline_hcp import (
     compute_hcp_interval_radius,
     compute_pooling_interval_radius,
     compute_subsampling_once_interval_radius,
-    compute_repeated_subsampling_interval_radius
+    compute_repeated_subsampling_interval_radius,
+    BaselineCalibration
 )
-from .hcp_plus import compute_hcp_plus_interval
+from .hcp_plus import compute_hcp_plus_interval, compute_hcp_plus_intervals
 from .hcp_sample import compute_hcp_sample_interval
+from .hcp_online import OnlineHCPPlus
+from .model_cache import GlobalModelCache
 
 __all__ = [
     'create_mu_method_random_forest_offset',
     'create_mu_method_random_forest_global_only',
+    'create_mu_method_random_forest_group_bagged',
     'create_mu_method_ols_offset',
     'create_mu_method_ols_global_only',
     'compute_hcp_interval_radius',
     'compute_pooling_interval_radius',
     'compute_subsampling_once_interval_radius',
     'compute_repeated_subsampling_interval_radius',
+    'BaselineCalibration',
     'compute_hcp_plus_interval',
-    'compute_hcp_sample_interval'
+    'compute_hcp_plus_intervals',
+    'compute_hcp_sample_interval',
+    'OnlineHCPPlus',
+    'GlobalModelCache'
 ]
@@ -6,13 +6,23 @@ This module implements baseline hierarchical conformal prediction methods:
 - Pooling
 - Subsampling (once)
 - Repeated subsampling
+
+BaselineCalibration bundles the parts of these methods that depend only on
+the calibration data (baseline model, calibration scores, radii) so they are
+computed once and reused for every test point.
 """
 
 import numpy as np
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
-from scores import weighted_quantile
+from scores import (
+    absolute_residual_score,
+    weighted_quantile,
+    GroupedWeightedQuantile,
+    infinite_quantile
+)
+from grouped_data import as_grouped_data
 
 
 def compute_hcp_interval_radius(scores_list, alpha):
@@ -23,31 +33,24 @@ def compute_hcp_interval_radius(scores_list, alpha):
     -----------
     scores_list : list of arrays
         List where scores_list[k] contains scores for calibration group k
-    alpha : float
-        Miscoverage level
+    alpha : float or array-like
+        Miscoverage level, or a vector of levels sharing one sort
 
     Returns:
     --------
-    float : Interval radius
+    float : Interval radius (ndarray of radii if alpha is a vector)
     """
     K = len(scores_list)
     Nk = np.array([len(scores) for scores in scores_list])
 
-    # Combine all scores
-    all_scores = []
-    all_weights = []
-
-    for k in range(K):
-        nk = Nk[k]
-        if nk > 0:
-            all_scores.extend(scores_list[k])
-            all_weights.extend([1.0 / ((K + 1) * nk)] * nk)
+    # Per-group scores with within-group weight 1/((K+1) n_k)
+    blocks = [scores_list[k] for k in range(K) if Nk[k] > 0]
+    group_weights = [1.0 / ((K + 1) * nk) for nk in Nk if nk > 0]
 
     # Add infinity with weight 1/(K+1)
-    all_scores.append(np.inf)
-    all_weights.append(1.0 / (K + 1))
-
-    return weighted_quantile(all_scores, all_weights, alpha)
+    return GroupedWeightedQuantile(
+        blocks, group_weights, point_masses=[(np.inf, 1.0 / (K + 1))]
+    ).quantile(alpha)
 
 
 def compute_pooling_interval_radius(scores_list, alpha):
@@ -58,33 +61,27 @@ def compute_pooling_interval_radius(scores_list, alpha):
     -----------
     scores_list : list of arrays
         List where scores_list[k] contains scores for calibration group k
-    alpha : float
-        Miscoverage level
+    alpha : float or array-like
+        Miscoverage level, or a vector of levels sharing one sort
 
     Returns:
     --------
-    float : Interval radius
+    float : Interval radius (ndarray of radii if alpha is a vector)
     """
     K = len(scores_list)
     Nk = np.array([len(scores) for scores in scores_list])
 
-    # Combine all scores without infinity
-    all_scores = []
-    all_weights = []
+    # Per-group scores with within-group weight 1/(K n_k), without infinity
+    blocks = [scores_list[k] for k in range(K) if Nk[k] > 0]
+    group_weights = [1.0 / (K * nk) for nk in Nk if nk > 0]
 
-    for k in range(K):
-        nk = Nk[k]
-        if nk > 0:
-            all_scores.extend(scores_list[k])
-            all_weights.extend([1.0 / (K * nk)] * nk)
+    if len(blocks) == 0:
+        return infinite_quantile(alpha)
 
-    if len(all_scores) == 0:
-        return np.inf
+    return GroupedWeightedQuantile(blocks, group_weights).quantile(alpha)
 
-    return weighted_quantile(all_scores, all_weights, alpha)
 
-
-def compute_subsampling_once_interval_radius(scores_list, alpha):
+def compute_subsampling_once_interval_radius(scores_list, alpha, rng=None):
     """
     Compute subsampling interval radius (sample one score from each group).
 
@@ -92,34 +89,37 @@ def compute_subsampling_once_interval_radius(scores_list, alpha):
     -----------
     scores_list : list of arrays
         List where scores_list[k] contains scores for calibration group k
-    alpha : float
-        Miscoverage level
+    alpha : float or array-like
+        Miscoverage level, or a vector of levels sharing one sort
+    rng : numpy.random.Generator, optional
+        Random number generator (default: the global np.random state)
 
     Returns:
     --------
-    float : Interval radius
+    float : Interval radius (ndarray of radii if alpha is a vector)
     """
+    if rng is None:
+        rng = np.random
     K = len(scores_list)
     if K == 0:
-        return np.inf
+        return infinite_quantile(alpha)
 
     # Sample one score from each group
     sampled_scores = []
     for scores in scores_list:
         if len(scores) > 0:
-            sampled_scores.append(np.random.choice(scores))
-
-    # Add infinity
-    sampled_scores.append(np.inf)
+            sampled_scores.append(rng.choice(scores))
 
-    # Uniform weights
+    # Uniform weights; infinity is added as a point mass
     weights = np.ones(len(sampled_scores)) / (K + 1)
 
-    return weighted_quantile(sampled_scores, weights, alpha)
+    return weighted_quantile(sampled_scores, weights, alpha,
+                             point_masses=[(np.inf, 1.0 / (K + 1))])
 
 
 def compute_repeated_subsampling_interval_radius(scores_list, alpha,
-                                                 number_repetitions):
+                                                 number_repetitions, rng=None,
+                                                 mode='sample'):
     """
     Compute repeated subsampling interval radius.
 
@@ -127,32 +127,173 @@ def compute_repeated_subsampling_interval_radius(scores_list, alpha,
     -----------
     scores_list : list of arrays
         List where scores_list[k] contains scores for calibration group k
-    alpha : float
-        Miscoverage level
+    alpha : float or array-like
+        Miscoverage level, or a vector of levels sharing one sort
     number_repetitions : int
         Number of times to repeat the subsampling
+    rng : numpy.random.Generator, optional
+        Random number generator (default: the global np.random state)
+    mode : str
+        'sample' (default): draw number_repetitions scores from every group
+        'expected': the limit number_repetitions -> infinity in closed form
+        (number_repetitions and rng are not used)
 
     Returns:
     --------
-    float : Interval radius
+    float : Interval radius (ndarray of radii if alpha is a vector)
     """
+    if mode not in ('sample', 'expected'):
+        raise ValueError(f"Unknown repeated subsampling mode: {mode}")
     K = len(scores_list)
-    if K == 0 or number_repetitions <= 0:
-        return np.inf
+    if K == 0 or (mode == 'sample' and number_repetitions <= 0):
+        return infinite_quantile(alpha)
 
-    # Sample scores repeatedly
-    sampled_scores = []
-    for _ in range(number_repetitions):
-        for scores in scores_list:
-            if len(scores) > 0:
-                sampled_scores.append(np.random.choice(scores))
+    Nk = np.array([len(scores) for scores in scores_list])
+    blocks = [np.asarray(scores_list[k], dtype=float).ravel() for k in range(K) if Nk[k] > 0]
+    if len(blocks) == 0:
+        return infinite_quantile(alpha)
+
+    if mode == 'expected':
+        # Every group contributes total weight 1/(K+1); as the repetitions
+        # grow its draws approach its empirical CDF, i.e. weight
+        # 1/((K+1) n_k) on each of its scores
+        group_weights = [1.0 / ((K + 1) * nk) for nk in Nk if nk > 0]
+        return GroupedWeightedQuantile(
+            blocks, group_weights, point_masses=[(np.inf, 1.0 / (K + 1))]
+        ).quantile(alpha)
+
+    if rng is None:
+        rng = np.random
+    integers = getattr(rng, 'integers', None) or rng.randint
+
+    # Flattened CSR scores; one draw per (repetition, non-empty group)
+    sizes = Nk[Nk > 0]
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    flat = np.concatenate(blocks)
+    draws = integers(0, sizes, size=(number_repetitions, sizes.shape[0]))
+    sampled_scores = flat[(starts + draws).ravel()]
+
+    # Weights; infinity is added as a point mass
+    weights = np.full(sampled_scores.shape[0], 1.0 / (number_repetitions * (K + 1)))
+
+    return weighted_quantile(sampled_scores, weights, alpha,
+                             point_masses=[(np.inf, 1.0 / (K + 1))])
 
-    # Add infinity
-    sampled_scores.append(np.inf)
 
-    # Weights
-    n_samples = K * number_repetitions
-    weights = np.array([1.0 / (number_repetitions * (K + 1))] * n_samples +
-                      [1.0 / (K + 1)])
+BASELINE_METHODS = ('HCP', 'Pooling', 'Subsampling', 'Repeated')
+
+
+class BaselineCalibration:
+    """
+    Calibration context of the baseline methods.
+
+    The baselines fit a global model on the first half of the calibration
+    groups and score the second half; neither step involves the test group, so
+    the model, the scores and the radii are built once and shared by all test
+    points evaluated against the same calibration data. Radii are memoized per
+    alpha.
+
+    Parameters:
+    -----------
+    U_calibration : ndarray of shape (K, d)
+        Group-level covariates of the calibration groups
+    Z_calibration : GroupedData or list of lists
+        Calibration observations
+    mu_method : dict
+        Baseline μ-method (only the global model is used)
+    number_repetitions : int
+        Number of repetitions of the repeated subsampling baseline (default: 50)
+    rng : numpy.random.Generator, optional
+        Random number generator for the subsampling baselines
+        (default: the global np.random state)
+    repeated_mode : str
+        'sample' (default) or 'expected' (limit of infinitely many
+        repetitions); see compute_repeated_subsampling_interval_radius
+
+    Attributes:
+    -----------
+    model : object
+        Global model fitted on the first K // 2 calibration groups (the
+        degenerate fit on no groups if K < 2)
+    scores_list : list of arrays
+        Calibration scores of the remaining groups (not pickled: a copy sent
+        to another process carries the model and the radii derived so far)
+    """
 
-    return weighted_quantile(sampled_scores, weights, alpha)
+    def __init__(self, U_calibration, Z_calibration, mu_method,
+                 number_repetitions=50, rng=None, repeated_mode='sample'):
+        calibration = as_grouped_data(Z_calibration, U_calibration)
+        K = calibration.n_groups
+
+        # Split calibration groups: fit on the first half, score the second
+        # (with a single group the model is fitted on no groups, i.e. it is
+        # whatever fit_global returns for an empty selection, e.g. None)
+        K0 = K // 2
+        self.train_index = list(range(K0))
+        self.calib_index = list(range(K0, K))
+
+        self.mu_method = mu_method
+        self.number_repetitions = number_repetitions
+        self.rng = rng
+        self.repeated_mode = repeated_mode
+        self.model = mu_method['fit_global'](
+            U_matrix=calibration.U,
+            Z_list=calibration,
+            group_index_vector=self.train_index
+        )
+
+        self.scores_list = []
+        for j in self.calib_index:
+            muj = mu_method['predict_global_batch'](
+                model_global=self.model,
+                X_matrix=calibration.group_X(j),
+                u_vector=calibration.U[j, :]
+            )
+            self.scores_list.append(absolute_residual_score(calibration.group_Y(j), muj))
+
+        self._radii = {}
+
+    def radii(self, alpha):
+        """
+        Interval radii of the four baselines at level alpha (memoized).
+
+        Returns:
+        --------
+        dict : {'HCP', 'Pooling', 'Subsampling', 'Repeated'} -> radius
+               (ndarray of radii if alpha is a vector)
+        """
+        key = tuple(np.ravel(alpha).tolist()) if np.ndim(alpha) > 0 else float(alpha)
+        if key not in self._radii:
+            if self.scores_list is None:
+                raise ValueError(
+                    f"BaselineCalibration: radii at alpha={alpha} were not derived "
+                    "before the calibration was pickled"
+                )
+            self._radii[key] = {
+                'HCP': compute_hcp_interval_radius(self.scores_list, alpha),
+                'Pooling': compute_pooling_interval_radius(self.scores_list, alpha),
+                'Subsampling': compute_subsampling_once_interval_radius(
+                    self.scores_list, alpha, rng=self.rng
+                ),
+                'Repeated': compute_repeated_subsampling_interval_radius(
+                    self.scores_list, alpha, self.number_repetitions, rng=self.rng,
+                    mode=self.repeated_mode
+                )
+            }
+        return self._radii[key]
+
+    def __getstate__(self):
+        # the scores are O(n) and only needed to derive new radii; workers
+        # receive the model and the memoized radii
+        state = self.__dict__.copy()
+        state['scores_list'] = None
+        state['rng'] = None
+        return state
+
+    def predict(self, x_vector, u_vector):
+        """Baseline point prediction μ̂(x) for one test observation."""
+        return self.mu_method['predict_global'](
+            model_global=self.model,
+            x_vector=x_vector,
+            u_vector=u_vector
+        )
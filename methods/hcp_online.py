@@ -0,0 +1,397 @@
+"""
+Online HCP++ for a Streaming Test Group
+
+In the sequential setting the test group grows by one observation per step
+and HCP++ is evaluated for the next one. Recomputing the interval from scratch
+costs O(o) per step (fit the test offset on the first τ points, score the
+points τ..o-1, sort). OnlineHCPPlus keeps that work incremental instead:
+
+- residuals Y - μ_global(X) of the test group are computed once per global
+  model, so the test offset (their running mean over the first τ points) is a
+  prefix-sum lookup;
+- the residuals in the calibration window [τ, o) are kept sorted, so the test
+  group's share of the weighted CDF at t is two binary searches around the
+  offset, and τ = floor(o/2) transitions insert/remove single residuals;
+- the donor set S_tilde is a range of the presorted calibration group sizes,
+  found by binary search.
+
+Calibration groups are treated the same way (residuals once per global model,
+offsets from prefix sums), so no μ-model is evaluated on calibration data
+after the first step that uses a given global model. The residual tracks of
+a global model are kept with it in a bounded LRU and dropped together; a
+dropped model's tracks are rebuilt if it is used again. Intervals agree with
+compute_hcp_plus_interval called on the growing test group with the same rng
+(up to rounding in the offsets).
+"""
+
+import bisect
+import numpy as np
+import sys
+from collections import OrderedDict
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from scores import CDF_TOLERANCE, GroupedWeightedQuantile, infinite_quantile, symmetric_interval
+from grouped_data import as_grouped_data
+from methods.hcp_plus import split_point
+from methods.model_cache import GlobalModelCache
+
+
+def _grow(buffer, size):
+    """buffer, or a copy with at least twice the capacity if size does not fit."""
+    if size <= buffer.shape[0]:
+        return buffer
+    grown = np.zeros((max(size, 2 * buffer.shape[0]),) + buffer.shape[1:])
+    grown[:buffer.shape[0]] = buffer
+    return grown
+
+
+class _ResidualTrack:
+    """
+    Residuals of one group under one global model, with prefix sums for the
+    offset and (for the test group) a sorted calibration window.
+    """
+
+    def __init__(self):
+        self._n = 0
+        self._residuals = np.zeros(16)
+        self._prefix = np.zeros(17)        # prefix[i] = sum of the first i residuals
+        self.window = []                   # sorted residuals[window_lo:window_hi]
+        self.window_lo = None
+        self.window_hi = None
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def residuals(self):
+        return self._residuals[:self._n]
+
+    def extend(self, new_residuals):
+        new_residuals = np.asarray(new_residuals, dtype=float).ravel()
+        m = new_residuals.shape[0]
+        if m == 0:
+            return
+        n = self._n
+        self._residuals = _grow(self._residuals, n + m)
+        self._prefix = _grow(self._prefix, n + m + 1)
+        self._residuals[n:n + m] = new_residuals
+        self._prefix[n + 1:n + m + 1] = self._prefix[n] + np.cumsum(new_residuals)
+        self._n = n + m
+
+    def mean(self, tau):
+        """Mean of the first tau residuals (0 for tau = 0)."""
+        return float(self._prefix[tau] / tau) if tau > 0 else 0.0
+
+    def slide_window(self, lo, hi):
+        """Make window hold the sorted residuals[lo:hi] (lo and hi never decrease)."""
+        if self.window_lo is None:
+            self.window_lo = self.window_hi = lo
+        for i in range(self.window_hi, hi):
+            bisect.insort(self.window, float(self._residuals[i]))
+        self.window_hi = max(self.window_hi, hi)
+        for i in range(self.window_lo, min(lo, self.window_hi)):
+            del self.window[bisect.bisect_left(self.window, float(self._residuals[i]))]
+        self.window_lo = max(self.window_lo, lo)
+
+
+class _ModelState:
+    """A global model with the residual tracks computed under it."""
+
+    def __init__(self, model):
+        self.model = model
+        self.test_track = _ResidualTrack()
+        self.calibration_tracks = {}       # j -> _ResidualTrack
+
+
+def _count_within(window, center, radius):
+    """#{r in window : |r - center| <= radius} for a sorted window."""
+    # compare the deviations r - center themselves (not r with center +- radius)
+    # so the count is exact for radii taken from _kth_deviation
+    def deviation(r):
+        return r - center
+    return (bisect.bisect_right(window, radius, key=deviation)
+            - bisect.bisect_left(window, -radius, key=deviation))
+
+
+def _kth_deviation(window, center, k):
+    """k-th smallest (0-indexed) |r - center| over a sorted window."""
+    p = bisect.bisect_left(window, center)
+    n_left, n_right = p, len(window) - p
+
+    # deviations left of the center ascend as we walk down from p-1, those
+    # right of it as we walk up from p; select k+1 elements from the two runs
+    def left(i):
+        return -(window[p - 1 - i] - center)
+
+    def right(j):
+        return window[p + j] - center
+
+    lo, hi = max(0, k + 1 - n_right), min(k + 1, n_left)
+    while lo < hi:
+        i = (lo + hi) // 2
+        if left(i) < right(k - i):
+            lo = i + 1
+        else:
+            hi = i
+    i, j = lo, k + 1 - lo
+    candidates = []
+    if i > 0:
+        candidates.append(left(i - 1))
+    if j > 0:
+        candidates.append(right(j - 1))
+    return max(candidates)
+
+
+class OnlineHCPPlus:
+    """
+    HCP++ intervals for a test group whose observations arrive one at a time.
+
+    Call predict_interval(x) for the next observation, then update(x, y) once
+    its response is known. Each prediction draws a donor exactly like
+    compute_hcp_plus_interval, so a shared rng gives the same donors.
+
+    Parameters:
+    -----------
+    U_calibration : ndarray of shape (K, d)
+        Group-level covariates for calibration groups
+    Z_calibration : GroupedData or list of lists
+        Calibration observations (K >= 1)
+    U_test : ndarray of shape (1, d)
+        Group-level covariate for test group
+    alpha : float or array-like
+        Miscoverage level, or a vector of levels
+    alpha_selection : float
+        Selection level for donor groups
+    mu_method : dict
+        μ-estimation method object; its group adjustment must be the mean
+        residual of the global model or none ('group_adjustment_type')
+    model_cache : GlobalModelCache, optional
+        Cache of global models (default: a new GlobalModelCache with its
+        default bounds)
+    rng : numpy.random.Generator, optional
+        Random number generator (default: the global np.random state)
+    max_models : int
+        Global models kept here together with their residual tracks; the
+        least recently used are dropped (default: 64)
+    """
+
+    def __init__(self, U_calibration, Z_calibration, U_test, alpha, alpha_selection,
+                 mu_method, model_cache=None, rng=None, max_models=64):
+        adjustment = mu_method.get('group_adjustment_type')
+        if adjustment not in ('mean_residual', 'none'):
+            raise ValueError("OnlineHCPPlus: mu_method must declare group_adjustment_type "
+                             "'mean_residual' or 'none'")
+        self.calibration = as_grouped_data(Z_calibration, U_calibration)
+        if self.calibration.n_groups == 0:
+            raise ValueError("OnlineHCPPlus: at least one calibration group is required")
+
+        self.U_test = np.asarray(U_test, dtype=float).reshape(1, -1)
+        self.alpha = alpha
+        self.alpha_selection = alpha_selection
+        self.mu_method = mu_method
+        self.use_offset = adjustment == 'mean_residual'
+        self.model_cache = GlobalModelCache() if model_cache is None else model_cache
+        self.max_models = max_models
+        self.rng = np.random if rng is None else rng
+
+        N = self.calibration.group_sizes
+        self._N = N
+        self._size_order = np.argsort(N, kind='stable')
+        self._N_sorted = N[self._size_order]
+        self._donor_sets = {}
+
+        self._n_observed = 0
+        self._X = np.zeros((16, self.calibration.n_features))
+        self._Y = np.zeros(16)
+
+        self._states = OrderedDict()       # S_comp -> _ModelState (LRU)
+        self._calibration_quantiles = {}   # S_comp -> GroupedWeightedQuantile (current tau)
+        self._quantile_tau = None
+
+    @property
+    def n_observed(self):
+        """Number of test observations ingested so far."""
+        return self._n_observed
+
+    def update(self, x_vector, y):
+        """Add one observed test point (the one last predicted for)."""
+        n = self._n_observed
+        self._X = _grow(self._X, n + 1)
+        self._Y = _grow(self._Y, n + 1)
+        self._X[n] = np.asarray(x_vector, dtype=float).ravel()
+        self._Y[n] = float(y)
+        self._n_observed = n + 1
+
+    def _donor_set(self, o_observed):
+        """S_tilde for o observed points (see select_donor_groups)."""
+        K = self._N_sorted.shape[0]
+        n_le_o = int(np.searchsorted(self._N_sorted, o_observed, side='right'))
+        p = min(1.0, n_le_o / K + (1 - self.alpha_selection))
+        V_o = self._N_sorted[max(0, int(np.ceil(p * K)) - 1)]
+        hi = int(np.searchsorted(self._N_sorted, V_o, side='right'))
+        if hi <= n_le_o:
+            hi = K
+        key = (n_le_o, hi)
+        if key not in self._donor_sets:
+            self._donor_sets[key] = np.sort(self._size_order[n_le_o:hi])
+        return self._donor_sets[key]
+
+    def _state(self, S_comp):
+        """Global model fitted on S_comp and its residual tracks."""
+        state = self._states.get(S_comp)
+        if state is not None:
+            self._states.move_to_end(S_comp)
+            return state
+        state = _ModelState(self.model_cache.get_or_fit(
+            self.mu_method, self.calibration.U, self.calibration, sorted(S_comp)
+        ))
+        self._states[S_comp] = state
+        while len(self._states) > max(self.max_models, 1):
+            self._states.popitem(last=False)
+        return state
+
+    def _calibration_track(self, S_comp, j):
+        state = self._state(S_comp)
+        if j not in state.calibration_tracks:
+            track = _ResidualTrack()
+            mu = self.mu_method['predict_global_batch'](
+                model_global=state.model,
+                X_matrix=self.calibration.group_X(j),
+                u_vector=self.calibration.U[j, :]
+            )
+            track.extend(self.calibration.group_Y(j) - mu)
+            state.calibration_tracks[j] = track
+        return state.calibration_tracks[j]
+
+    def _calibration_quantile(self, S_comp, S_cal, tau):
+        """Presorted calibration scores of the groups in S_cal at split tau."""
+        if tau != self._quantile_tau:
+            # tau never decreases, so older splits are not needed again
+            self._calibration_quantiles = {}
+            self._quantile_tau = tau
+        if S_comp not in self._calibration_quantiles:
+            S_size = len(S_cal) + 1
+            blocks, weights = [], []
+            for j in S_cal:
+                if self._N[j] <= tau:
+                    continue
+                track = self._calibration_track(S_comp, j)
+                offset = track.mean(tau) if self.use_offset else 0.0
+                blocks.append(np.abs(track.residuals[tau:] - offset))
+                weights.append(1.0 / (S_size * (self._N[j] - tau)))
+            self._calibration_quantiles[S_comp] = GroupedWeightedQuantile(blocks, weights)
+        return self._calibration_quantiles[S_comp]
+
+    def _test_track(self, S_comp, o_observed, tau):
+        state = self._state(S_comp)
+        track = state.test_track
+        n_done = len(track)
+        if n_done < o_observed:
+            mu = self.mu_method['predict_global_batch'](
+                model_global=state.model,
+                X_matrix=self._X[n_done:o_observed],
+                u_vector=self.U_test[0, :]
+            )
+            track.extend(self._Y[n_done:o_observed] - mu)
+        track.slide_window(tau, o_observed)
+        return track
+
+    @staticmethod
+    def _quantile(calibration_quantile, window, center, w_test, inf_mass, alpha):
+        """
+        (1-alpha)-quantile of the calibration scores, the test scores
+        |r - center| (r in window, weight w_test each) and inf_mass at infinity.
+        """
+        def test_cdf(t):
+            total = 0.0
+            if w_test != 0:
+                total += w_test * _count_within(window, center, t)
+            if inf_mass > 0 and t >= np.inf:
+                total += inf_mass
+            return total
+
+        def cdf(t):
+            return calibration_quantile.cdf(t) + test_cdf(t)
+
+        def outside_cdf(values):
+            return np.array([test_cdf(t) for t in values])
+
+        # calibration candidates, all levels in one pass
+        best = np.atleast_1d(calibration_quantile.quantile(alpha, extra_cdf=outside_cdf)).ravel()
+        # test-score candidates, accessed in sorted order by selection
+        for a, level in enumerate(np.atleast_1d(alpha).ravel()):
+            threshold = 1 - level - CDF_TOLERANCE
+            lo, hi = 0, len(window)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if cdf(_kth_deviation(window, center, mid)) >= threshold:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            if lo < len(window):
+                best[a] = min(best[a], _kth_deviation(window, center, lo))
+        return float(best[0]) if np.ndim(alpha) == 0 else best.reshape(np.shape(alpha))
+
+    def predict_interval(self, x_target):
+        """
+        HCP++ interval for the next test observation given all observations
+        ingested so far (o_observed = n_observed).
+
+        Parameters:
+        -----------
+        x_target : array-like of shape (p,)
+            Features of the observation to predict
+
+        Returns:
+        --------
+        dict with keys:
+            - 'interval': tuple (lower, upper); arrays of bounds if alpha is a vector
+            - 'mu_hat': float
+            - 'number_selected_groups': int
+            - 'donor_group_index': int or None
+        """
+        o_observed = self.n_observed
+        K = self.calibration.n_groups
+        tau = split_point(o_observed)
+        S_tilde = self._donor_set(o_observed)
+
+        if len(S_tilde) == 0:
+            # no calibration group is larger than o: test group only, global
+            # model fitted on all calibration groups
+            donor = None
+            S_comp = frozenset(range(K))
+            calibration_quantile = GroupedWeightedQuantile([], [])
+            S_size = 1
+            n_inf = 0
+        else:
+            donor = int(self.rng.choice(S_tilde))
+            S_cal = np.sort(np.setdiff1d(S_tilde, [donor]))
+            S_comp = frozenset(int(j) for j in np.setdiff1d(np.arange(K), S_cal))
+            calibration_quantile = self._calibration_quantile(S_comp, S_cal, tau)
+            S_size = len(S_cal) + 1
+            n_inf = max(0, int(self._N[donor]) - o_observed)
+
+        track = self._test_track(S_comp, o_observed, tau)
+        offset = track.mean(tau) if self.use_offset else 0.0
+
+        n_tail_finite = len(track.window)
+        n_total_test = n_tail_finite + n_inf
+        w_test = 1.0 / (S_size * n_total_test) if n_total_test > 0 else 0.0
+        if donor is None and n_tail_finite == 0:
+            q = infinite_quantile(self.alpha)
+        else:
+            q = self._quantile(calibration_quantile, track.window, offset,
+                               w_test, n_inf * w_test, self.alpha)
+
+        mu_center = self.mu_method['predict_global'](
+            model_global=self._state(S_comp).model,
+            x_vector=np.asarray(x_target, dtype=float).ravel(),
+            u_vector=self.U_test[0, :]
+        ) + offset
+
+        return {
+            'interval': symmetric_interval(mu_center, q),
+            'mu_hat': mu_center,
+            'number_selected_groups': S_size,
+            'donor_group_index': donor
+        }
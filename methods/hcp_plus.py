@@ -8,11 +8,230 @@ import numpy as np
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
-from scores import weighted_quantile
+from scores import (
+    weighted_quantile, GroupedWeightedQuantile, infinite_quantile, symmetric_interval
+)
+from grouped_data import GroupView, as_grouped_data, group_arrays
+from methods.model_cache import fit_global_model
+from methods.mu_methods import fit_group_adjustments
+
+
+# Record layout returned by compute_hcp_plus_intervals (scalar alpha)
+HCP_PLUS_RESULT_DTYPE = np.dtype([
+    ('lower', np.float64),
+    ('upper', np.float64),
+    ('mu_hat', np.float64),
+    ('number_selected_groups', np.int64),
+    ('donor_group_index', np.int64)   # -1 when no donor group is used
+])
+
+
+def hcp_plus_result_dtype(alpha):
+    """
+    Record layout for compute_hcp_plus_intervals; with a vector of alphas the
+    lower and upper fields hold one bound per level.
+    """
+    if np.ndim(alpha) == 0:
+        return HCP_PLUS_RESULT_DTYPE
+    shape = np.shape(alpha)
+    return np.dtype([
+        ('lower', np.float64, shape),
+        ('upper', np.float64, shape),
+        ('mu_hat', np.float64),
+        ('number_selected_groups', np.int64),
+        ('donor_group_index', np.int64)
+    ])
+
+
+def select_donor_groups(N, o_observed, alpha_selection):
+    """
+    Select the candidate donor groups S_tilde for a test group with o observations.
+
+    Parameters:
+    -----------
+    N : ndarray of shape (K,)
+        Calibration group sizes
+    o_observed : int
+        Number of observed points in test group
+    alpha_selection : float
+        Selection level for donor groups
+
+    Returns:
+    --------
+    ndarray : Indices (0-indexed) of the selected calibration groups
+    """
+    K = len(N)
+
+    # Compute empirical CDF and selection threshold
+    def Fhat_N(t):
+        return np.mean(N <= t)
+
+    p = min(1.0, Fhat_N(o_observed) + (1 - alpha_selection))
+
+    N_sorted = np.sort(N)
+    idx_V = max(0, int(np.ceil(p * K)) - 1)  # -1 for 0-indexing
+    V_o = N_sorted[idx_V]
+
+    # Select donor groups
+    S_tilde = np.where((N > o_observed) & (N <= V_o))[0]
+    if len(S_tilde) == 0:
+        S_tilde = np.where(N > o_observed)[0]
+    return S_tilde
+
+
+def split_point(o_observed):
+    """τ(o): ALWAYS floor(o/2), with clamping."""
+    tau = int(np.floor(o_observed / 2))
+    if tau < 0:
+        tau = 0
+    if o_observed > 0 and tau >= o_observed:
+        tau = o_observed - 1
+    return tau
+
+
+def _calibration_scores(calibration, S_cal, S_size, tau, global_model, mu_method):
+    """
+    Calibration scores |Y - μ_global - offset_j| of the tail indices tau..N_j
+    of every group in S_cal, sorted per group for the weighted quantile.
+    """
+    N = calibration.group_sizes
+    U_calibration = calibration.U
+
+    score_blocks = []
+    group_weights = []
+
+    # Calibration uses observations from index tau onwards
+    S_used = S_cal[N[S_cal] > tau]
+    if tau > 0:
+        offsets = fit_group_adjustments(
+            mu_method, global_model, U_calibration, calibration, S_used, tau
+        )
+    else:
+        offsets = np.zeros(len(S_used))
+
+    for j, offset_j in zip(S_used, offsets):
+        N_j = N[j]
+        mu = mu_method['predict_group_mu_batch'](
+            model_global=global_model,
+            group_adjustment=offset_j,
+            X_matrix=calibration.group_X(j)[tau:],
+            u_group_vector=U_calibration[j, :]
+        )
+        n_tail = N_j - tau
+        score_blocks.append(np.abs(calibration.group_Y(j)[tau:] - mu))
+        group_weights.append(1.0 / (S_size * n_tail))
+
+    return GroupedWeightedQuantile(score_blocks, group_weights)
+
+
+def _donor_calibration(calibration, S_tilde, donor, tau, mu_method, model_cache):
+    """
+    Everything in HCP++ that depends on the donor but not on the test group:
+    the global model fitted on S_comp and the calibration scores, presorted
+    per group for the weighted quantile. With a model_cache, the scores are
+    kept in its score cache alongside the model.
+    """
+    K = calibration.n_groups
+    N = calibration.group_sizes
+    U_calibration = calibration.U
+
+    S_cal = np.sort(np.setdiff1d(S_tilde, [donor]))
+    S_size = len(S_cal) + 1  # calibration groups plus the test group
+
+    # Fit global model on complement of S (the test group is always in S,
+    # so S_comp only contains calibration groups)
+    S_comp = np.setdiff1d(list(range(K)), S_cal)
+    if len(S_comp) == 0:
+        global_model = None
+    else:
+        global_model = fit_global_model(
+            mu_method, U_calibration, calibration, list(S_comp), model_cache
+        )
+
+    def compute():
+        return _calibration_scores(calibration, S_cal, S_size, tau, global_model, mu_method)
+
+    # S_cal (and with it S_size) is determined by the model's S_comp
+    if model_cache is None or global_model is None:
+        calibration_quantile = compute()
+    else:
+        calibration_quantile = model_cache.scores.get_or_compute(
+            mu_method, calibration, global_model, tau, compute
+        )
+
+    return {
+        'global_model': global_model,
+        'S_size': S_size,
+        'N_donor': N[donor],
+        'calibration_quantile': calibration_quantile
+    }
+
+
+def _donor_interval(context, U_test, X_test, Y_test, o_observed, tau, alpha, mu_method):
+    """
+    Finish the HCP++ interval of one test group given its donor context.
+
+    Returns:
+    --------
+    tuple : (interval, mu_center)
+    """
+    global_model = context['global_model']
+    S_size = context['S_size']
+    scores = context['calibration_quantile']
+
+    # Test group
+    if tau > 0:
+        train_idx_test = list(range(tau))
+        offset_test = mu_method['fit_group_adjustment'](
+            model_global=global_model,
+            u_group_vector=U_test[0, :],
+            Z_group_list=GroupView(X_test, Y_test),
+            training_index_vector=train_idx_test
+        )
+    else:
+        offset_test = 0.0
+
+    # Calibration uses observations from index tau to o_observed-1
+    if o_observed > tau:
+        mu = mu_method['predict_group_mu_batch'](
+            model_global=global_model,
+            group_adjustment=offset_test,
+            X_matrix=X_test[tau:o_observed],
+            u_group_vector=U_test[0, :]
+        )
+        test_scores = np.abs(Y_test[tau:o_observed] - mu)
+    else:
+        test_scores = np.zeros(0)
+
+    n_tail_finite = len(test_scores)
+    n_inf = max(0, context['N_donor'] - o_observed)
+    n_total_test = n_tail_finite + n_inf
+
+    if n_total_test > 0:
+        # test scores and the n_inf infinite scores share one weight; the
+        # infinite scores form a single point mass
+        w_test = 1.0 / (S_size * n_total_test)
+        if n_tail_finite > 0:
+            scores = scores.with_group(test_scores, w_test)
+        if n_inf > 0:
+            scores = scores.with_point_mass(np.inf, n_inf * w_test)
+
+    q = scores.quantile(alpha)
+
+    X_target = X_test[o_observed]
+    mu_global_target = mu_method['predict_global'](
+        model_global=global_model,
+        x_vector=X_target,
+        u_vector=U_test[0, :]
+    )
+    mu_center = mu_global_target + offset_test
+    interval = symmetric_interval(mu_center, q)
+    return interval, mu_center
 
 
 def compute_hcp_plus_interval(U_calibration, Z_calibration, U_test, Z_test,
-                              o_observed, alpha, alpha_selection, mu_method):
+                              o_observed, alpha, alpha_selection, mu_method,
+                              model_cache=None, rng=None):
     """
     Compute HCP++ prediction interval.
 
@@ -20,52 +239,56 @@ def compute_hcp_plus_interval(U_calibration, Z_calibration, U_test, Z_test,
     -----------
     U_calibration : ndarray of shape (K, d)
         Group-level covariates for calibration groups
-    Z_calibration : list of lists
+    Z_calibration : GroupedData or list of lists
         Z_calibration[j] contains observations for calibration group j
     U_test : ndarray of shape (1, d)
         Group-level covariate for test group
-    Z_test : list
+    Z_test : GroupView or list
         Observations for test group
     o_observed : int
         Number of observed points in test group
-    alpha : float
-        Miscoverage level
+    alpha : float or array-like
+        Miscoverage level, or a vector of levels sharing models and scores
     alpha_selection : float
         Selection level for donor groups
     mu_method : dict
         μ-estimation method object
+    model_cache : GlobalModelCache, optional
+        Cache of global models fitted on calibration groups (see model_cache.py)
+    rng : numpy.random.Generator, optional
+        Random number generator (default: the global np.random state)
 
     Returns:
     --------
     dict with keys:
-        - 'interval': tuple (lower, upper)
+        - 'interval': tuple (lower, upper); arrays of bounds if alpha is a vector
+        - 'mu_hat': float
         - 'number_selected_groups': int
         - 'donor_group_index': int or None
     """
-    K = len(Z_calibration)
-    N = np.array([len(Z_calibration[j]) for j in range(K)])
-    test_idx = K  # 0-indexed
+    if rng is None:
+        rng = np.random
+    calibration = as_grouped_data(Z_calibration, U_calibration)
+    U_calibration = calibration.U
+    K = calibration.n_groups
+    N = calibration.group_sizes
 
-    U_all = np.vstack([U_calibration, U_test])
-    Z_all = Z_calibration + [Z_test]
+    X_test, Y_test = group_arrays(Z_test)
+    Z_test = GroupView(X_test, Y_test)
 
     if K == 0:
         # No calibration groups available - use standard CP on test group only
         # Split test group: first half for training, second half for calibration
-        N_test = len(Z_test)
+        N_test = len(Y_test)
         if N_test < (o_observed + 1):
             return {
-                'interval': (-np.inf, np.inf),
+                'interval': symmetric_interval(0.0, infinite_quantile(alpha)),
                 'mu_hat': 0.0,
                 'number_selected_groups': 0,
                 'donor_group_index': None
             }
 
-        tau = int(np.floor(o_observed / 2))
-        if tau < 0:
-            tau = 0
-        if o_observed > 0 and tau >= o_observed:
-            tau = o_observed - 1
+        tau = split_point(o_observed)
 
         # Fit model on test group training data (if available)
         if tau > 0:
@@ -90,27 +313,23 @@ def compute_hcp_plus_interval(U_calibration, Z_calibration, U_test, Z_test,
 
         # Compute scores on calibration portion
         if o_observed >= (tau + 1):
-            cal_idx = list(range(tau, o_observed))
-            scores = []
-            for i in cal_idx:
-                z = Z_test[i]
-                if global_model is not None:
-                    mu = mu_method['predict_group_mu'](
-                        model_global=global_model,
-                        group_adjustment=offset_test,
-                        x_vector=z['X'],
-                        u_group_vector=U_test[0, :]
-                    )
-                else:
-                    mu = 0.0
-                scores.append(np.abs(z['Y'] - mu))
+            if global_model is not None:
+                mu = mu_method['predict_group_mu_batch'](
+                    model_global=global_model,
+                    group_adjustment=offset_test,
+                    X_matrix=X_test[tau:o_observed],
+                    u_group_vector=U_test[0, :]
+                )
+            else:
+                mu = np.zeros(o_observed - tau)
+            scores = np.abs(Y_test[tau:o_observed] - mu)
             weights = np.ones(len(scores)) / len(scores)
             q = weighted_quantile(scores, weights, alpha)
         else:
-            q = np.inf
+            q = infinite_quantile(alpha)
 
         # Prediction
-        X_target = Z_test[o_observed]['X']
+        X_target = X_test[o_observed]
         if global_model is not None:
             mu_global_target = mu_method['predict_global'](
                 model_global=global_model,
@@ -121,7 +340,7 @@ def compute_hcp_plus_interval(U_calibration, Z_calibration, U_test, Z_test,
         else:
             mu_center = 0.0
 
-        interval = (-np.inf, np.inf) if np.isinf(q) else (mu_center - q, mu_center + q)
+        interval = symmetric_interval(mu_center, q)
 
         return {
             'interval': interval,
@@ -130,39 +349,19 @@ def compute_hcp_plus_interval(U_calibration, Z_calibration, U_test, Z_test,
             'donor_group_index': None
         }
 
-    N_test = len(Z_test)
+    N_test = len(Y_test)
     if N_test < (o_observed + 1):
         raise ValueError("compute_hcp_plus_interval: Z_test must have at least o+1 observations.")
 
-    # Compute empirical CDF and selection threshold
-    def Fhat_N(t):
-        return np.mean(N <= t)
-
-    p = min(1.0, Fhat_N(o_observed) + (1 - alpha_selection))
-
-    N_sorted = np.sort(N)
-    idx_V = max(0, int(np.ceil(p * K)) - 1)  # -1 for 0-indexing
-    V_o = N_sorted[idx_V]
-
-    # Select donor groups
-    S_tilde = np.where((N > o_observed) & (N <= V_o))[0]
-    if len(S_tilde) == 0:
-        S_tilde = np.where(N > o_observed)[0]
+    S_tilde = select_donor_groups(N, o_observed, alpha_selection)
 
     # Special case: no donor groups; use only test group
     if len(S_tilde) == 0:
-        global_model = mu_method['fit_global'](
-            U_matrix=U_calibration,
-            Z_list=Z_calibration,
-            group_index_vector=list(range(K))
+        global_model = fit_global_model(
+            mu_method, U_calibration, calibration, list(range(K)), model_cache
         )
 
-        # τ(o) = floor(o/2), with clamping
-        tau = int(np.floor(o_observed / 2))
-        if tau < 0:
-            tau = 0
-        if o_observed > 0 and tau >= o_observed:
-            tau = o_observed - 1
+        tau = split_point(o_observed)
 
         if tau > 0:
             train_idx = list(range(tau))
@@ -176,155 +375,145 @@ def compute_hcp_plus_interval(U_calibration, Z_calibration, U_test, Z_test,
             offset_test = 0.0
 
         if o_observed >= (tau + 1):
-            cal_idx = list(range(tau, o_observed))
-            scores = []
-            for i in cal_idx:
-                z = Z_test[i]
-                mu = mu_method['predict_group_mu'](
-                    model_global=global_model,
-                    group_adjustment=offset_test,
-                    x_vector=z['X'],
-                    u_group_vector=U_test[0, :]
-                )
-                scores.append(np.abs(z['Y'] - mu))
+            mu = mu_method['predict_group_mu_batch'](
+                model_global=global_model,
+                group_adjustment=offset_test,
+                X_matrix=X_test[tau:o_observed],
+                u_group_vector=U_test[0, :]
+            )
+            scores = np.abs(Y_test[tau:o_observed] - mu)
             weights = np.ones(len(scores)) / len(scores)
             q = weighted_quantile(scores, weights, alpha)
         else:
-            q = np.inf
+            q = infinite_quantile(alpha)
 
-        X_target = Z_test[o_observed]['X']
+        X_target = X_test[o_observed]
         mu_global_target = mu_method['predict_global'](
             model_global=global_model,
             x_vector=X_target,
             u_vector=U_test[0, :]
         )
         mu_center = mu_global_target + offset_test
-        interval = (-np.inf, np.inf) if np.isinf(q) else (mu_center - q, mu_center + q)
+        interval = symmetric_interval(mu_center, q)
 
         return {
             'interval': interval,
+            'mu_hat': mu_center,
             'number_selected_groups': 1,
             'donor_group_index': None
         }
 
     # Normal HCP++ path
-    donor = np.random.choice(S_tilde)
-    N_donor = N[donor]
+    donor = rng.choice(S_tilde)
+    tau = split_point(o_observed)
+    context = _donor_calibration(calibration, S_tilde, donor, tau, mu_method, model_cache)
+    interval, mu_center = _donor_interval(
+        context, U_test, X_test, Y_test, o_observed, tau, alpha, mu_method
+    )
 
-    S_cal = np.sort(np.setdiff1d(S_tilde, [donor]))
-    S = np.sort(np.concatenate([S_cal, [test_idx]]))
-    S_size = len(S)
+    return {
+        'interval': interval,
+        'mu_hat': mu_center,
+        'number_selected_groups': context['S_size'],
+        'donor_group_index': int(donor)
+    }
 
-    # τ(o): ALWAYS floor(o/2), with clamping
-    tau = int(np.floor(o_observed / 2))
-    if tau < 0:
-        tau = 0
-    if o_observed > 0 and tau >= o_observed:
-        tau = o_observed - 1
 
-    # Fit global model on complement of S
-    S_comp = np.setdiff1d(list(range(K + 1)), S)
-    if len(S_comp) == 0:
-        global_model = None
-    else:
-        global_model = mu_method['fit_global'](
-            U_matrix=U_all,
-            Z_list=Z_all,
-            group_index_vector=list(S_comp)
-        )
+def compute_hcp_plus_intervals(U_calibration, Z_calibration, U_test_matrix, Z_test_list,
+                               o_observed, alpha, alpha_selection, mu_method,
+                               model_cache=None, rng=None):
+    """
+    Compute HCP++ prediction intervals for many test groups at once.
+
+    The donor selection is done once, all donors are drawn up front (in test
+    group order) and test groups sharing a donor share the global model fit
+    and the calibration scores. The result equals calling
+    compute_hcp_plus_interval for each test group in turn only if the
+    μ-method's fit_global draws nothing from rng (or np.random when rng is
+    None), as for the OLS methods and the seeded Random Forests; the loop
+    draws each donor after the previous group's fit, so a fit that consumes
+    random numbers shifts the later donors. The intervals then still have
+    the same distribution, but not the same values.
 
-    scores = []
-    weights = []
+    Parameters:
+    -----------
+    U_calibration : ndarray of shape (K, d)
+        Group-level covariates for calibration groups
+    Z_calibration : GroupedData or list of lists
+        Z_calibration[j] contains observations for calibration group j
+    U_test_matrix : ndarray of shape (T, d)
+        Group-level covariates of the test groups (row t for test group t)
+    Z_test_list : list
+        Z_test_list[t] holds the observations of test group t (GroupView or
+        list); each needs at least o_observed + 1 observations
+    o_observed : int
+        Number of observed points in each test group
+    alpha : float or array-like
+        Miscoverage level, or a vector of levels sharing models and scores
+    alpha_selection : float
+        Selection level for donor groups
+    mu_method : dict
+        μ-estimation method object
+    model_cache : GlobalModelCache, optional
+        Cache of global models fitted on calibration groups (see model_cache.py)
+    rng : numpy.random.Generator, optional
+        Random number generator (default: the global np.random state)
 
-    # Calibration groups
-    for j in S_cal:
-        N_j = N[j]
-        # Calibration uses observations from index tau onwards
-        if N_j <= tau:
-            continue
+    Returns:
+    --------
+    ndarray of dtype hcp_plus_result_dtype(alpha) and shape (T,) with fields
+        lower, upper, mu_hat, number_selected_groups and donor_group_index
+        (-1 when no donor group is used); lower and upper have one entry per
+        level when alpha is a vector
+    """
+    if rng is None:
+        rng = np.random
+    calibration = as_grouped_data(Z_calibration, U_calibration)
+    U_test_matrix = np.asarray(U_test_matrix, dtype=float).reshape(len(Z_test_list), -1)
+    T = len(Z_test_list)
+    results = np.zeros(T, dtype=hcp_plus_result_dtype(alpha))
+
+    if calibration.n_groups > 0:
+        S_tilde = select_donor_groups(calibration.group_sizes, o_observed, alpha_selection)
+    else:
+        S_tilde = np.zeros(0, dtype=int)
 
-        if tau > 0:
-            train_idx = list(range(tau))
-            offset_j = mu_method['fit_group_adjustment'](
-                model_global=global_model,
-                u_group_vector=U_calibration[j, :],
-                Z_group_list=Z_calibration[j],
-                training_index_vector=train_idx
+    if len(S_tilde) == 0:
+        # No donor is drawn in these cases; defer to the single-group method
+        for t in range(T):
+            res = compute_hcp_plus_interval(
+                U_calibration=calibration.U,
+                Z_calibration=calibration,
+                U_test=U_test_matrix[t:t + 1],
+                Z_test=Z_test_list[t],
+                o_observed=o_observed,
+                alpha=alpha,
+                alpha_selection=alpha_selection,
+                mu_method=mu_method,
+                model_cache=model_cache,
+                rng=rng
             )
-        else:
-            offset_j = 0.0
-
-        idx_tail = list(range(tau, N_j))
-        for i in idx_tail:
-            z = Z_calibration[j][i]
-            mu = mu_method['predict_group_mu'](
-                model_global=global_model,
-                group_adjustment=offset_j,
-                x_vector=z['X'],
-                u_group_vector=U_calibration[j, :]
+            donor = res['donor_group_index']
+            results[t] = (res['interval'][0], res['interval'][1], res['mu_hat'],
+                          res['number_selected_groups'], -1 if donor is None else donor)
+        return results
+
+    tests = [group_arrays(Z_test) for Z_test in Z_test_list]
+    for X_test, Y_test in tests:
+        if len(Y_test) < (o_observed + 1):
+            raise ValueError("compute_hcp_plus_intervals: every test group must have at least o+1 observations.")
+
+    donors = np.array([rng.choice(S_tilde) for _ in range(T)], dtype=np.int64)
+    tau = split_point(o_observed)
+
+    for donor in np.unique(donors):
+        context = _donor_calibration(calibration, S_tilde, donor, tau, mu_method, model_cache)
+        for t in np.where(donors == donor)[0]:
+            X_test, Y_test = tests[t]
+            interval, mu_center = _donor_interval(
+                context, U_test_matrix[t:t + 1], X_test, Y_test,
+                o_observed, tau, alpha, mu_method
             )
-            scores.append(np.abs(z['Y'] - mu))
-
-        if len(idx_tail) > 0:
-            w_j = 1.0 / (S_size * len(idx_tail))
-            weights.extend([w_j] * len(idx_tail))
-
-    # Test group
-    if tau > 0:
-        train_idx_test = list(range(tau))
-        offset_test = mu_method['fit_group_adjustment'](
-            model_global=global_model,
-            u_group_vector=U_test[0, :],
-            Z_group_list=Z_test,
-            training_index_vector=train_idx_test
-        )
-    else:
-        offset_test = 0.0
-
-    # Calibration uses observations from index tau to o_observed-1
-    idx_tail_test = list(range(tau, o_observed)) if o_observed > tau else []
+            results[t] = (interval[0], interval[1], mu_center, context['S_size'], donor)
 
-    test_scores = []
-    for i in idx_tail_test:
-        z = Z_test[i]
-        mu = mu_method['predict_group_mu'](
-            model_global=global_model,
-            group_adjustment=offset_test,
-            x_vector=z['X'],
-            u_group_vector=U_test[0, :]
-        )
-        test_scores.append(np.abs(z['Y'] - mu))
-
-    n_tail_finite = len(test_scores)
-    n_inf = max(0, N_donor - o_observed)
-    n_total_test = n_tail_finite + n_inf
-
-    if n_total_test > 0:
-        w_test = 1.0 / (S_size * n_total_test)
-        if n_tail_finite > 0:
-            scores.extend(test_scores)
-            weights.extend([w_test] * n_tail_finite)
-        if n_inf > 0:
-            scores.extend([np.inf] * n_inf)
-            weights.extend([w_test] * n_inf)
-
-    if len(scores) == 0 or all(w <= 0 for w in weights):
-        q = np.inf
-    else:
-        q = weighted_quantile(scores, weights, alpha)
-
-    X_target = Z_test[o_observed]['X']
-    mu_global_target = mu_method['predict_global'](
-        model_global=global_model,
-        x_vector=X_target,
-        u_vector=U_test[0, :]
-    )
-    mu_center = mu_global_target + offset_test
-    interval = (-np.inf, np.inf) if np.isinf(q) else (mu_center - q, mu_center + q)
-
-    return {
-        'interval': interval,
-        'mu_hat': mu_center,
-        'number_selected_groups': S_size,
-        'donor_group_index': int(donor)
-    }
+    return results
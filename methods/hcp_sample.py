@@ -9,12 +9,17 @@ import numpy as np
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
-from scores import weighted_quantile
+from scores import weighted_quantile, infinite_quantile, symmetric_interval
+from grouped_data import GroupView, as_grouped_data, group_arrays
+from methods.model_cache import fit_global_model
+from methods.mu_methods import fit_group_adjustments
+from methods.hcp_plus import compute_hcp_plus_interval, select_donor_groups, split_point
 
 
 def compute_hcp_sample_interval(U_calibration, Z_calibration, U_test, Z_test,
                                 o_observed, alpha, test_index_target,
-                                alpha_selection, mu_method):
+                                alpha_selection, mu_method, model_cache=None,
+                                rng=None):
     """
     Compute HCP.sample prediction interval.
 
@@ -22,75 +27,72 @@ def compute_hcp_sample_interval(U_calibration, Z_calibration, U_test, Z_test,
     -----------
     U_calibration : ndarray of shape (K, d)
         Group-level covariates for calibration groups
-    Z_calibration : list of lists
+    Z_calibration : GroupedData or list of lists
         Z_calibration[j] contains observations for calibration group j
     U_test : ndarray of shape (1, d)
         Group-level covariate for test group
-    Z_test : list
+    Z_test : GroupView or list
         Observations for test group
     o_observed : int
         Number of observed points in test group
-    alpha : float
-        Miscoverage level
+    alpha : float or array-like
+        Miscoverage level, or a vector of levels sharing models and scores
     test_index_target : int
         Index of target observation in test group (0-indexed)
     alpha_selection : float
         Selection level for donor groups
     mu_method : dict
         μ-estimation method object
+    model_cache : GlobalModelCache, optional
+        Cache of global models fitted on calibration groups (see model_cache.py)
+    rng : numpy.random.Generator, optional
+        Random number generator (default: the global np.random state)
 
     Returns:
     --------
     dict with keys:
-        - 'interval': tuple (lower, upper)
+        - 'interval': tuple (lower, upper); arrays of bounds if alpha is a vector
         - 'number_selected_groups': int
     """
-    K = len(Z_calibration)
-    N = np.array([len(Z_calibration[j]) for j in range(K)])
+    if rng is None:
+        rng = np.random
+    calibration = as_grouped_data(Z_calibration, U_calibration)
+    U_calibration = calibration.U
+    K = calibration.n_groups
+    N = calibration.group_sizes
     test_idx = K  # 0-indexed
 
-    U_all = np.vstack([U_calibration, U_test])
-    Z_all = Z_calibration + [Z_test]
+    X_test, Y_test = group_arrays(Z_test)
+    Z_test = GroupView(X_test, Y_test)
 
     if K == 0:
         return {
-            'interval': (-np.inf, np.inf),
+            'interval': symmetric_interval(0.0, infinite_quantile(alpha)),
             'mu_hat': 0.0,
             'number_selected_groups': 0
         }
 
-    N_test = len(Z_test)
+    N_test = len(Y_test)
     if N_test < (o_observed + 1):
         raise ValueError("compute_hcp_sample_interval: Z_test must have at least o+1 observations.")
 
-    # Compute empirical CDF and selection threshold
-    def Fhat_N(t):
-        return np.mean(N <= t)
-
-    p = min(1.0, Fhat_N(o_observed) + (1 - alpha_selection))
-
-    N_sorted = np.sort(N)
-    idx_V = max(0, int(np.ceil(p * K)) - 1)  # -1 for 0-indexing
-    V_o = N_sorted[idx_V]
-
     # Select groups
-    S_tilde = np.where((N > o_observed) & (N <= V_o))[0]
-    if len(S_tilde) == 0:
-        S_tilde = np.where(N > o_observed)[0]
+    S_tilde = select_donor_groups(N, o_observed, alpha_selection)
 
     # Special case: no donor groups available
     if len(S_tilde) == 0:
         # Fall back to HCP++ logic
-        from .hcp_plus import compute_hcp_plus_interval
         res_pp = compute_hcp_plus_interval(
             U_calibration=U_calibration,
-            Z_calibration=Z_calibration,
+            Z_calibration=calibration,
             U_test=U_test,
             Z_test=Z_test,
             o_observed=o_observed,
             alpha=alpha,
             alpha_selection=alpha_selection,
-            mu_method=mu_method
+            mu_method=mu_method,
+            model_cache=model_cache,
+            rng=rng
         )
         return {
             'interval': res_pp['interval'],
@@ -101,22 +103,16 @@ def compute_hcp_sample_interval(U_calibration, Z_calibration, U_test, Z_test,
     S = np.sort(np.concatenate([S_tilde, [test_idx]]))
     S_size = len(S)
 
-    # τ(o): ALWAYS floor(o/2), with clamping
-    tau = int(np.floor(o_observed / 2))
-    if tau < 0:
-        tau = 0
-    if o_observed > 0 and tau >= o_observed:
-        tau = o_observed - 1
+    tau = split_point(o_observed)
 
-    # Fit global model on complement of S
+    # Fit global model on complement of S (the test group is always in S,
+    # so S_comp only contains calibration groups)
     S_comp = np.setdiff1d(list(range(K + 1)), S)
     if len(S_comp) == 0:
         global_model = None
     else:
-        global_model = mu_method['fit_global'](
-            U_matrix=U_all,
-            Z_list=Z_all,
-            group_index_vector=list(S_comp)
+        global_model = fit_global_model(
+            mu_method, U_calibration, calibration, list(S_comp), model_cache
         )
 
     n_slots = o_observed + 1 - tau
@@ -124,45 +120,42 @@ def compute_hcp_sample_interval(U_calibration, Z_calibration, U_test, Z_test,
 
     values = []
     weights = []
+    point_masses = []
     offset_test = 0.0
 
+    # Calibration groups (S is sorted, so they come before the test group):
+    # sample o_observed + 1 observations of each without replacement, the
+    # first tau of them for the offset
+    S_used = np.array([j for j in S if j < K and N[j] >= (o_observed + 1)], dtype=np.int64)
+    samples = np.array(
+        [rng.choice(N[j], size=o_observed + 1, replace=False) for j in S_used], dtype=np.int64
+    ).reshape(len(S_used), o_observed + 1)
+    if tau > 0 and len(S_used) > 0:
+        offsets = fit_group_adjustments(
+            mu_method, global_model, U_calibration, calibration, S_used, samples[:, :tau]
+        )
+    else:
+        offsets = np.zeros(len(S_used))
+    calibration_samples = {int(j): (Tj, offset_j) for j, Tj, offset_j in zip(S_used, samples, offsets)}
+
     for j in S:
         if j < K:
             # Calibration group
-            Uj = U_calibration[j, :]
-            Zj = Z_calibration[j]
-            Nj = N[j]
-            if Nj < (o_observed + 1):
+            if j not in calibration_samples:
                 continue
-
-            # Sample o_observed + 1 observations without replacement
-            Tj = np.random.choice(Nj, size=o_observed + 1, replace=False)
-
-            if tau > 0:
-                Tj_train = Tj[:tau]
-                Tj_cal = Tj[tau:(o_observed + 1)]
-                offset_j = mu_method['fit_group_adjustment'](
-                    model_global=global_model,
-                    u_group_vector=Uj,
-                    Z_group_list=Zj,
-                    training_index_vector=list(Tj_train)
-                )
-            else:
-                Tj_train = []
-                Tj_cal = Tj[0:(o_observed + 1)]
-                offset_j = 0.0
-
-            for i_idx in Tj_cal:
-                z = Zj[i_idx]
-                mu = mu_method['predict_group_mu'](
-                    model_global=global_model,
-                    group_adjustment=offset_j,
-                    x_vector=z['X'],
-                    u_group_vector=Uj
-                )
-                s = np.abs(z['Y'] - mu)
-                values.append(s)
-                weights.append(w_slot)
+            Uj = U_calibration[j, :]
+            Zj = calibration[j]
+            Tj, offset_j = calibration_samples[j]
+            Tj_cal = Tj[tau:(o_observed + 1)]
+
+            mu = mu_method['predict_group_mu_batch'](
+                model_global=global_model,
+                group_adjustment=offset_j,
+                X_matrix=Zj.X[Tj_cal],
+                u_group_vector=Uj
+            )
+            values.extend(np.abs(Zj.Y[Tj_cal] - mu))
+            weights.extend([w_slot] * len(Tj_cal))
 
         else:
             # Test group
@@ -174,7 +167,7 @@ def compute_hcp_sample_interval(U_calibration, Z_calibration, U_test, Z_test,
 
             if tau > 0:
                 # Sample tau training indices from the o observed points
-                Tj_train = np.random.choice(o_observed, size=tau, replace=False)
+                Tj_train = rng.choice(o_observed, size=tau, replace=False)
                 Tj_cal = np.setdiff1d(list(range(o_observed)), Tj_train)
                 offset_test = mu_method['fit_group_adjustment'](
                     model_global=global_model,
@@ -187,32 +180,29 @@ def compute_hcp_sample_interval(U_calibration, Z_calibration, U_test, Z_test,
                 Tj_cal = list(range(o_observed))
                 offset_test = 0.0
 
-            for i_idx in Tj_cal:
-                z = Zj[i_idx]
-                mu = mu_method['predict_group_mu'](
-                    model_global=global_model,
-                    group_adjustment=offset_test,
-                    x_vector=z['X'],
-                    u_group_vector=Uj
-                )
-                s = np.abs(z['Y'] - mu)
-                values.append(s)
-                weights.append(w_slot)
+            Tj_cal = np.asarray(Tj_cal, dtype=int)
+            mu = mu_method['predict_group_mu_batch'](
+                model_global=global_model,
+                group_adjustment=offset_test,
+                X_matrix=Zj.X[Tj_cal],
+                u_group_vector=Uj
+            )
+            values.extend(np.abs(Zj.Y[Tj_cal] - mu))
+            weights.extend([w_slot] * len(Tj_cal))
 
-            # Add infinity
-            values.append(np.inf)
-            weights.append(w_slot)
+            # Add infinity (as a point mass)
+            point_masses.append((np.inf, w_slot))
 
-    if len(values) == 0:
+    if len(values) == 0 and len(point_masses) == 0:
         return {
-            'interval': (-np.inf, np.inf),
+            'interval': symmetric_interval(0.0, infinite_quantile(alpha)),
             'mu_hat': 0.0,
             'number_selected_groups': S_size
         }
 
-    q = weighted_quantile(values, weights, alpha)
+    q = weighted_quantile(values, weights, alpha, point_masses=point_masses)
 
-    X_target = Z_test[test_index_target]['X']
+    X_target = X_test[test_index_target]
     mu_global = mu_method['predict_global'](
         model_global=global_model,
         x_vector=X_target,
@@ -220,10 +210,7 @@ def compute_hcp_sample_interval(U_calibration, Z_calibration, U_test, Z_test,
     )
     mu_center = mu_global + offset_test
 
-    if np.isinf(q):
-        interval = (-np.inf, np.inf)
-    else:
-        interval = (mu_center - q, mu_center + q)
+    interval = symmetric_interval(mu_center, q)
 
     return {
         'interval': interval,
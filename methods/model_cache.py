@@ -0,0 +1,289 @@
+"""
+Global-Model Cache
+
+The global model of HCP++ and HCP.sample depends only on the calibration data,
+the μ-method and the set S_comp of calibration groups it is fitted on; it never
+depends on the observations of the test group. This module provides a bounded
+LRU cache so that repeated intervals (e.g. many test groups evaluated against
+the same calibration data) reuse the fitted model instead of refitting it.
+
+The calibration scores of HCP++ (|Y - μ_global - offset_j| on the tail
+indices of the calibration groups, sorted per group) likewise depend only on
+the global model and the split point tau. Each GlobalModelCache carries a
+ScoreCache that keeps them across test groups; its entries are dropped
+together with their model.
+"""
+
+import numpy as np
+import pickle
+import sys
+from collections import OrderedDict
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+from grouped_data import as_grouped_data
+
+
+def estimate_model_nbytes(model):
+    """
+    Approximate memory footprint of a fitted global model in bytes.
+
+    Tree ensembles are sized from their node arrays; anything else falls back
+    to the length of its pickle.
+    """
+    if model is None:
+        return 0
+    estimators = getattr(model, 'estimators_', None)
+    if estimators is not None:
+        total = 0
+        for est in np.ravel(estimators):
+            tree = getattr(est, 'tree_', None)
+            if tree is None:
+                return len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+            # node record (children, feature, threshold, impurity, counts)
+            # plus the per-node value array
+            total += tree.node_count * (64 + 8 * tree.n_outputs * int(np.max(tree.n_classes)))
+        return total
+    try:
+        return len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 0
+
+
+def estimate_scores_nbytes(value):
+    """
+    Approximate memory footprint of cached calibration scores in bytes: the
+    sorted per-group blocks.
+    """
+    blocks = getattr(value, 'sorted_blocks', None)
+    if blocks is None:
+        return 0
+    return sum(block.nbytes for block in blocks)
+
+
+class ScoreCache:
+    """
+    Bounded LRU cache of calibration scores derived from a global model.
+
+    Entries are keyed by (calibration-data fingerprint, μ-method, id of the
+    global model, tau). Every entry keeps a reference to its model, so the id
+    cannot be reused while the entry is alive, and a lookup only hits if the
+    cached model is the very model passed in.
+
+    Parameters:
+    -----------
+    max_entries : int or None
+        Maximum number of cached score sets (default: 256; None for no limit)
+    max_bytes : int or None
+        Maximum total estimated size in bytes (None for no limit)
+
+    Attributes:
+    -----------
+    hits : int
+        Number of lookups answered from the cache
+    misses : int
+        Number of lookups that required computing the scores
+    """
+
+    def __init__(self, max_entries=256, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_compute(self, mu_method, calibration, global_model, tau, compute):
+        """
+        Return the cached scores of (calibration, mu_method, global_model, tau)
+        or compute() them (and cache them).
+        """
+        key = (
+            calibration.fingerprint(),
+            mu_method['predict_group_mu_batch'],
+            id(global_model),
+            int(tau)
+        )
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is global_model:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+        self.misses += 1
+        value = compute()
+        if entry is not None:
+            self.nbytes -= entry[2]
+        size = estimate_scores_nbytes(value)
+        self._entries[key] = (global_model, value, size)
+        self._entries.move_to_end(key)
+        self.nbytes += size
+        self._evict()
+        return value
+
+    def discard_model(self, global_model):
+        """Drop the entries computed from global_model."""
+        for key in [k for k, entry in self._entries.items() if entry[0] is global_model]:
+            self.nbytes -= self._entries.pop(key)[2]
+
+    def _evict(self):
+        # keep at least the most recent entry even if it alone exceeds max_bytes
+        while len(self._entries) > 1 and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+        ):
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self.nbytes -= size
+
+    def clear(self):
+        """Drop all cached scores (counters are kept)."""
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """Dictionary with hits, misses, hit_rate, entries and nbytes."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+            'entries': len(self._entries),
+            'nbytes': self.nbytes
+        }
+
+
+class GlobalModelCache:
+    """
+    Bounded LRU cache of fitted global models.
+
+    Entries are keyed by (calibration-data fingerprint, μ-method, S_comp) where
+    the μ-method is identified by its fit_global function and S_comp is the
+    frozenset of calibration groups the model is fitted on.
+
+    Parameters:
+    -----------
+    max_entries : int or None
+        Maximum number of cached models (default: 64; None for no limit)
+    max_bytes : int or None
+        Maximum total estimated size of cached models in bytes (None for no limit)
+    max_score_entries : int or None
+        Maximum number of cached calibration score sets (default: 256)
+    max_score_bytes : int or None
+        Maximum total estimated size of cached scores in bytes (None for no limit)
+
+    Attributes:
+    -----------
+    hits : int
+        Number of lookups answered from the cache
+    misses : int
+        Number of lookups that required a fit
+    scores : ScoreCache
+        Calibration scores derived from the cached models
+    """
+
+    def __init__(self, max_entries=64, max_bytes=None, max_score_entries=256,
+                 max_score_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self.scores = ScoreCache(max_entries=max_score_entries, max_bytes=max_score_bytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(mu_method, calibration, group_index_vector):
+        """Cache key of a fit of mu_method on the given groups of calibration."""
+        return (
+            calibration.fingerprint(),
+            mu_method['fit_global'],
+            frozenset(int(j) for j in np.ravel(group_index_vector))
+        )
+
+    def get_or_fit(self, mu_method, U_matrix, Z_list, group_index_vector):
+        """
+        Return the cached global model or fit (and cache) it.
+
+        Parameters:
+        -----------
+        mu_method : dict
+            μ-estimation method object
+        U_matrix : ndarray of shape (K, d)
+            Group-level covariates of the calibration groups
+        Z_list : GroupedData or list of lists
+            Calibration observations
+        group_index_vector : array-like of int
+            Groups to fit on (0-indexed)
+
+        Returns:
+        --------
+        Fitted global model (or None, as returned by fit_global)
+        """
+        calibration = as_grouped_data(Z_list, U_matrix)
+        key = self.key(mu_method, calibration, group_index_vector)
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+        self.misses += 1
+        model = mu_method['fit_global'](
+            U_matrix=calibration.U,
+            Z_list=calibration,
+            group_index_vector=list(group_index_vector)
+        )
+        size = estimate_model_nbytes(model)
+        self._entries[key] = (model, size)
+        self.nbytes += size
+        self._evict()
+        return model
+
+    def _evict(self):
+        # keep at least the most recent entry even if it alone exceeds max_bytes
+        while len(self._entries) > 1 and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+        ):
+            _, (model, size) = self._entries.popitem(last=False)
+            self.nbytes -= size
+            self.scores.discard_model(model)
+
+    def clear(self):
+        """Drop all cached models and scores (counters are kept)."""
+        self._entries.clear()
+        self.nbytes = 0
+        self.scores.clear()
+
+    def stats(self):
+        """
+        Dictionary with hits, misses, hit_rate, entries and nbytes of the
+        models, and the same counters of the score cache prefixed 'score_'.
+        """
+        lookups = self.hits + self.misses
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+            'entries': len(self._entries),
+            'nbytes': self.nbytes
+        }
+        stats.update({f'score_{name}': value for name, value in self.scores.stats().items()})
+        return stats
+
+
+def fit_global_model(mu_method, U_matrix, Z_list, group_index_vector, model_cache=None):
+    """
+    Fit a global model, going through model_cache when one is given.
+    """
+    if model_cache is None:
+        return mu_method['fit_global'](
+            U_matrix=U_matrix,
+            Z_list=Z_list,
+            group_index_vector=list(group_index_vector)
+        )
+    return model_cache.get_or_fit(mu_method, U_matrix, Z_list, group_index_vector)
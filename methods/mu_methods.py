@@ -3,14 +3,152 @@ Mu-Estimation Method Objects (Random Forest + Offset + OLS)
 
 This module defines methods for estimating the conditional mean function μ(X, U)
 using Random Forest models or OLS with group-specific offsets.
+
+The group-bagged Random Forest trains one forest per calibration data set in
+which every tree sees a random subset of the groups; a global model fitted on
+a subset of groups is the average of the trees whose groups all lie in that
+subset, so HCP++ masks trees instead of refitting for every donor choice.
 """
 
 import numpy as np
+import sys
+import warnings
+from collections import OrderedDict
+from pathlib import Path
+from joblib import Parallel, delayed
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.linear_model import LinearRegression
+from sklearn.tree import DecisionTreeRegressor
+sys.path.append(str(Path(__file__).parent.parent))
+from grouped_data import as_grouped_data, group_arrays
+from resources import rf_n_jobs
+
+
+def _predict_batch(model_global, X_matrix, u_vector):
+    """
+    Predict a fitted global model on all rows of X_matrix sharing one group covariate u.
+
+    Returns an array of shape (m,); zeros if there is no model.
+    """
+    X_mat = np.asarray(X_matrix, dtype=float)
+    if X_mat.ndim == 1:
+        X_mat = X_mat.reshape(1, -1)
+    m = X_mat.shape[0]
+    if model_global is None or m == 0:
+        return np.zeros(m)
+
+    u = np.asarray(u_vector, dtype=float).ravel()
+    feats = np.empty((m, X_mat.shape[1] + u.shape[0]), dtype=float)
+    feats[:, :X_mat.shape[1]] = X_mat
+    feats[:, X_mat.shape[1]:] = u
+    return np.asarray(model_global.predict(feats), dtype=float).ravel()
+
+
+def _training_rows(data, groups, training_index):
+    """
+    Rows (into data.X / data.Y) of the training observations of each group,
+    stacked group by group, and the number of rows of each group.
+
+    training_index is either tau (the first min(tau, N_j) observations of
+    every group) or an integer array of shape (G, t) holding the within-group
+    indices of each of the G groups.
+    """
+    starts = data.offsets[groups]
+    if np.ndim(training_index) == 0:
+        counts = np.minimum(int(training_index), data.offsets[groups + 1] - starts)
+        counts = np.maximum(counts, 0)
+        # arange within each group shifted to the group start
+        shift = np.repeat(starts - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+        return np.arange(int(counts.sum()), dtype=np.int64) + shift, counts
 
+    pattern = np.asarray(training_index, dtype=np.int64).reshape(groups.shape[0], -1)
+    counts = np.full(groups.shape[0], pattern.shape[1], dtype=np.int64)
+    return (starts[:, None] + pattern).ravel(), counts
 
-def create_mu_method_random_forest_offset(ntree=50, mtry=None, nodesize=5, random_state=123):
+
+def _mean_residual_offsets(model_global, data, group_index_vector, training_index):
+    """
+    Offsets mean(Y - mu_global) over the training observations of many groups
+    with one global prediction and one segment sum (np.add.reduceat).
+
+    Returns an array with one offset per group (0.0 for groups without
+    training observations).
+    """
+    groups = np.asarray(group_index_vector, dtype=np.int64).ravel()
+    rows, counts = _training_rows(data, groups, training_index)
+    offsets = np.zeros(groups.shape[0])
+    if rows.shape[0] == 0:
+        return offsets
+
+    residuals = np.asarray(data.Y[rows], dtype=float)
+    if model_global is not None:
+        feats = np.empty((rows.shape[0], data.n_features + data.U.shape[1]), dtype=float)
+        feats[:, :data.n_features] = data.X[rows]
+        feats[:, data.n_features:] = np.repeat(data.U[groups], counts, axis=0)
+        residuals = residuals - np.asarray(model_global.predict(feats), dtype=float).ravel()
+
+    nonempty = counts > 0
+    segment_starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+    offsets[nonempty] = np.add.reduceat(residuals, segment_starts) / counts[nonempty]
+    return offsets
+
+
+def fit_group_adjustments(mu_method, model_global, U_matrix, Z_list, group_index_vector,
+                          training_index):
+    """
+    Group adjustments of many calibration groups at once.
+
+    Uses the mu-method's fit_group_adjustments_all when it has one and calls
+    fit_group_adjustment once per group otherwise.
+
+    Parameters:
+    -----------
+    mu_method : dict
+        μ-estimation method object
+    model_global : object
+        Fitted global model
+    U_matrix : ndarray of shape (K, d)
+        Group-level covariates
+    Z_list : GroupedData or list of lists
+        Observations of the groups
+    group_index_vector : array-like of int
+        Groups to fit (0-indexed)
+    training_index : int or ndarray of shape (G, t)
+        tau (the first tau observations of every group) or the within-group
+        training indices of each selected group
+
+    Returns:
+    --------
+    ndarray : One adjustment per selected group
+    """
+    data = as_grouped_data(Z_list, U_matrix)
+    groups = np.asarray(group_index_vector, dtype=np.int64).ravel()
+    if "fit_group_adjustments_all" in mu_method:
+        return mu_method["fit_group_adjustments_all"](
+            model_global=model_global,
+            U_matrix=data.U,
+            Z_list=data,
+            group_index_vector=groups,
+            training_index=training_index
+        )
+
+    adjustments = np.zeros(groups.shape[0])
+    for i, j in enumerate(groups):
+        if np.ndim(training_index) == 0:
+            train_idx = list(range(min(int(training_index), data.group_sizes[j])))
+        else:
+            train_idx = list(np.asarray(training_index)[i])
+        adjustments[i] = mu_method["fit_group_adjustment"](
+            model_global=model_global,
+            u_group_vector=data.U[j, :],
+            Z_group_list=data[j],
+            training_index_vector=train_idx
+        )
+    return adjustments
+
+
+def create_mu_method_random_forest_offset(ntree=50, mtry=None, nodesize=5, random_state=123,
+                                          n_jobs=None):
     """
     Create a mu-estimation method using Random Forest with group-specific offsets.
 
@@ -27,6 +165,9 @@ def create_mu_method_random_forest_offset(ntree=50, mtry=None, nodesize=5, rando
         Minimum samples per leaf.
     random_state : int
         Seed for reproducibility.
+    n_jobs : int or None
+        Threads per fit; None takes the Random Forest budget from
+        resources.configure_resources at fit time (all cores by default).
 
     Returns
     -------
@@ -34,14 +175,6 @@ def create_mu_method_random_forest_offset(ntree=50, mtry=None, nodesize=5, rando
         Method object with fit/predict functions.
     """
 
-    def _stack_group_features(U_group, Z_group):
-        """
-        Build feature matrix for one group: [X | repeated U].
-        """
-        X_mat = np.asarray([z["X"] for z in Z_group], dtype=float)
-        U_rep = np.repeat(np.asarray(U_group, dtype=float).reshape(1, -1), X_mat.shape[0], axis=0)
-        return np.hstack([X_mat, U_rep])
-
     def fit_global(U_matrix, Z_list, group_index_vector):
         """
         Fit global Random Forest on pooled data from selected groups (0-indexed).
@@ -49,45 +182,28 @@ def create_mu_method_random_forest_offset(ntree=50, mtry=None, nodesize=5, rando
         if len(group_index_vector) == 0:
             return None
 
-        # infer dimensions
-        first_g = group_index_vector[0]
-        p_X = len(Z_list[first_g][0]["X"])
-        d_U = int(np.asarray(U_matrix).shape[1])
-        p_total = p_X + d_U
+        data = as_grouped_data(Z_list, U_matrix)
+        p_total = data.n_features + data.U.shape[1]
 
         local_mtry = mtry
         if local_mtry is None:
             local_mtry = max(1, int(np.sqrt(p_total)))
 
-        X_blocks = []
-        y_blocks = []
-
-        for g in group_index_vector:
-            U_g = U_matrix[g, :]
-            Z_g = Z_list[g]
-            if len(Z_g) == 0:
-                continue
-
-            Xg = _stack_group_features(U_g, Z_g)
-            yg = np.asarray([z["Y"] for z in Z_g], dtype=float)
-
-            X_blocks.append(Xg)
-            y_blocks.append(yg)
-
-        if len(X_blocks) == 0:
+        X_train, y_train = data.design(group_index_vector)
+        if X_train.shape[0] == 0:
             return None
 
-        X_train = np.vstack(X_blocks)
-        y_train = np.concatenate(y_blocks)
-
         rf = RandomForestRegressor(
             n_estimators=ntree,
             max_features=local_mtry,
             min_samples_leaf=nodesize,
             random_state=random_state,
-            n_jobs=-1,  # parallelize within RF (optional; remove if you prefer)
+            n_jobs=rf_n_jobs(n_jobs),
         )
         rf.fit(X_train, y_train)
+        # Threaded prediction sums the trees in completion order, which makes
+        # predictions depend on the thread budget; predict serially instead
+        rf.set_params(n_jobs=1)
         return rf
 
     def predict_global(model_global, x_vector, u_vector):
@@ -102,6 +218,12 @@ def create_mu_method_random_forest_offset(ntree=50, mtry=None, nodesize=5, rando
         feats = np.concatenate([x, u]).reshape(1, -1)
         return float(model_global.predict(feats)[0])
 
+    def predict_global_batch(model_global, X_matrix, u_vector):
+        """
+        Predict using the global model on every row of X_matrix (one group's u).
+        """
+        return _predict_batch(model_global, X_matrix, u_vector)
+
     def fit_group_adjustment(model_global, u_group_vector, Z_group_list, training_index_vector):
         """
         Fit group-specific offset = mean(Y - mu_global) over training indices (0-indexed).
@@ -109,63 +231,323 @@ def create_mu_method_random_forest_offset(ntree=50, mtry=None, nodesize=5, rando
         if len(training_index_vector) == 0:
             return 0.0
 
-        idx = list(training_index_vector)
-        y_train = np.asarray([Z_group_list[i]["Y"] for i in idx], dtype=float)
+        idx = np.asarray(training_index_vector, dtype=int)
+        X_group, Y_group = group_arrays(Z_group_list)
+        y_train = Y_group[idx]
 
         # vectorized prediction on the selected indices
-        X_sel = np.asarray([Z_group_list[i]["X"] for i in idx], dtype=float)
-        u = np.asarray(u_group_vector, dtype=float).ravel()
-        U_rep = np.repeat(u.reshape(1, -1), X_sel.shape[0], axis=0)
-        feats = np.hstack([X_sel, U_rep])
-
-        mu_global = 0.0 if model_global is None else model_global.predict(feats)
-        mu_global = np.asarray(mu_global, dtype=float).ravel()
+        mu_global = _predict_batch(model_global, X_group[idx], u_group_vector)
 
         return float(np.mean(y_train - mu_global))
 
+    def fit_group_adjustments_all(model_global, U_matrix, Z_list, group_index_vector,
+                                  training_index):
+        """
+        Offsets of many groups in one pass (see fit_group_adjustments).
+        """
+        data = as_grouped_data(Z_list, U_matrix)
+        return _mean_residual_offsets(model_global, data, group_index_vector, training_index)
+
     def predict_group_mu(model_global, group_adjustment, x_vector, u_group_vector):
         """
         Predict using global model + group adjustment.
         """
         return predict_global(model_global, x_vector, u_group_vector) + float(group_adjustment)
 
+    def predict_group_mu_batch(model_global, group_adjustment, X_matrix, u_group_vector):
+        """
+        Predict global model + group adjustment on every row of X_matrix.
+        """
+        return predict_global_batch(model_global, X_matrix, u_group_vector) + float(group_adjustment)
+
     return {
         "fit_global": fit_global,
         "predict_global": predict_global,
+        "predict_global_batch": predict_global_batch,
         "fit_group_adjustment": fit_group_adjustment,
+        "fit_group_adjustments_all": fit_group_adjustments_all,
         "predict_group_mu": predict_group_mu,
+        "predict_group_mu_batch": predict_group_mu_batch,
+        # the group adjustment is mean(Y - mu_global) over the training
+        # indices (lets the online HCP++ engine maintain it incrementally)
+        "group_adjustment_type": "mean_residual",
     }
 
 
-def create_mu_method_random_forest_global_only(ntree=50, mtry=None, nodesize=5, random_state=123):
+def create_mu_method_random_forest_global_only(ntree=50, mtry=None, nodesize=5, random_state=123,
+                                               n_jobs=None):
     """
     Create a mu-estimation method using only a global Random Forest (no group offsets).
     """
     base = create_mu_method_random_forest_offset(
-        ntree=ntree, mtry=mtry, nodesize=nodesize, random_state=random_state
+        ntree=ntree, mtry=mtry, nodesize=nodesize, random_state=random_state,
+        n_jobs=n_jobs
     )
 
     def fit_group_adjustment(model_global, u_group_vector, Z_group_list, training_index_vector):
         return 0.0
 
+    def fit_group_adjustments_all(model_global, U_matrix, Z_list, group_index_vector,
+                                  training_index):
+        return np.zeros(np.asarray(group_index_vector).size)
+
     def predict_group_mu(model_global, group_adjustment, x_vector, u_group_vector):
         return base["predict_global"](model_global, x_vector, u_group_vector)
 
+    def predict_group_mu_batch(model_global, group_adjustment, X_matrix, u_group_vector):
+        return base["predict_global_batch"](model_global, X_matrix, u_group_vector)
+
     base["fit_group_adjustment"] = fit_group_adjustment
+    base["fit_group_adjustments_all"] = fit_group_adjustments_all
     base["predict_group_mu"] = predict_group_mu
+    base["predict_group_mu_batch"] = predict_group_mu_batch
+    base["group_adjustment_type"] = "none"
     return base
 
 
-def create_mu_method_ols_offset():
+class _DataCache:
+    """
+    Per-data-set cache held by a μ-method closure, keyed on
+    GroupedData.fingerprint(): the fresh GroupedData that as_grouped_data
+    builds for every list input or U override of the same calibration data
+    hits the same entry. Bounded LRU of max_entries data sets; the cache
+    pickles as empty so μ-methods can be shipped to worker processes.
+    """
+
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, data):
+        key = data.fingerprint()
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, data, value):
+        self._entries[data.fingerprint()] = value
+        self._entries.move_to_end(data.fingerprint())
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __reduce__(self):
+        return (_DataCache, (self.max_entries,))
+
+
+def _ols_group_statistics(data):
+    """
+    Per-group centered sufficient statistics of the OLS features [X | U] and Y.
+
+    The U block is constant within a group, so only the X block of each
+    group's centered Gram matrix is non-zero.
+
+    Returns:
+    --------
+    dict
+        'n' (K,), 'mean_f' (K, q), 'mean_y' (K,), 'Sxx' (K, p, p), 'Sxy' (K, p)
+        with q = p + d the number of OLS features.
+    """
+    K = data.n_groups
+    p = data.n_features
+    n = data.group_sizes.astype(float)
+
+    mean_x = np.zeros((K, p))
+    mean_y = np.zeros(K)
+    Sxx = np.zeros((K, p, p))
+    Sxy = np.zeros((K, p))
+    for j in range(K):
+        if n[j] == 0:
+            continue
+        X_j = data.group_X(j)
+        Y_j = data.group_Y(j)
+        mean_x[j] = X_j.mean(axis=0)
+        mean_y[j] = Y_j.mean()
+        Xc = X_j - mean_x[j]
+        Sxx[j] = Xc.T @ Xc
+        Sxy[j] = Xc.T @ (Y_j - mean_y[j])
+
+    return {
+        'n': n,
+        'mean_f': np.hstack([mean_x, data.U]),
+        'mean_y': mean_y,
+        'Sxx': Sxx,
+        'Sxy': Sxy,
+    }
+
+
+def _ols_pooled_moments(stats, groups):
+    """
+    Count, means and centered cross-products of the features [X | U] and Y on
+    the union of the given groups, combined from their sufficient statistics.
+
+    Between-group terms are added with the pairwise (Chan et al.) update, so the
+    pooled centered Gram matrix is formed without catastrophic cancellation.
+
+    Returns:
+    --------
+    tuple : (n, mean_f (q,), mean_y, Sff (q, q), Sfy (q,))
+    """
+    n_g = stats['n'][groups]
+    n_total = n_g.sum()
+    q = stats['mean_f'].shape[1]
+    if n_total == 0:
+        return 0.0, np.zeros(q), 0.0, np.zeros((q, q)), np.zeros(q)
+
+    p = stats['Sxx'].shape[1]
+    mean_f = (n_g @ stats['mean_f'][groups]) / n_total
+    mean_y = (n_g @ stats['mean_y'][groups]) / n_total
+    D = stats['mean_f'][groups] - mean_f
+    e = stats['mean_y'][groups] - mean_y
+
+    Sff = (D * n_g[:, None]).T @ D
+    Sff[:p, :p] += stats['Sxx'][groups].sum(axis=0)
+    Sfy = (D * n_g[:, None]).T @ e
+    Sfy[:p] += stats['Sxy'][groups].sum(axis=0)
+    return n_total, mean_f, mean_y, Sff, Sfy
+
+
+def _ols_solve(mean_f, mean_y, Sff, Sfy):
+    """
+    OLS (with intercept) from pooled moments.
+
+    Zero-variance features get a zero coefficient. The rank of the remaining
+    system is decided in correlation scale (so it does not depend on the units
+    of the features), and the coefficients are the minimum-norm solution in
+    the original centered coordinates, as sklearn's LinearRegression returns
+    them. On full-rank and exactly collinear designs (duplicated or linearly
+    dependent columns, a full set of indicators) the fit agrees with sklearn
+    in and out of sample to floating-point tolerance. It can differ on nearly
+    collinear designs, since the moments square the condition number, and
+    where sklearn drops a direction that is small in the features' units.
+
+    Returns:
+    --------
+    LinearRegression
+        A fitted-equivalent sklearn model (coef_ and intercept_ set directly).
+    """
+    q = mean_f.shape[0]
+    coef = np.zeros(q)
+    scale = np.sqrt(np.clip(np.diag(Sff), 0.0, None))
+    active = scale > 1e-12 * max(scale.max(), 1.0)
+    if np.any(active):
+        s_a = scale[active]
+        R = Sff[np.ix_(active, active)] / np.outer(s_a, s_a)
+        r = Sfy[active] / s_a
+        eigenvalues, V = np.linalg.eigh(R)
+        kept = eigenvalues > s_a.shape[0] * np.finfo(float).eps * max(eigenvalues.max(), 0.0)
+        V_kept = V[:, kept]
+        beta = (V_kept @ ((V_kept.T @ r) / eigenvalues[kept])) / s_a
+        # null space of the unscaled system: remove beta's component in it
+        # to get the minimum-norm solution in the original coordinates
+        null = V[:, ~kept] / s_a[:, None]
+        if null.shape[1] > 0:
+            beta -= null @ np.linalg.lstsq(null, beta, rcond=None)[0]
+        coef[active] = beta
+
+    ols = LinearRegression(fit_intercept=True)
+    ols.coef_ = coef
+    ols.intercept_ = float(mean_y - mean_f @ coef)
+    ols.n_features_in_ = q
+    return ols
+
+
+def _ols_from_group_statistics(stats, group_index_vector):
+    """
+    Solve OLS (with intercept) on the union of the selected groups from their
+    sufficient statistics: O(|S| q^2 + q^3) instead of O(n q^2).
+
+    Returns:
+    --------
+    LinearRegression or None
+        A fitted-equivalent sklearn model (coef_ and intercept_ set directly).
+    """
+    groups = np.asarray(group_index_vector, dtype=int).ravel()
+    n_total, mean_f, mean_y, Sff, Sfy = _ols_pooled_moments(stats, groups)
+    if n_total == 0:
+        return None
+    return _ols_solve(mean_f, mean_y, Sff, Sfy)
+
+
+def _ols_by_downdate(stats, group_index_vector, tol=1e-8):
+    """
+    Solve OLS on the selected groups by removing the excluded groups S from
+    the cached all-groups moments: O(|S| q^2 + q^3), which makes fits on
+    "all groups but a few" nearly as cheap as the solve itself.
+
+    The centered moments of the complement follow exactly from those of all
+    groups and of S (the pairwise update run backwards). If a feature loses
+    more than a fraction 1 - tol of its total variation in the subtraction,
+    too few digits are left and the fit is recomputed from the selected
+    groups directly. Features that do not vary in the whole data set are
+    left out of that check.
+
+    Returns:
+    --------
+    LinearRegression or None
+        A fitted-equivalent sklearn model (coef_ and intercept_ set directly).
+    """
+    groups = np.asarray(group_index_vector, dtype=int).ravel()
+    K = stats['n'].shape[0]
+    included = np.zeros(K, dtype=bool)
+    included[groups] = True
+    excluded = np.flatnonzero(~included)
+    # duplicated groups, or more groups to remove than to add: sum directly
+    if np.count_nonzero(included) != groups.shape[0] or excluded.shape[0] >= groups.shape[0]:
+        return _ols_from_group_statistics(stats, groups)
+
+    full = stats.get('all')
+    if full is None:
+        full = stats['all'] = _ols_pooled_moments(stats, np.arange(K))
+    n_all, mean_f_all, mean_y_all, Sff_all, Sfy_all = full
+
+    n_S, mean_f_S, mean_y_S, Sff_S, Sfy_S = _ols_pooled_moments(stats, excluded)
+    n_c = n_all - n_S
+    if n_c == 0:
+        return None
+    if n_S == 0:
+        return _ols_solve(mean_f_all, mean_y_all, Sff_all, Sfy_all)
+
+    mean_f = (n_all * mean_f_all - n_S * mean_f_S) / n_c
+    mean_y = (n_all * mean_y_all - n_S * mean_y_S) / n_c
+    w = n_c * n_S / n_all
+    d_f = mean_f - mean_f_S
+    Sff = Sff_all - Sff_S - w * np.outer(d_f, d_f)
+    Sfy = Sfy_all - Sfy_S - w * d_f * (mean_y - mean_y_S)
+
+    # features without variation in all groups (e.g. a constant U) have
+    # nothing to lose and get a zero coefficient in _ols_solve either way
+    total = np.diag(Sff_all)
+    varying = total > 1e-24 * max(total.max(), 1.0)
+    if np.any(np.diag(Sff)[varying] <= tol * total[varying]):
+        return _ols_from_group_statistics(stats, groups)
+    return _ols_solve(mean_f, mean_y, Sff, Sfy)
+
+
+def create_mu_method_ols_offset(sufficient_statistics=False, downdate=False):
     """
     Create a mu-estimation method using OLS with group-specific offsets.
     Uses NumPy arrays (no pandas).
-    """
 
-    def _stack_group_features(U_group, Z_group):
-        X_mat = np.asarray([z["X"] for z in Z_group], dtype=float)
-        U_rep = np.repeat(np.asarray(U_group, dtype=float).reshape(1, -1), X_mat.shape[0], axis=0)
-        return np.hstack([X_mat, U_rep])
+    Parameters:
+    -----------
+    sufficient_statistics : bool
+        If True, each group's centered Gram matrix X'X, X'y and count are
+        computed once per calibration data set and every fit_global call on a
+        subset of groups combines those p x p blocks and solves a single small
+        system, instead of refitting from the stacked rows.
+    downdate : bool
+        If True (implies sufficient_statistics), the moments of all groups are
+        cached as well and a fit on all groups but S subtracts the blocks of
+        the excluded groups S instead of adding those of the included ones,
+        falling back to the direct sum when the subtraction loses precision.
+    """
+    sufficient_statistics = sufficient_statistics or downdate
+    # per-data-set group statistics (by fingerprint, see _DataCache)
+    group_statistics = _DataCache()
 
     def fit_global(U_matrix, Z_list, group_index_vector):
         """
@@ -174,27 +556,21 @@ def create_mu_method_ols_offset():
         if len(group_index_vector) == 0:
             return None
 
-        X_blocks = []
-        y_blocks = []
-
-        for g in group_index_vector:
-            U_g = U_matrix[g, :]
-            Z_g = Z_list[g]
-            if len(Z_g) == 0:
-                continue
-
-            Xg = _stack_group_features(U_g, Z_g)
-            yg = np.asarray([z["Y"] for z in Z_g], dtype=float)
+        data = as_grouped_data(Z_list, U_matrix)
 
-            X_blocks.append(Xg)
-            y_blocks.append(yg)
+        if sufficient_statistics:
+            stats = group_statistics.get(data)
+            if stats is None:
+                stats = _ols_group_statistics(data)
+                group_statistics[data] = stats
+            if downdate:
+                return _ols_by_downdate(stats, group_index_vector)
+            return _ols_from_group_statistics(stats, group_index_vector)
 
-        if len(X_blocks) == 0:
+        X_train, y_train = data.design(group_index_vector)
+        if X_train.shape[0] == 0:
             return None
 
-        X_train = np.vstack(X_blocks)
-        y_train = np.concatenate(y_blocks)
-
         ols = LinearRegression(fit_intercept=True)
         ols.fit(X_train, y_train)
         return ols
@@ -211,6 +587,12 @@ def create_mu_method_ols_offset():
         feats = np.concatenate([x, u]).reshape(1, -1)
         return float(model_global.predict(feats)[0])
 
+    def predict_global_batch(model_global, X_matrix, u_vector):
+        """
+        Predict using the global OLS model on every row of X_matrix.
+        """
+        return _predict_batch(model_global, X_matrix, u_vector)
+
     def fit_group_adjustment(model_global, u_group_vector, Z_group_list, training_index_vector):
         """
         Fit group-specific adjustment = mean(Y - mu_global) over training indices (0-indexed).
@@ -218,40 +600,243 @@ def create_mu_method_ols_offset():
         if model_global is None or len(training_index_vector) == 0:
             return 0.0
 
-        idx = list(training_index_vector)
-        y_train = np.asarray([Z_group_list[i]["Y"] for i in idx], dtype=float)
-
-        X_sel = np.asarray([Z_group_list[i]["X"] for i in idx], dtype=float)
-        u = np.asarray(u_group_vector, dtype=float).ravel()
-        U_rep = np.repeat(u.reshape(1, -1), X_sel.shape[0], axis=0)
-        feats = np.hstack([X_sel, U_rep])
+        idx = np.asarray(training_index_vector, dtype=int)
+        X_group, Y_group = group_arrays(Z_group_list)
+        y_train = Y_group[idx]
 
-        mu_global = np.asarray(model_global.predict(feats), dtype=float).ravel()
+        mu_global = _predict_batch(model_global, X_group[idx], u_group_vector)
         return float(np.mean(y_train - mu_global))  # (fix #7) ensure Python float
 
+    def fit_group_adjustments_all(model_global, U_matrix, Z_list, group_index_vector,
+                                  training_index):
+        """
+        Adjustments of many groups in one pass (see fit_group_adjustments).
+        """
+        if model_global is None:
+            return np.zeros(np.asarray(group_index_vector).size)
+        data = as_grouped_data(Z_list, U_matrix)
+        return _mean_residual_offsets(model_global, data, group_index_vector, training_index)
+
     def predict_group_mu(model_global, group_adjustment, x_vector, u_group_vector):
         return predict_global(model_global, x_vector, u_group_vector) + float(group_adjustment)
 
+    def predict_group_mu_batch(model_global, group_adjustment, X_matrix, u_group_vector):
+        return predict_global_batch(model_global, X_matrix, u_group_vector) + float(group_adjustment)
+
     return {
         "fit_global": fit_global,
         "predict_global": predict_global,
+        "predict_global_batch": predict_global_batch,
         "fit_group_adjustment": fit_group_adjustment,
+        "fit_group_adjustments_all": fit_group_adjustments_all,
         "predict_group_mu": predict_group_mu,
+        "predict_group_mu_batch": predict_group_mu_batch,
+        # the group adjustment is mean(Y - mu_global) over the training
+        # indices (lets the online HCP++ engine maintain it incrementally)
+        "group_adjustment_type": "mean_residual",
     }
 
 
-def create_mu_method_ols_global_only():
+def create_mu_method_ols_global_only(sufficient_statistics=False, downdate=False):
     """
     Create a mu-estimation method using OLS without group-specific adjustments.
     """
-    base = create_mu_method_ols_offset()
+    base = create_mu_method_ols_offset(sufficient_statistics=sufficient_statistics,
+                                       downdate=downdate)
 
     def fit_group_adjustment(model_global, u_group_vector, Z_group_list, training_index_vector):
         return 0.0
 
+    def fit_group_adjustments_all(model_global, U_matrix, Z_list, group_index_vector,
+                                  training_index):
+        return np.zeros(np.asarray(group_index_vector).size)
+
     def predict_group_mu(model_global, group_adjustment, x_vector, u_group_vector):
         return base["predict_global"](model_global, x_vector, u_group_vector)
 
+    def predict_group_mu_batch(model_global, group_adjustment, X_matrix, u_group_vector):
+        return base["predict_global_batch"](model_global, X_matrix, u_group_vector)
+
     base["fit_group_adjustment"] = fit_group_adjustment
+    base["fit_group_adjustments_all"] = fit_group_adjustments_all
     base["predict_group_mu"] = predict_group_mu
-    return base
\ No newline at end of file
+    base["predict_group_mu_batch"] = predict_group_mu_batch
+    base["group_adjustment_type"] = "none"
+    return base
+
+class _TreeSubsetForest:
+    """
+    Average of a subset of the trees of a group-bagged forest. Predicts like a
+    fitted RandomForestRegressor (trees are summed serially, in order).
+    """
+
+    def __init__(self, estimators):
+        self.estimators_ = list(estimators)
+
+    def predict(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        prediction = np.zeros(X.shape[0])
+        for tree in self.estimators_:
+            prediction += tree.predict(X, check_input=False)
+        return prediction / len(self.estimators_)
+
+
+def _fit_group_bagged_forest(data, ntree, group_fraction, mtry, nodesize, random_state, n_jobs):
+    """
+    Fit ntree regression trees on [X | U] where tree t sees only the groups of
+    its bag (each group enters a bag independently with probability
+    group_fraction) and, as in a Random Forest, a bootstrap sample of their rows.
+
+    Bags are drawn independently of the data, so a tree whose bag avoids a set
+    S of groups is a function of the observations outside S only.
+
+    Returns:
+    --------
+    dict
+        'bags' (ntree, K) bool membership, 'trees' list of fitted trees (None
+        for a tree whose bag has no observations)
+    """
+    K = data.n_groups
+    features, y = data.design(np.arange(K))
+    features = np.ascontiguousarray(features, dtype=np.float32)
+
+    rng = np.random.RandomState(random_state)
+    bags = rng.random_sample((ntree, K)) < group_fraction
+    empty = np.flatnonzero(~bags.any(axis=1))
+    bags[empty, rng.randint(0, K, empty.shape[0])] = True
+    seeds = rng.randint(np.iinfo(np.int32).max, size=ntree)
+
+    def fit_tree(bag, seed):
+        rows = data.rows(np.flatnonzero(bag))
+        if rows.shape[0] == 0:
+            return None
+        tree_rng = np.random.RandomState(seed)
+        counts = np.bincount(tree_rng.randint(0, rows.shape[0], rows.shape[0]),
+                             minlength=rows.shape[0])
+        drawn = counts > 0
+        tree = DecisionTreeRegressor(max_features=mtry, min_samples_leaf=nodesize,
+                                     random_state=tree_rng)
+        tree.fit(features[rows[drawn]], y[rows[drawn]],
+                 sample_weight=counts[drawn].astype(float))
+        return tree
+
+    trees = Parallel(n_jobs=rf_n_jobs(n_jobs), prefer='threads')(
+        delayed(fit_tree)(bags[t], seeds[t]) for t in range(ntree)
+    )
+    return {'bags': bags, 'trees': trees}
+
+
+def group_bag_fraction(ntree, min_trees, exclusion_size):
+    """
+    Bag fraction f with ntree * (1 - f)^exclusion_size = 2 * min_trees: the
+    expected number of trees avoiding an excluded set of that size is twice
+    the number a masked model needs. Requires ntree > 2 * min_trees (at
+    ntree = 2 * min_trees no group could enter a bag).
+    """
+    if ntree <= 2 * min_trees:
+        raise ValueError("ntree must exceed 2 * min_trees to derive the bag fraction")
+    if exclusion_size <= 0:
+        return 1.0
+    return float(1.0 - (2.0 * min_trees / ntree) ** (1.0 / exclusion_size))
+
+
+def create_mu_method_random_forest_group_bagged(ntree=500, group_fraction=None, exclusion_size=None,
+                                                min_trees=50, mtry=None, nodesize=5,
+                                                random_state=123, n_jobs=None):
+    """
+    Create a Random Forest + offset mu-method that fits one group-bagged forest
+    per calibration data set and answers fit_global on a subset of groups by
+    tree masking (out-of-group bagging).
+
+    fit_global(U, Z, S_comp) returns the average of the trees whose bags lie
+    inside S_comp. These trees never saw the excluded groups, so the model is
+    independent of their observations, as HCP++ requires. A tree avoids an
+    excluded set S with probability (1 - group_fraction)^|S|, so by default
+    the bags are sized for the exclusion sets expected (see
+    group_bag_fraction). When fewer than min_trees trees qualify, a Random
+    Forest of min_trees trees is fitted on S_comp directly and a
+    RuntimeWarning is issued.
+
+    Parameters
+    ----------
+    ntree : int
+        Number of trees in the group-bagged forest (at least 2 * min_trees,
+        more than 2 * min_trees if group_fraction is None).
+    group_fraction : float or None
+        Probability that a group enters the bag of a tree; None derives it
+        from exclusion_size with group_bag_fraction.
+    exclusion_size : int or None
+        Expected number of excluded groups per fit (default: K // 2, the
+        typical size of the HCP++ calibration set S_cal with
+        alpha_selection = 0.5); only used when group_fraction is None.
+    min_trees : int
+        Minimum number of trees averaged by a masked model; also the size of
+        the fallback forest.
+    mtry : int or None
+        Number of features considered at each split (if None uses sqrt(p_total)).
+    nodesize : int
+        Minimum samples per leaf.
+    random_state : int
+        Seed for reproducibility.
+    n_jobs : int or None
+        Threads per fit; None takes the Random Forest budget from
+        resources.configure_resources at fit time (all cores by default).
+
+    Returns
+    -------
+    dict
+        Method object with fit/predict functions.
+    """
+    if group_fraction is not None and not 0.0 < group_fraction <= 1.0:
+        raise ValueError("group_fraction must be in (0, 1]")
+    if ntree < 2 * min_trees:
+        raise ValueError("ntree must be at least 2 * min_trees for masking to apply")
+    if group_fraction is None and ntree == 2 * min_trees:
+        raise ValueError("ntree must exceed 2 * min_trees to derive group_fraction")
+
+    base = create_mu_method_random_forest_offset(
+        ntree=min_trees, mtry=mtry, nodesize=nodesize, random_state=random_state,
+        n_jobs=n_jobs
+    )
+    fit_forest = base["fit_global"]
+    # per-data-set group-bagged forests (by fingerprint, see _DataCache)
+    forests = _DataCache()
+
+    def fit_global(U_matrix, Z_list, group_index_vector):
+        """
+        Average of the trees trained only on the selected groups (0-indexed),
+        or a directly fitted forest if too few trees qualify.
+        """
+        if len(group_index_vector) == 0:
+            return None
+
+        data = as_grouped_data(Z_list, U_matrix)
+        forest = forests.get(data)
+        if forest is None:
+            local_mtry = mtry
+            if local_mtry is None:
+                local_mtry = max(1, int(np.sqrt(data.n_features + data.U.shape[1])))
+            fraction = group_fraction
+            if fraction is None:
+                size = data.n_groups // 2 if exclusion_size is None else exclusion_size
+                fraction = group_bag_fraction(ntree, min_trees, size)
+            forest = _fit_group_bagged_forest(data, ntree, fraction, local_mtry,
+                                              nodesize, random_state, n_jobs)
+            forests[data] = forest
+
+        excluded = np.ones(data.n_groups, dtype=bool)
+        excluded[np.asarray(group_index_vector, dtype=int)] = False
+        usable = ~(forest['bags'] & excluded).any(axis=1)
+        trees = [tree for tree, ok in zip(forest['trees'], usable) if ok and tree is not None]
+        if len(trees) < min_trees:
+            warnings.warn(
+                f"group-bagged forest: only {len(trees)} of {ntree} trees avoid the "
+                f"{int(excluded.sum())} excluded groups; refitting a forest on S_comp",
+                RuntimeWarning
+            )
+            return fit_forest(U_matrix=data.U, Z_list=data,
+                              group_index_vector=group_index_vector)
+        return _TreeSubsetForest(trees)
+
+    base["fit_global"] = fit_global
+    return base
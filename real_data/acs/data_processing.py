@@ -10,8 +10,18 @@ This module handles:
 
 import numpy as np
 import pandas as pd
+import sys
+from pathlib import Path
 from typing import List, Dict, Tuple, Optional
 
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from grouped_data import GroupedData, GroupView
+
+sys.path.append(str(Path(__file__).parent.parent))
+from grouping import GroupRows
+from design_matrix import DesignMatrixSchema
+from dataset_cache import DatasetCache, call_params
+
 
 # State lists based on Migration Policy Institute (MPI)
 NEW_DESTINATION_STATES = [
@@ -107,7 +117,7 @@ def load_and_clean_acs_pums(
     try:
         df = pd.read_csv(pums_csv_path, usecols=list(col_map.keys()))
         df = df.rename(columns=col_map)
-    except:
+    except ValueError:
         # If specific columns fail, load all and rename
         df = pd.read_csv(pums_csv_path)
         df = df.rename(columns=col_map)
@@ -191,7 +201,23 @@ def load_and_clean_acs_pums(
     return df
 
 
-def build_design_matrix_acs(df: pd.DataFrame) -> np.ndarray:
+def acs_design_schema() -> DesignMatrixSchema:
+    """
+    Column layout of the ACS design matrix: age, age_sq, hours, entry_recency,
+    married, female, then education / English / class-of-worker indicators
+    (first level dropped).
+    """
+    return DesignMatrixSchema(
+        numeric_columns=['age', 'age_sq', 'hours', 'entry_recency', 'married', 'female'],
+        categorical_columns=['educ_level', 'english', 'cow'],
+        prefixes=['educ', 'eng', 'cow'],
+        drop_first=True
+    )
+
+
+def build_design_matrix_acs(df: pd.DataFrame,
+                            schema: Optional[DesignMatrixSchema] = None,
+                            dtype=np.float64) -> np.ndarray:
     """
     Build design matrix X from cleaned ACS data.
 
@@ -199,25 +225,78 @@ def build_design_matrix_acs(df: pd.DataFrame) -> np.ndarray:
     -----------
     df : pd.DataFrame
         Cleaned ACS data
+    schema : DesignMatrixSchema, optional
+        Fitted column layout to encode df with (default: acs_design_schema()
+        fitted on df); pass the same schema to encode new rows consistently
+    dtype : numpy dtype
+        np.float64 (default) or np.float32
 
     Returns:
     --------
-    np.ndarray : Design matrix of shape (n, p)
+    np.ndarray : Contiguous design matrix of shape (n, p)
     """
-    # Create dummy variables for categorical features
-    educ_dummies = pd.get_dummies(df['educ_level'], prefix='educ', drop_first=True)
-    english_dummies = pd.get_dummies(df['english'], prefix='eng', drop_first=True)
-    cow_dummies = pd.get_dummies(df['cow'], prefix='cow', drop_first=True)
+    if schema is None:
+        schema = acs_design_schema().fit(df)
+    return schema.transform(df, dtype=dtype)
 
-    # Combine all features
-    X = pd.concat([
-        df[['age', 'age_sq', 'hours', 'entry_recency', 'married', 'female']],
-        educ_dummies,
-        english_dummies,
-        cow_dummies
-    ], axis=1)
 
-    return X.values
+# Routines behind a cached ACS data set (part of its cache key)
+_ACS_DATASET_CODE = (load_and_clean_acs_pums, acs_design_schema, build_design_matrix_acs, DesignMatrixSchema)
+
+
+def load_acs_dataset(
+    pums_csv_path: str,
+    cache_dir: Optional[str] = None,
+    **clean_kwargs
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Cleaned ACS data and its design matrix, read from a content-addressed
+    cache when the same PUMS file was cleaned with the same parameters before.
+
+    Parameters:
+    -----------
+    pums_csv_path : str
+        Path to ACS PUMS CSV file
+    cache_dir : str, optional
+        Cache directory (default: None = always clean from the CSV)
+    **clean_kwargs :
+        Filters passed to load_and_clean_acs_pums (states_keep, age_min,
+        age_max, yoep_window_years, top_income_quantile, ...)
+
+    Returns:
+    --------
+    tuple : (df, X) with df index reset so positions match the rows of X
+    """
+    def build():
+        df = load_and_clean_acs_pums(pums_csv_path, **clean_kwargs)
+        df = df.reset_index(drop=True)
+        return df, build_design_matrix_acs(df)
+
+    if cache_dir is None:
+        return build()
+
+    df, X, hit = DatasetCache(cache_dir).get_or_build(
+        pums_csv_path, 'acs',
+        call_params(load_and_clean_acs_pums, None, **clean_kwargs), build,
+        code=_ACS_DATASET_CODE,
+        schema=lambda df: acs_design_schema().fit(df)
+    )
+    if hit:
+        print(f"Loaded {len(df)} cleaned rows and design matrix {X.shape} from cache {cache_dir}")
+    return df, X
+
+
+def acs_dataset_key(pums_csv_path: str, cache_dir: str, **clean_kwargs) -> str:
+    """
+    Cache key of the data set load_acs_dataset(pums_csv_path, cache_dir,
+    **clean_kwargs) returns, computed without loading it (the PUMS file is
+    hashed once and then remembered in cache_dir).
+    """
+    return DatasetCache(cache_dir).key(
+        pums_csv_path, 'acs',
+        call_params(load_and_clean_acs_pums, None, **clean_kwargs),
+        code=_ACS_DATASET_CODE
+    )
 
 
 def create_acs_hierarchical_data(
@@ -259,21 +338,25 @@ def create_acs_hierarchical_data(
     # Training states (calibration)
     train_states = [s for s in EMERGING_STATES if s not in test_states]
 
+    # Row positions of every state, computed once
+    group_rows = GroupRows(df, 'state_abb')
+    y_all = group_rows.y
     results = {}
 
     for test_state in test_states:
         # Check if test state has enough data
-        test_indices = np.where(df['state_abb'] == test_state)[0]
+        test_indices = group_rows.rows(test_state)
         if len(test_indices) < (o_observed + 1):
             print(f"Warning: Test state {test_state} has only {len(test_indices)} rows, need {o_observed + 1}")
             continue
 
         # Create calibration groups (one per training state)
-        Z_calibration = []
+        X_blocks = []
+        Y_blocks = []
         cal_states_used = []
 
         for state in train_states:
-            state_indices = np.where(df['state_abb'] == state)[0]
+            state_indices = group_rows.rows(state)
             if len(state_indices) < 2:
                 continue
 
@@ -281,15 +364,8 @@ def create_acs_hierarchical_data(
             n_sample = min(n_per_cal_group, len(state_indices))
             sampled_indices = np.random.choice(state_indices, size=n_sample, replace=False)
 
-            # Create Z list for this group
-            Z_group = []
-            for idx in sampled_indices:
-                Z_group.append({
-                    'X': X[idx, :],
-                    'Y': df.iloc[idx]['y']
-                })
-
-            Z_calibration.append(Z_group)
+            X_blocks.append(X[sampled_indices, :])
+            Y_blocks.append(y_all[sampled_indices])
             cal_states_used.append(state)
 
         # Create test group
@@ -302,16 +378,12 @@ def create_acs_hierarchical_data(
         # Shuffle to create random "stream" order
         np.random.shuffle(sampled_test_indices)
 
-        Z_test = []
-        for idx in sampled_test_indices:
-            Z_test.append({
-                'X': X[idx, :],
-                'Y': df.iloc[idx]['y']
-            })
+        Z_test = GroupView(X[sampled_test_indices, :], y_all[sampled_test_indices])
 
         # U vectors (constant 0 to avoid leakage, X contains demographics)
-        U_calibration = np.zeros((len(Z_calibration), 1))
+        U_calibration = np.zeros((len(Y_blocks), 1))
         U_test = np.zeros((1, 1))
+        Z_calibration = GroupedData.from_groups(X_blocks, Y_blocks, U_calibration)
 
         results[test_state] = {
             'U_calibration': U_calibration,
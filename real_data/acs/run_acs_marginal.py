@@ -30,22 +30,18 @@ from methods import (
 )
 from methods.hcp_plus import compute_hcp_plus_interval
 from methods.hcp_sample import compute_hcp_sample_interval
-from methods.baseline_hcp import (
-    compute_hcp_interval_radius,
-    compute_pooling_interval_radius,
-    compute_subsampling_once_interval_radius,
-    compute_repeated_subsampling_interval_radius
-)
-from scores import absolute_residual_score
 
 from data_processing import (
-    load_and_clean_acs_pums,
-    build_design_matrix_acs,
+    load_acs_dataset,
+    acs_dataset_key,
     EMERGING_STATES
 )
 
 sys.path.append(str(Path(__file__).parent.parent))
 from format_results import csv_to_markdown_table, add_data_summary_to_markdown
+from grouping import GroupRows, open_cached_layout
+from unit_runner import run_test_units, unit_data
+from calibration_context import CalibrationContext
 
 
 def run_marginal_experiment_one_state(
@@ -54,7 +50,10 @@ def run_marginal_experiment_one_state(
     alpha_selection=0.5,
     n_subsample_rep=50,
     mu_method_baseline=None,
-    mu_method_hcp=None
+    mu_method_hcp=None,
+    group_rows=None,
+    Z_calibration=None,
+    calibration_context=None
 ):
     """
     Run marginal coverage experiment for ONE test state.
@@ -85,13 +84,25 @@ def run_marginal_experiment_one_state(
         Baseline μ-method
     mu_method_hcp : dict
         HCP μ-method
+    group_rows : GroupRows, optional
+        Row positions of every state in df (computed here if not given)
+    Z_calibration : GroupedData, optional
+        Calibration groups of the training states (built from df and X if
+        not given; df and X then only need the test state's rows)
+    calibration_context : CalibrationContext, optional
+        Baseline model, scores, radii and global-model cache of Z_calibration,
+        shared across test units (built here if not given)
 
     Returns:
     --------
     pd.DataFrame : Results with one row per (percentile, method)
     """
+    if group_rows is None:
+        group_rows = GroupRows(df, 'state_abb')
+
     # Get test state data (original order, no permutation)
-    test_df = df[df['state_abb'] == test_state].reset_index(drop=True)
+    test_rows = group_rows.rows(test_state)  # rows of df / X
+    test_df = df.iloc[test_rows].reset_index(drop=True)
     n_test = len(test_df)
 
     if n_test < 5:
@@ -107,33 +118,15 @@ def run_marginal_experiment_one_state(
 
     # Create calibration groups from training states ONLY
     # Baseline methods should NOT see any test state data
-    Z_calibration = []
-    cal_states_used = []
-
-    for state in training_states:
-        state_df = df[df['state_abb'] == state]
-        if len(state_df) < 1:
-            continue
-
-        Z_group = []
-        state_indices = state_df.index.tolist()
-        for idx in state_indices:
-            Z_group.append({
-                'X': X[idx, :],
-                'Y': df.iloc[idx]['y']
-            })
-
-        Z_calibration.append(Z_group)
-        cal_states_used.append(state)
-
-    test_indices = test_df.index.tolist()
+    if Z_calibration is None:
+        Z_calibration, cal_states_used = group_rows.grouped_data(X, training_states)
 
     n_cal_groups = len(Z_calibration)
-    n_cal_total_obs = sum(len(Z) for Z in Z_calibration)
+    n_cal_total_obs = Z_calibration.n_obs
     print(f"    Calibration: {n_cal_groups} groups, {n_cal_total_obs} total observations")
 
     # U vectors (constant 0)
-    U_calibration = np.zeros((n_cal_groups, 1))
+    U_calibration = Z_calibration.U
     U_test = np.zeros((1, 1))
 
     # Determine which observations to test (at income percentiles)
@@ -148,7 +141,7 @@ def run_marginal_experiment_one_state(
             sorted_idx = int(np.percentile(np.arange(n_test), pct))
 
         # Map from sorted position to original position in test_df
-        original_idx = test_df_sorted.iloc[sorted_idx]['index']
+        original_idx = int(test_df_sorted['index'].iloc[sorted_idx])
 
         # Check if we have enough observations for history
         if original_idx < 1:  # Need at least 1 history observation
@@ -158,6 +151,18 @@ def run_marginal_experiment_one_state(
 
     print(f"    Testing at income percentiles: {list(percentile_indices.keys())}")
 
+    # The baseline model, scores and radii and the global models of HCP++ /
+    # HCP.sample depend only on the fixed calibration groups, so they are
+    # computed once and shared across percentiles (and test states)
+    if calibration_context is None:
+        calibration_context = CalibrationContext(
+            Z_calibration, mu_method_baseline, number_repetitions=n_subsample_rep
+        )
+    else:
+        calibration_context.check(Z_calibration)
+    radii = calibration_context.radii(alpha)
+    model_cache = calibration_context.model_cache
+
     # Run experiments for each percentile
     all_results = []
 
@@ -170,62 +175,15 @@ def run_marginal_experiment_one_state(
         o_observed = target_index  # Number of observations in history
 
         # Build Z_test: history (indices 0 to target_index-1) + target (index target_index)
-        Z_test = []
-        for i in range(target_index + 1):  # Includes target
-            if i >= n_test:
-                break
-            idx = test_indices[i]
-            Z_test.append({
-                'X': X[idx, :],
-                'Y': df.iloc[idx]['y']
-            })
+        Z_test = group_rows.group(X, test_state, rows=test_rows[:target_index + 1])
 
         # Get target observation
-        target_idx = test_indices[target_index]
-        true_y = df.iloc[target_idx]['y']
+        target_idx = test_rows[target_index]
+        true_y = group_rows.y[target_idx]
         x_target = X[target_idx, :]
 
-        # Baseline methods: split groups, compute fixed radius
-        K = len(Z_calibration)
-        K0 = K // 2
-        train_idx = list(range(K0))
-        calib_idx = list(range(K0, K))
-
-        # Fit baseline model
-        model_baseline = mu_method_baseline['fit_global'](
-            U_matrix=U_calibration,
-            Z_list=Z_calibration,
-            group_index_vector=train_idx
-        )
-
-        # Compute scores
-        scores_list = []
-        for j in calib_idx:
-            Zj = Z_calibration[j]
-            Uj = U_calibration[j, :]
-            yj = np.array([z['Y'] for z in Zj])
-            muj = np.array([
-                mu_method_baseline['predict_global'](
-                    model_global=model_baseline,
-                    x_vector=z['X'],
-                    u_vector=Uj
-                ) for z in Zj
-            ])
-            scores = absolute_residual_score(yj, muj)
-            scores_list.append(scores)
-
-        # Compute interval radii
-        T_hcp = compute_hcp_interval_radius(scores_list, alpha)
-        T_pool = compute_pooling_interval_radius(scores_list, alpha)
-        T_sub = compute_subsampling_once_interval_radius(scores_list, alpha)
-        T_rep = compute_repeated_subsampling_interval_radius(scores_list, alpha, n_subsample_rep)
-
         # Baseline prediction (global estimate only, no within-group offset)
-        mu_hat_baseline = mu_method_baseline['predict_global'](
-            model_global=model_baseline,
-            x_vector=x_target,
-            u_vector=U_test[0, :]
-        )
+        mu_hat_baseline = calibration_context.predict_baseline(x_target, U_test[0, :])
 
         # Helper function
         def interval_from_radius(center, radius):
@@ -243,7 +201,8 @@ def run_marginal_experiment_one_state(
                 o_observed=o_observed,
                 alpha=alpha,
                 alpha_selection=alpha_selection,
-                mu_method=mu_method_hcp
+                mu_method=mu_method_hcp,
+                model_cache=model_cache
             )
             int_pp = res_pp['interval']
             mu_hat_hcp_methods = res_pp.get('mu_hat', mu_hat_baseline)
@@ -263,7 +222,8 @@ def run_marginal_experiment_one_state(
                 alpha=alpha,
                 test_index_target=target_index,
                 alpha_selection=alpha_selection,
-                mu_method=mu_method_hcp
+                mu_method=mu_method_hcp,
+                model_cache=model_cache
             )
             int_hs = res_hs['interval']
         except Exception as e:
@@ -271,10 +231,10 @@ def run_marginal_experiment_one_state(
             int_hs = (-np.inf, np.inf)
 
         # Baseline intervals (all use baseline mu estimate)
-        int_hcp = interval_from_radius(mu_hat_baseline, T_hcp)
-        int_pool = interval_from_radius(mu_hat_baseline, T_pool)
-        int_sub = interval_from_radius(mu_hat_baseline, T_sub)
-        int_rep = interval_from_radius(mu_hat_baseline, T_rep)
+        int_hcp = interval_from_radius(mu_hat_baseline, radii['HCP'])
+        int_pool = interval_from_radius(mu_hat_baseline, radii['Pooling'])
+        int_sub = interval_from_radius(mu_hat_baseline, radii['Subsampling'])
+        int_rep = interval_from_radius(mu_hat_baseline, radii['Repeated'])
 
         # Check coverage
         def check_coverage(interval, true_value):
@@ -314,6 +274,16 @@ def run_marginal_experiment_one_state(
     return pd.DataFrame(all_results)
 
 
+def select_states(state_counts):
+    """
+    Test states (emerging destinations that have data) and training states
+    (all others, by decreasing count) from the observations per state.
+    """
+    test_states = [s for s in EMERGING_STATES if s in state_counts.index]
+    training_states = [s for s in state_counts.index if s not in test_states]
+    return test_states, training_states
+
+
 def main():
     """Main function - run marginal experiments."""
     import argparse
@@ -328,6 +298,14 @@ def main():
                        help='Miscoverage level (default: 0.1 for 90%% coverage)')
     parser.add_argument('--seed', type=int, default=123,
                        help='Random seed')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Worker processes for the test states (-1: all cores; default: 1)')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                       help='Cache for the cleaned data and design matrix (default: <output_dir>/../../data/cache)')
+    parser.add_argument('--no_cache', action='store_true',
+                       help='Always clean the data from the CSV')
+    parser.add_argument('--mmap_dir', type=str, default=None,
+                       help='Write X, y and state offsets as memory-mapped .npy files here (once per cached data set) and run on them')
 
     args = parser.parse_args()
 
@@ -347,66 +325,117 @@ def main():
         top_income_quantile = None
 
     # Load ALL states (not just emerging)
-    df = load_and_clean_acs_pums(
-        args.pums_csv,
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    data_dir = output_dir.parent.parent / 'data'
+    cache_dir = None if args.no_cache else (args.cache_dir or data_dir / 'cache')
+
+    # Load ALL states (not just emerging)
+    clean_kwargs = dict(
         states_keep=None,  # Keep all states
         top_income_quantile=top_income_quantile
     )
+    loaded = []
 
-    # Save filtered data
-    output_dir = Path(args.output_dir)
-    output_dir.mkdir(parents=True, exist_ok=True)
+    def load_data():
+        # Cleaned frame and design matrix (from the cache when this CSV was
+        # cleaned the same way), loaded at most once
+        if not loaded:
+            loaded.append(load_acs_dataset(args.pums_csv, cache_dir=cache_dir, **clean_kwargs))
+        return loaded[0]
 
-    filtered_data_path = output_dir.parent.parent / 'data' / f'acs_filtered_marginal_top{int(args.top_income_pct)}pct.csv'
+    # Save filtered data (only when missing or older than the source CSV)
+    filtered_data_path = data_dir / f'acs_filtered_marginal_top{int(args.top_income_pct)}pct.csv'
     filtered_data_path.parent.mkdir(parents=True, exist_ok=True)
-    df.to_csv(filtered_data_path, index=False)
-    print(f"\n   Saved filtered data to {filtered_data_path}")
-
-    # Reset index
-    df = df.reset_index(drop=True)
-
-    # Build design matrix
-    print("\n2. Building design matrix...")
-    X = build_design_matrix_acs(df)
+    if (not filtered_data_path.exists()
+            or filtered_data_path.stat().st_mtime < Path(args.pums_csv).stat().st_mtime):
+        load_data()[0].to_csv(filtered_data_path, index=False)
+        print(f"\n   Saved filtered data to {filtered_data_path}")
+
+    print("\n2. Design matrix...")
+    layout = None
+    if args.mmap_dir is not None:
+        # X, y, income and state offsets as memory-mapped .npy files with the
+        # training states first, so the calibration set is one zero-copy
+        # slice that concurrent runs share through the page cache. The layout
+        # is written once per cached data set; later runs and the workers
+        # open only the mapped arrays, never the full DataFrame
+        source_key = acs_dataset_key(args.pums_csv, cache_dir or args.mmap_dir, **clean_kwargs)
+        layout, _, reused = open_cached_layout(
+            args.mmap_dir, source_key, 'state_abb',
+            lambda sizes: select_states(sizes.sort_values(ascending=False))[1],
+            load_data, columns=['income']
+        )
+        loaded.clear()
+        X = layout.X
+        state_counts = layout.group_sizes().sort_values(ascending=False)
+        print(f"   Memory-mapped layout of X, y and state offsets in {args.mmap_dir}"
+              f"{' (reused)' if reused else ''}")
+    else:
+        df, X = load_data()
+        state_counts = df.groupby('state_abb').size().sort_values(ascending=False)
+    n_obs = X.shape[0]
     print(f"   Design matrix shape: {X.shape}")
 
     # Select training and test states
     print("\n3. Selecting training and test states...")
-    state_counts = df.groupby('state_abb').size().sort_values(ascending=False)
     print(f"   Total states: {len(state_counts)}")
     print(f"   Top 20 states by count:\n{state_counts.head(20)}")
 
-    # Test states: emerging destination states (that have data)
-    test_states = [s for s in EMERGING_STATES if s in state_counts.index]
+    # Test states: emerging destination states (that have data);
+    # training states: all others
+    test_states, training_states = select_states(state_counts)
     print(f"\n   Test states (emerging destinations, {len(test_states)}): {test_states}")
-
-    # Training states: all others
-    training_states = [s for s in state_counts.index if s not in test_states]
     print(f"   Training states ({len(training_states)}): {training_states[:10]}... (showing first 10)")
 
     # Create μ-methods (using OLS)
     print("\n4. Creating μ-estimation methods (OLS)...")
     mu_baseline = create_mu_method_ols_global_only()
-    mu_hcp = create_mu_method_ols_offset()
+    mu_hcp = create_mu_method_ols_offset(sufficient_statistics=True)
 
     # Run marginal experiments
     print(f"\n5. Running marginal experiments ({len(test_states)} test states)...")
-    all_results = []
-
+    if layout is not None:
+        group_rows = layout.group_rows()
+    else:
+        group_rows = GroupRows(df, 'state_abb')
+
+    # Every state runs on its own rows against the shared calibration
+    # groups and calibration context (baseline model, scores, radii), seeded
+    # from its own stream, so results do not depend on --workers
+    Z_calibration, _ = group_rows.grouped_data(X, training_states)
+    calibration_context = CalibrationContext(
+        Z_calibration, mu_baseline, number_repetitions=50, alphas=[args.alpha]
+    )
+    unit_kwargs = []
     for test_state in test_states:
-        print(f"\n  Running marginal coverage for {test_state}...")
-        results = run_marginal_experiment_one_state(
-            df=df,
-            X=X,
+        if layout is not None:
+            df_unit, X_unit = layout.unit_data(test_state)
+        else:
+            df_unit, X_unit = unit_data(df, X, group_rows, test_state)
+        unit_kwargs.append(dict(
+            df=df_unit,
+            X=X_unit,
             training_states=training_states,
             test_state=test_state,
             alpha=args.alpha,
             alpha_selection=0.5,
             n_subsample_rep=50,
             mu_method_baseline=mu_baseline,
-            mu_method_hcp=mu_hcp
-        )
-        all_results.append(results)
+            mu_method_hcp=mu_hcp,
+            calibration_context=calibration_context
+        ))
+
+    print(f"   {len(test_states)} states on {args.workers} worker(s); finished states are written to {output_dir / 'units'}")
+    all_results = run_test_units(
+        run_marginal_experiment_one_state,
+        unit_kwargs,
+        Z_calibration,
+        n_workers=args.workers,
+        seed=args.seed,
+        stream_dir=output_dir / 'units',
+        unit_names=[str(u) for u in test_states]
+    )
 
     # Combine results
     print("\n6. Combining and saving results...")
@@ -479,7 +508,7 @@ def main():
     print(f"  - acs_marginal_detailed.csv ({len(full_results)} predictions)")
     print(f"  - acs_marginal_summary.csv (method summaries)")
     print(f"\nFiltered data saved to:")
-    print(f"  - {filtered_data_path} ({len(df)} observations)")
+    print(f"  - {filtered_data_path} ({n_obs} observations)")
 
 
 if __name__ == "__main__":
@@ -28,21 +28,22 @@ from methods import (
     create_mu_method_ols_global_only
 )
 from methods.hcp_plus import compute_hcp_plus_interval
+from methods.hcp_online import OnlineHCPPlus
 from methods.hcp_sample import compute_hcp_sample_interval
-from methods.baseline_hcp import (
-    compute_hcp_interval_radius,
-    compute_pooling_interval_radius,
-    compute_subsampling_once_interval_radius,
-    compute_repeated_subsampling_interval_radius
-)
-from scores import absolute_residual_score
+from methods.baseline_hcp import BaselineCalibration
+from grouped_data import GroupView
+from methods.model_cache import GlobalModelCache
 
 from data_processing import (
-    load_and_clean_acs_pums,
-    build_design_matrix_acs,
+    load_acs_dataset,
+    acs_dataset_key,
     EMERGING_STATES
 )
 
+sys.path.append(str(Path(__file__).parent.parent))
+from grouping import GroupRows, open_cached_layout
+from unit_runner import run_test_units, unit_data
+
 
 def run_all_methods_one_prediction(
     U_cal, Z_cal, U_test, Z_test,
@@ -51,7 +52,10 @@ def run_all_methods_one_prediction(
     alpha_selection=0.5,
     n_subsample_rep=50,
     mu_method_baseline=None,
-    mu_method_hcp=None
+    mu_method_hcp=None,
+    model_cache=None,
+    baseline_calibration=None,
+    hcp_plus_online=None
 ):
     """
     Run all 6 methods for ONE prediction (the (o+1)-th observation).
@@ -64,8 +68,8 @@ def run_all_methods_one_prediction(
         Calibration observations
     U_test : ndarray
         Test group-level covariates
-    Z_test : list
-        Test observations (first o_observed points)
+    Z_test : GroupView or list
+        Test observations (first o_observed points plus the target)
     o_observed : int
         Number of observed points in test group so far
     alpha : float
@@ -78,50 +82,25 @@ def run_all_methods_one_prediction(
         Baseline μ-method
     mu_method_hcp : dict
         HCP μ-method
+    model_cache : GlobalModelCache, optional
+        Cache of HCP global models shared across predictions
+    baseline_calibration : BaselineCalibration, optional
+        Precomputed baseline model, scores and radii for (U_cal, Z_cal);
+        built here if not given
+    hcp_plus_online : OnlineHCPPlus, optional
+        Online HCP++ engine that has ingested the first o_observed test
+        points; used instead of recomputing HCP++ from Z_test
 
     Returns:
     --------
     dict : Results for all 6 methods for this one prediction
     """
-    K = len(Z_cal)
-    if K < 2:
-        raise ValueError("Need at least 2 calibration groups")
-
-    # Baseline: split groups into train/calib halves
-    K0 = K // 2
-    train_idx = list(range(K0))
-    calib_idx = list(range(K0, K))
-
-    # Fit baseline model
-    model_baseline = mu_method_baseline['fit_global'](
-        U_matrix=U_cal,
-        Z_list=Z_cal,
-        group_index_vector=train_idx
-    )
-
-    # Compute scores for baseline methods
-    scores_list = []
-    for j in calib_idx:
-        Zj = Z_cal[j]
-        Uj = U_cal[j, :]
-        yj = np.array([z['Y'] for z in Zj])
-        muj = np.array([
-            mu_method_baseline['predict_global'](
-                model_global=model_baseline,
-                x_vector=z['X'],
-                u_vector=Uj
-            ) for z in Zj
-        ])
-        scores = absolute_residual_score(yj, muj)
-        scores_list.append(scores)
-
-    # Compute interval radii for baseline methods
-    T_hcp = compute_hcp_interval_radius(scores_list, alpha)
-    T_pool = compute_pooling_interval_radius(scores_list, alpha)
-    T_sub = compute_subsampling_once_interval_radius(scores_list, alpha)
-    T_rep = compute_repeated_subsampling_interval_radius(
-        scores_list, alpha, n_subsample_rep
-    )
+    # Baseline model, scores and radii do not depend on the test group
+    if baseline_calibration is None:
+        baseline_calibration = BaselineCalibration(
+            U_cal, Z_cal, mu_method_baseline, number_repetitions=n_subsample_rep
+        )
+    radii = baseline_calibration.radii(alpha)
 
     # Target observation index (o+1 = the NEXT observation we want to predict)
     test_index = o_observed  # 0-indexed
@@ -131,11 +110,7 @@ def run_all_methods_one_prediction(
     x_target = Z_test[test_index]['X']
 
     # Baseline prediction
-    mu_hat = mu_method_baseline['predict_global'](
-        model_global=model_baseline,
-        x_vector=x_target,
-        u_vector=U_test[0, :]
-    )
+    mu_hat = baseline_calibration.predict(x_target, U_test[0, :])
 
     # Helper function to create interval from radius
     def interval_from_radius(center, radius):
@@ -145,16 +120,20 @@ def run_all_methods_one_prediction(
 
     # HCP++ interval
     try:
-        res_pp = compute_hcp_plus_interval(
-            U_calibration=U_cal,
-            Z_calibration=Z_cal,
-            U_test=U_test,
-            Z_test=Z_test[:o_observed+1],  # Include target observation
-            o_observed=o_observed,
-            alpha=alpha,
-            alpha_selection=alpha_selection,
-            mu_method=mu_method_hcp
-        )
+        if hcp_plus_online is not None:
+            res_pp = hcp_plus_online.predict_interval(x_target)
+        else:
+            res_pp = compute_hcp_plus_interval(
+                U_calibration=U_cal,
+                Z_calibration=Z_cal,
+                U_test=U_test,
+                Z_test=Z_test[:o_observed+1],  # Include target observation
+                o_observed=o_observed,
+                alpha=alpha,
+                alpha_selection=alpha_selection,
+                mu_method=mu_method_hcp,
+                model_cache=model_cache
+            )
         int_pp = res_pp['interval']
     except Exception as e:
         print(f"    Warning: HCP++ failed: {e}")
@@ -171,7 +150,8 @@ def run_all_methods_one_prediction(
             alpha=alpha,
             test_index_target=test_index,
             alpha_selection=alpha_selection,
-            mu_method=mu_method_hcp
+            mu_method=mu_method_hcp,
+            model_cache=model_cache
         )
         int_hs = res_hs['interval']
     except Exception as e:
@@ -179,10 +159,10 @@ def run_all_methods_one_prediction(
         int_hs = (-np.inf, np.inf)
 
     # Baseline intervals
-    int_hcp = interval_from_radius(mu_hat, T_hcp)
-    int_pool = interval_from_radius(mu_hat, T_pool)
-    int_sub = interval_from_radius(mu_hat, T_sub)
-    int_rep = interval_from_radius(mu_hat, T_rep)
+    int_hcp = interval_from_radius(mu_hat, radii['HCP'])
+    int_pool = interval_from_radius(mu_hat, radii['Pooling'])
+    int_sub = interval_from_radius(mu_hat, radii['Subsampling'])
+    int_rep = interval_from_radius(mu_hat, radii['Repeated'])
 
     # Helper functions
     def check_coverage(interval, true_value):
@@ -222,7 +202,9 @@ def run_sequential_experiment_one_state(
     alpha_selection=0.5,
     n_subsample_rep=50,
     mu_method_baseline=None,
-    mu_method_hcp=None
+    mu_method_hcp=None,
+    group_rows=None,
+    Z_calibration=None
 ):
     """
     Run sequential online prediction for ONE test state.
@@ -252,13 +234,23 @@ def run_sequential_experiment_one_state(
         Baseline μ-method
     mu_method_hcp : dict
         HCP μ-method
+    group_rows : GroupRows, optional
+        Row positions of every state in df (computed here if not given)
+    Z_calibration : GroupedData, optional
+        Calibration groups of the training states (built from df and X if
+        not given; df and X then only need the test state's rows)
 
     Returns:
     --------
     pd.DataFrame : Results with one row per (test_obs_index, method)
     """
+    if group_rows is None:
+        group_rows = GroupRows(df, 'state_abb')
+
     # Get test state data, ordered by year of entry
-    test_df = df[df['state_abb'] == test_state].sort_values('yoep').reset_index(drop=True)
+    test_df = df[df['state_abb'] == test_state].sort_values('yoep')
+    test_rows = test_df.index.to_numpy()  # rows of df / X, in order of entry
+    test_df = test_df.reset_index(drop=True)
     n_test = len(test_df)
 
     if n_test == 0:
@@ -268,49 +260,47 @@ def run_sequential_experiment_one_state(
     print(f"  Test state {test_state}: {n_test} observations (YOEP range: {test_df['yoep'].min()}-{test_df['yoep'].max()})")
 
     # Create calibration groups (one per training state, ALL observations)
-    Z_calibration = []
-    cal_states_used = []
-
-    for state in training_states:
-        state_df = df[df['state_abb'] == state]
-        if len(state_df) < 1:  # Only skip if truly no data
-            continue
-
-        Z_group = []
-        state_indices = state_df.index.tolist()
-        for idx in state_indices:
-            Z_group.append({
-                'X': X[idx, :],
-                'Y': df.iloc[idx]['y']
-            })
-
-        Z_calibration.append(Z_group)
-        cal_states_used.append(state)
+    if Z_calibration is None:
+        Z_calibration, cal_states_used = group_rows.grouped_data(X, training_states)
 
     n_cal_groups = len(Z_calibration)
-    n_cal_total_obs = sum(len(Z) for Z in Z_calibration)
+    n_cal_total_obs = Z_calibration.n_obs
     print(f"  Calibration: {n_cal_groups} groups, {n_cal_total_obs} total observations")
 
     # U vectors (constant 0 to avoid leakage)
-    U_calibration = np.zeros((n_cal_groups, 1))
+    U_calibration = Z_calibration.U
     U_test = np.zeros((1, 1))
 
+    # The calibration groups are fixed, so global models fitted on the same
+    # subset of groups are reused across predictions, and the baseline model,
+    # scores and radii are computed once for all of them
+    model_cache = GlobalModelCache()
+    baseline_calibration = BaselineCalibration(
+        U_calibration, Z_calibration, mu_method_baseline,
+        number_repetitions=n_subsample_rep
+    )
+
+    # HCP++ is updated one observation at a time instead of being recomputed
+    # from the whole history at every step
+    hcp_plus_online = OnlineHCPPlus(
+        U_calibration, Z_calibration, U_test, alpha, alpha_selection,
+        mu_method_hcp, model_cache=model_cache
+    )
+
+    # Test observations in order of entry; the test group at step o is a
+    # prefix view of these arrays
+    X_test_all = X[test_rows, :]
+    Y_test_all = group_rows.y[test_rows]
+
     # Sequential prediction loop
     all_results = []
-    test_indices = test_df.index.tolist()
 
     for o_observed in range(n_test):
         if (o_observed + 1) % 10 == 0 or o_observed == n_test - 1:
             print(f"    Prediction {o_observed + 1}/{n_test}")
 
-        # Build test group: all observations up to (but not including) current one
-        Z_test = []
-        for i in range(o_observed + 1):  # Need to include target for data structure
-            idx = test_indices[i]
-            Z_test.append({
-                'X': X[idx, :],
-                'Y': df.iloc[idx]['y']
-            })
+        # Test group: all previous observations plus the target
+        Z_test = GroupView(X_test_all[:o_observed + 1], Y_test_all[:o_observed + 1])
 
         # Run all methods
         try:
@@ -324,7 +314,10 @@ def run_sequential_experiment_one_state(
                 alpha_selection=alpha_selection,
                 n_subsample_rep=n_subsample_rep,
                 mu_method_baseline=mu_method_baseline,
-                mu_method_hcp=mu_method_hcp
+                mu_method_hcp=mu_method_hcp,
+                model_cache=model_cache,
+                baseline_calibration=baseline_calibration,
+                hcp_plus_online=hcp_plus_online
             )
 
             # Record results for all methods
@@ -350,6 +343,9 @@ def run_sequential_experiment_one_state(
         except Exception as e:
             print(f"    Error in prediction {o_observed + 1}: {e}")
             continue
+        finally:
+            # the target is observed before the next prediction
+            hcp_plus_online.update(X_test_all[o_observed], Y_test_all[o_observed])
 
     return pd.DataFrame(all_results)
 
@@ -372,6 +368,14 @@ def main():
                        help='Miscoverage level (default: 0.1 for 90%% coverage)')
     parser.add_argument('--seed', type=int, default=123,
                        help='Random seed')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Worker processes for the test states (-1: all cores; default: 1)')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                       help='Cache for the cleaned data and design matrix (default: <output_dir>/../data/cache)')
+    parser.add_argument('--no_cache', action='store_true',
+                       help='Always clean the data from the CSV')
+    parser.add_argument('--mmap_dir', type=str, default=None,
+                       help='Write X, y and state offsets as memory-mapped .npy files here (once per cached data set) and run on them')
 
     args = parser.parse_args()
 
@@ -391,47 +395,78 @@ def main():
     else:
         top_income_quantile = None  # No income filter
 
-    df = load_and_clean_acs_pums(
-        args.pums_csv,
-        states_keep=EMERGING_STATES,
-        top_income_quantile=top_income_quantile
-    )
-
-    # Save filtered data
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
+    data_dir = output_dir.parent / 'data'
+    cache_dir = None if args.no_cache else (args.cache_dir or data_dir / 'cache')
 
-    filtered_data_path = output_dir.parent / 'data' / f'acs_filtered_top{int(args.top_income_pct)}pct.csv'
+    clean_kwargs = dict(
+        states_keep=EMERGING_STATES,
+        top_income_quantile=top_income_quantile
+    )
+    loaded = []
+
+    def load_data():
+        # Cleaned frame (index reset so positions match between df and X)
+        # and design matrix, from the cache when this CSV was cleaned the
+        # same way; loaded at most once
+        if not loaded:
+            loaded.append(load_acs_dataset(args.pums_csv, cache_dir=cache_dir, **clean_kwargs))
+        return loaded[0]
+
+    def select_states(state_counts):
+        # Test states first (either specified or auto-select: states ranked
+        # N+1 to N+5), then the top N states EXCLUDING test states
+        if args.test_states is not None:
+            test_states = args.test_states
+        else:
+            test_states = state_counts.index[args.n_training_states:args.n_training_states+5].tolist()
+        available_for_training = [s for s in state_counts.index if s not in test_states]
+        return test_states, available_for_training[:args.n_training_states]
+
+    # Save filtered data (only when missing or older than the source CSV)
+    filtered_data_path = data_dir / f'acs_filtered_top{int(args.top_income_pct)}pct.csv'
     filtered_data_path.parent.mkdir(parents=True, exist_ok=True)
-    df.to_csv(filtered_data_path, index=False)
-    print(f"\n   Saved filtered data to {filtered_data_path}")
-
-    # Reset index so positions match between df and X
-    df = df.reset_index(drop=True)
-
-    # Build design matrix
-    print("\n2. Building design matrix...")
-    X = build_design_matrix_acs(df)
+    if (not filtered_data_path.exists()
+            or filtered_data_path.stat().st_mtime < Path(args.pums_csv).stat().st_mtime):
+        load_data()[0].to_csv(filtered_data_path, index=False)
+        print(f"\n   Saved filtered data to {filtered_data_path}")
+
+    print("\n2. Design matrix...")
+    layout = None
+    if args.mmap_dir is not None:
+        # X, y, yoep and state offsets as memory-mapped .npy files with the
+        # training states first, so the calibration set is one zero-copy
+        # slice that concurrent runs share through the page cache. The layout
+        # is written once per cached data set; later runs and the workers
+        # open only the mapped arrays, never the full DataFrame
+        source_key = acs_dataset_key(args.pums_csv, cache_dir or args.mmap_dir, **clean_kwargs)
+        layout, _, reused = open_cached_layout(
+            args.mmap_dir, source_key, 'state_abb',
+            lambda sizes: select_states(sizes.sort_values(ascending=False))[1],
+            load_data, columns=['yoep']
+        )
+        loaded.clear()
+        X = layout.X
+        state_counts = layout.group_sizes().sort_values(ascending=False)
+        print(f"   Memory-mapped layout of X, y and state offsets in {args.mmap_dir}"
+              f"{' (reused)' if reused else ''}")
+    else:
+        df, X = load_data()
+        state_counts = df.groupby('state_abb').size().sort_values(ascending=False)
+    n_obs = X.shape[0]
     print(f"   Design matrix shape: {X.shape}")
 
     # Select training and test states
     print("\n3. Selecting training and test states...")
-    state_counts = df.groupby('state_abb').size().sort_values(ascending=False)
     print(f"   State counts:\n{state_counts}")
 
-    # Determine test states first (either specified or auto-select)
+    test_states, training_states = select_states(state_counts)
     if args.test_states is not None:
-        test_states = args.test_states
         print(f"\n   Test states (specified, {len(test_states)}): {test_states}")
     else:
-        # Auto-select: use states ranked N+1 to N+5
-        test_states = state_counts.index[args.n_training_states:args.n_training_states+5].tolist()
         print(f"\n   Test states (auto-selected, {len(test_states)}): {test_states}")
 
-    # Training states: Top N states EXCLUDING test states
-    available_for_training = [s for s in state_counts.index if s not in test_states]
-    training_states = available_for_training[:args.n_training_states]
-
     print(f"   Training states ({len(training_states)}): {training_states}")
 
     # Verify no overlap
@@ -442,17 +477,27 @@ def main():
     # Create μ-methods (using OLS)
     print("\n4. Creating μ-estimation methods (OLS)...")
     mu_baseline = create_mu_method_ols_global_only()
-    mu_hcp = create_mu_method_ols_offset()
+    mu_hcp = create_mu_method_ols_offset(sufficient_statistics=True)
 
     # Run sequential experiments
     print(f"\n5. Running sequential experiments ({len(test_states)} test states)...")
-    all_results = []
+    if layout is not None:
+        group_rows = layout.group_rows()
+    else:
+        group_rows = GroupRows(df, 'state_abb')
 
+    # Every state runs on its own rows against the shared calibration
+    # groups, seeded from its own stream, so results do not depend on --workers
+    Z_calibration, _ = group_rows.grouped_data(X, training_states)
+    unit_kwargs = []
     for test_state in test_states:
-        print(f"\n  Running sequential prediction for {test_state}...")
-        results = run_sequential_experiment_one_state(
-            df=df,
-            X=X,
+        if layout is not None:
+            df_unit, X_unit = layout.unit_data(test_state)
+        else:
+            df_unit, X_unit = unit_data(df, X, group_rows, test_state)
+        unit_kwargs.append(dict(
+            df=df_unit,
+            X=X_unit,
             training_states=training_states,
             test_state=test_state,
             alpha=args.alpha,
@@ -460,8 +505,18 @@ def main():
             n_subsample_rep=50,
             mu_method_baseline=mu_baseline,
             mu_method_hcp=mu_hcp
-        )
-        all_results.append(results)
+        ))
+
+    print(f"   {len(test_states)} states on {args.workers} worker(s); finished states are written to {output_dir / 'units'}")
+    all_results = run_test_units(
+        run_sequential_experiment_one_state,
+        unit_kwargs,
+        Z_calibration,
+        n_workers=args.workers,
+        seed=args.seed,
+        stream_dir=output_dir / 'units',
+        unit_names=[str(u) for u in test_states]
+    )
 
     # Combine results
     print("\n6. Combining and saving results...")
@@ -519,7 +574,7 @@ def main():
     print(f"  - acs_sequential_detailed.csv ({len(full_results)} predictions)")
     print(f"  - acs_sequential_summary.csv (method summaries)")
     print(f"\nFiltered data saved to:")
-    print(f"  - {filtered_data_path} ({len(df)} observations)")
+    print(f"  - {filtered_data_path} ({n_obs} observations)")
 
 
 if __name__ == "__main__":
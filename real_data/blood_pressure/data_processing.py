@@ -10,8 +10,18 @@ This module handles:
 
 import numpy as np
 import pandas as pd
+import sys
+from pathlib import Path
 from typing import List, Dict, Tuple, Optional
 
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from grouped_data import GroupedData, GroupView
+
+sys.path.append(str(Path(__file__).parent.parent))
+from grouping import GroupRows
+from design_matrix import DesignMatrixSchema
+from dataset_cache import DatasetCache, call_params
+
 
 def load_and_clean_bp_data(
     bp_csv_path: str,
@@ -145,18 +155,12 @@ def load_and_clean_bp_data(
     return df
 
 
-def build_design_matrix_bp(df: pd.DataFrame) -> np.ndarray:
+def bp_design_schema(df: pd.DataFrame) -> DesignMatrixSchema:
     """
-    Build design matrix X from cleaned blood pressure data.
-
-    Parameters:
-    -----------
-    df : pd.DataFrame
-        Cleaned blood pressure data
-
-    Returns:
-    --------
-    np.ndarray : Design matrix of shape (n, p)
+    Column layout of the blood pressure design matrix: baseline_sbp and the
+    optional numeric features present in df, then indicators of the
+    categorical variables present (first level dropped). Missing numeric
+    values are filled with the column means.
     """
     # Baseline features to include
     feature_cols = ['baseline_sbp']
@@ -173,17 +177,80 @@ def build_design_matrix_bp(df: pd.DataFrame) -> np.ndarray:
         if col in df.columns:
             cat_cols.append(col)
 
-    if cat_cols:
-        # Create dummy variables
-        dummies = pd.get_dummies(df[cat_cols], drop_first=True, prefix=cat_cols)
-        X = pd.concat([df[feature_cols], dummies], axis=1)
-    else:
-        X = df[feature_cols]
+    return DesignMatrixSchema(
+        numeric_columns=feature_cols,
+        categorical_columns=cat_cols,
+        drop_first=True,
+        fill_missing=True
+    )
 
-    # Drop any remaining NaNs
-    X = X.fillna(X.mean())
 
-    return X.values
+def build_design_matrix_bp(df: pd.DataFrame,
+                           schema: Optional[DesignMatrixSchema] = None,
+                           dtype=np.float64) -> np.ndarray:
+    """
+    Build design matrix X from cleaned blood pressure data.
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        Cleaned blood pressure data
+    schema : DesignMatrixSchema, optional
+        Fitted column layout to encode df with (default: bp_design_schema(df)
+        fitted on df); pass the same schema to encode new rows consistently
+    dtype : numpy dtype
+        np.float64 (default) or np.float32
+
+    Returns:
+    --------
+    np.ndarray : Contiguous design matrix of shape (n, p)
+    """
+    if schema is None:
+        schema = bp_design_schema(df).fit(df)
+    return schema.transform(df, dtype=dtype)
+
+
+def load_bp_dataset(
+    bp_csv_path: str,
+    cache_dir: Optional[str] = None,
+    **clean_kwargs
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Cleaned blood pressure data and its design matrix, read from a
+    content-addressed cache when the same CSV was cleaned with the same
+    parameters before.
+
+    Parameters:
+    -----------
+    bp_csv_path : str
+        Path to blood pressure CSV file
+    cache_dir : str, optional
+        Cache directory (default: None = always clean from the CSV)
+    **clean_kwargs :
+        Options passed to load_and_clean_bp_data (treatment_arm_only,
+        outcome_type, min_clinic_size)
+
+    Returns:
+    --------
+    tuple : (df, X) with df index reset so positions match the rows of X
+    """
+    def build():
+        df = load_and_clean_bp_data(bp_csv_path, **clean_kwargs)
+        df = df.reset_index(drop=True)
+        return df, build_design_matrix_bp(df)
+
+    if cache_dir is None:
+        return build()
+
+    df, X, hit = DatasetCache(cache_dir).get_or_build(
+        bp_csv_path, 'blood_pressure',
+        call_params(load_and_clean_bp_data, None, **clean_kwargs), build,
+        code=(load_and_clean_bp_data, bp_design_schema, build_design_matrix_bp, DesignMatrixSchema),
+        schema=lambda df: bp_design_schema(df).fit(df)
+    )
+    if hit:
+        print(f"Loaded {len(df)} cleaned rows and design matrix {X.shape} from cache {cache_dir}")
+    return df, X
 
 
 def create_bp_hierarchical_data(
@@ -226,21 +293,25 @@ def create_bp_hierarchical_data(
     all_clinics = df['clinic_id'].unique()
     train_clinics = [c for c in all_clinics if c not in test_clinics]
 
+    # Row positions of every clinic, computed once
+    group_rows = GroupRows(df, 'clinic_id')
+    y_all = group_rows.y
     results = {}
 
     for test_clinic in test_clinics:
         # Check if test clinic has enough data
-        test_indices = np.where(df['clinic_id'] == test_clinic)[0]
+        test_indices = group_rows.rows(test_clinic)
         if len(test_indices) < (o_observed + 1):
             print(f"Warning: Test clinic {test_clinic} has only {len(test_indices)} obs, need {o_observed + 1}")
             continue
 
         # Create calibration groups (one per training clinic)
-        Z_calibration = []
+        X_blocks = []
+        Y_blocks = []
         cal_clinics_used = []
 
         for clinic in train_clinics:
-            clinic_indices = np.where(df['clinic_id'] == clinic)[0]
+            clinic_indices = group_rows.rows(clinic)
             if len(clinic_indices) < 2:
                 continue
 
@@ -248,15 +319,8 @@ def create_bp_hierarchical_data(
             n_sample = min(n_per_cal_group, len(clinic_indices))
             sampled_indices = np.random.choice(clinic_indices, size=n_sample, replace=False)
 
-            # Create Z list for this group
-            Z_group = []
-            for idx in sampled_indices:
-                Z_group.append({
-                    'X': X[idx, :],
-                    'Y': df.iloc[idx]['y']
-                })
-
-            Z_calibration.append(Z_group)
+            X_blocks.append(X[sampled_indices, :])
+            Y_blocks.append(y_all[sampled_indices])
             cal_clinics_used.append(clinic)
 
         # Create test group
@@ -269,16 +333,12 @@ def create_bp_hierarchical_data(
         # Shuffle to create random "stream" order
         np.random.shuffle(sampled_test_indices)
 
-        Z_test = []
-        for idx in sampled_test_indices:
-            Z_test.append({
-                'X': X[idx, :],
-                'Y': df.iloc[idx]['y']
-            })
+        Z_test = GroupView(X[sampled_test_indices, :], y_all[sampled_test_indices])
 
         # U vectors (constant 0 to avoid leakage)
-        U_calibration = np.zeros((len(Z_calibration), 1))
+        U_calibration = np.zeros((len(Y_blocks), 1))
         U_test = np.zeros((1, 1))
+        Z_calibration = GroupedData.from_groups(X_blocks, Y_blocks, U_calibration)
 
         results[test_clinic] = {
             'U_calibration': U_calibration,
@@ -30,21 +30,16 @@ from methods import (
 )
 from methods.hcp_plus import compute_hcp_plus_interval
 from methods.hcp_sample import compute_hcp_sample_interval
-from methods.baseline_hcp import (
-    compute_hcp_interval_radius,
-    compute_pooling_interval_radius,
-    compute_subsampling_once_interval_radius,
-    compute_repeated_subsampling_interval_radius
-)
-from scores import absolute_residual_score
 
 from data_processing import (
-    load_and_clean_bp_data,
-    build_design_matrix_bp
+    load_bp_dataset
 )
 
 sys.path.append(str(Path(__file__).parent.parent))
 from format_results import csv_to_markdown_table, add_data_summary_to_markdown
+from grouping import GroupRows
+from unit_runner import run_test_units, unit_data
+from calibration_context import CalibrationContext
 
 
 def run_marginal_experiment_one_clinic(
@@ -53,7 +48,10 @@ def run_marginal_experiment_one_clinic(
     alpha_selection=0.5,
     n_subsample_rep=50,
     mu_method_baseline=None,
-    mu_method_hcp=None
+    mu_method_hcp=None,
+    group_rows=None,
+    Z_calibration=None,
+    calibration_context=None
 ):
     """
     Run marginal coverage experiment for ONE test clinic.
@@ -84,13 +82,25 @@ def run_marginal_experiment_one_clinic(
         Baseline μ-method
     mu_method_hcp : dict
         HCP μ-method
+    group_rows : GroupRows, optional
+        Row positions of every clinic in df (computed here if not given)
+    Z_calibration : GroupedData, optional
+        Calibration groups of the training clinics (built from df and X if
+        not given; df and X then only need the test clinic's rows)
+    calibration_context : CalibrationContext, optional
+        Baseline model, scores, radii and global-model cache of Z_calibration,
+        shared across test units (built here if not given)
 
     Returns:
     --------
     pd.DataFrame : Results with one row per (percentile, method)
     """
+    if group_rows is None:
+        group_rows = GroupRows(df, 'clinic_id')
+
     # Get test clinic data (original order, no permutation)
-    test_df = df[df['clinic_id'] == test_clinic].reset_index(drop=True)
+    test_rows = group_rows.rows(test_clinic)  # rows of df / X
+    test_df = df.iloc[test_rows].reset_index(drop=True)
     n_test = len(test_df)
 
     if n_test < 5:
@@ -105,27 +115,9 @@ def run_marginal_experiment_one_clinic(
     # test_df_sorted['index'] now contains the original positions in test_df
 
     # Create BASE calibration groups from training clinics (fixed across all percentiles)
-    Z_calibration_base = []
-    cal_clinics_used_base = []
-
-    for clinic in training_clinics:
-        clinic_df = df[df['clinic_id'] == clinic]
-        if len(clinic_df) < 1:
-            continue
-
-        Z_group = []
-        clinic_indices = clinic_df.index.tolist()
-        for idx in clinic_indices:
-            Z_group.append({
-                'X': X[idx, :],
-                'Y': df.iloc[idx]['y']
-            })
-
-        Z_calibration_base.append(Z_group)
-        cal_clinics_used_base.append(clinic)
-
-    # Store test indices for use in percentile loop
-    test_indices = test_df.index.tolist()
+    Z_calibration_base = Z_calibration
+    if Z_calibration_base is None:
+        Z_calibration_base, cal_clinics_used_base = group_rows.grouped_data(X, training_clinics)
     U_test = np.zeros((1, 1))
 
     # Determine which observations to test (at baseline SBP percentiles)
@@ -140,7 +132,7 @@ def run_marginal_experiment_one_clinic(
             sorted_idx = int(np.percentile(np.arange(n_test), pct))
 
         # Map from sorted position to original position in test_df
-        original_idx = test_df_sorted.iloc[sorted_idx]['index']
+        original_idx = int(test_df_sorted['index'].iloc[sorted_idx])
 
         # Check if we have enough observations for history
         if original_idx < 1:  # Need at least 1 history observation
@@ -150,12 +142,24 @@ def run_marginal_experiment_one_clinic(
 
     print(f"    Testing at baseline SBP percentiles: {list(percentile_indices.keys())}")
 
+    # The baseline model, scores and radii and the global models of HCP++ /
+    # HCP.sample depend only on the fixed calibration groups, so they are
+    # computed once and shared across percentiles (and test clinics)
+    if calibration_context is None:
+        calibration_context = CalibrationContext(
+            Z_calibration_base, mu_method_baseline, number_repetitions=n_subsample_rep
+        )
+    else:
+        calibration_context.check(Z_calibration_base)
+    radii = calibration_context.radii(alpha)
+    model_cache = calibration_context.model_cache
+
     # Run experiments for each percentile
     all_results = []
 
     for pct, target_index in percentile_indices.items():
         # Calibration: ONLY the 17 FIXED training clinics
-        Z_calibration = list(Z_calibration_base)
+        Z_calibration = Z_calibration_base
         n_cal = len(Z_calibration)
         U_calibration = np.zeros((n_cal, 1))
 
@@ -170,62 +174,15 @@ def run_marginal_experiment_one_clinic(
         o_observed = target_index  # Number of observations in history
 
         # Build Z_test: history (indices 0 to target_index-1) + target (index target_index)
-        Z_test = []
-        for i in range(target_index + 1):  # Includes target
-            if i >= n_test:
-                break
-            idx = test_indices[i]
-            Z_test.append({
-                'X': X[idx, :],
-                'Y': df.iloc[idx]['y']
-            })
+        Z_test = group_rows.group(X, test_clinic, rows=test_rows[:target_index + 1])
 
         # Get target observation
-        target_idx = test_indices[target_index]
-        true_y = df.iloc[target_idx]['y']
+        target_idx = test_rows[target_index]
+        true_y = group_rows.y[target_idx]
         x_target = X[target_idx, :]
 
-        # Baseline methods: split training groups, compute fixed radius
-        K = n_cal
-        K0 = K // 2
-        train_idx = list(range(K0))
-        calib_idx = list(range(K0, K))
-
-        # Fit baseline model
-        model_baseline = mu_method_baseline['fit_global'](
-            U_matrix=U_calibration,
-            Z_list=Z_calibration,
-            group_index_vector=train_idx
-        )
-
-        # Compute scores
-        scores_list = []
-        for j in calib_idx:
-            Zj = Z_calibration[j]
-            Uj = U_calibration[j, :]
-            yj = np.array([z['Y'] for z in Zj])
-            muj = np.array([
-                mu_method_baseline['predict_global'](
-                    model_global=model_baseline,
-                    x_vector=z['X'],
-                    u_vector=Uj
-                ) for z in Zj
-            ])
-            scores = absolute_residual_score(yj, muj)
-            scores_list.append(scores)
-
-        # Compute interval radii
-        T_hcp = compute_hcp_interval_radius(scores_list, alpha)
-        T_pool = compute_pooling_interval_radius(scores_list, alpha)
-        T_sub = compute_subsampling_once_interval_radius(scores_list, alpha)
-        T_rep = compute_repeated_subsampling_interval_radius(scores_list, alpha, n_subsample_rep)
-
         # Baseline prediction (global estimate only, no within-group offset)
-        mu_hat_baseline = mu_method_baseline['predict_global'](
-            model_global=model_baseline,
-            x_vector=x_target,
-            u_vector=U_test[0, :]
-        )
+        mu_hat_baseline = calibration_context.predict_baseline(x_target, U_test[0, :])
 
         # Helper function
         def interval_from_radius(center, radius):
@@ -243,7 +200,8 @@ def run_marginal_experiment_one_clinic(
                 o_observed=o_observed,
                 alpha=alpha,
                 alpha_selection=alpha_selection,
-                mu_method=mu_method_hcp
+                mu_method=mu_method_hcp,
+                model_cache=model_cache
             )
             int_pp = res_pp['interval']
             mu_hat_hcp_methods = res_pp.get('mu_hat', mu_hat_baseline)
@@ -263,7 +221,8 @@ def run_marginal_experiment_one_clinic(
                 alpha=alpha,
                 test_index_target=target_index,
                 alpha_selection=alpha_selection,
-                mu_method=mu_method_hcp
+                mu_method=mu_method_hcp,
+                model_cache=model_cache
             )
             int_hs = res_hs['interval']
         except Exception as e:
@@ -271,10 +230,10 @@ def run_marginal_experiment_one_clinic(
             int_hs = (-np.inf, np.inf)
 
         # Baseline intervals (all use baseline mu estimate)
-        int_hcp = interval_from_radius(mu_hat_baseline, T_hcp)
-        int_pool = interval_from_radius(mu_hat_baseline, T_pool)
-        int_sub = interval_from_radius(mu_hat_baseline, T_sub)
-        int_rep = interval_from_radius(mu_hat_baseline, T_rep)
+        int_hcp = interval_from_radius(mu_hat_baseline, radii['HCP'])
+        int_pool = interval_from_radius(mu_hat_baseline, radii['Pooling'])
+        int_sub = interval_from_radius(mu_hat_baseline, radii['Subsampling'])
+        int_rep = interval_from_radius(mu_hat_baseline, radii['Repeated'])
 
         # Check coverage
         def check_coverage(interval, true_value):
@@ -328,6 +287,12 @@ def main():
                        help='Miscoverage level (default: 0.2 for 80%% coverage)')
     parser.add_argument('--seed', type=int, default=123,
                        help='Random seed')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Worker processes for the test clinics (-1: all cores; default: 1)')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                       help='Cache for the cleaned data and design matrix (default: <output_dir>/../../data/cache)')
+    parser.add_argument('--no_cache', action='store_true',
+                       help='Always clean the data from the CSV')
 
     args = parser.parse_args()
 
@@ -341,19 +306,20 @@ def main():
     print("\n1. Loading and cleaning BP data...")
     print("   Treatment arm only, no additional filters")
 
-    df = load_and_clean_bp_data(
+    output_dir = Path(args.output_dir)
+    cache_dir = None if args.no_cache else (args.cache_dir or output_dir.parent.parent / 'data' / 'cache')
+
+    # Cleaned frame (index reset) and design matrix, from the cache when this
+    # CSV was cleaned the same way
+    df, X = load_bp_dataset(
         args.bp_csv,
+        cache_dir=cache_dir,
         treatment_arm_only=True,
         outcome_type='followup',
         min_clinic_size=5
     )
 
-    # Reset index
-    df = df.reset_index(drop=True)
-
-    # Build design matrix
-    print("\n2. Building design matrix...")
-    X = build_design_matrix_bp(df)
+    print("\n2. Design matrix...")
     print(f"   Design matrix shape: {X.shape}")
 
     # Select training and test clinics
@@ -373,26 +339,45 @@ def main():
     # Create μ-methods (using OLS)
     print("\n4. Creating μ-estimation methods (OLS)...")
     mu_baseline = create_mu_method_ols_global_only()
-    mu_hcp = create_mu_method_ols_offset()
+    mu_hcp = create_mu_method_ols_offset(sufficient_statistics=True)
 
     # Run marginal experiments
     print(f"\n5. Running marginal experiments ({len(test_clinics)} test clinics)...")
-    all_results = []
-
+    group_rows = GroupRows(df, 'clinic_id')
+
+    # Every clinic runs on its own rows against the shared calibration
+    # groups and calibration context (baseline model, scores, radii), seeded
+    # from its own stream, so results do not depend on --workers
+    Z_calibration, _ = group_rows.grouped_data(X, training_clinics)
+    calibration_context = CalibrationContext(
+        Z_calibration, mu_baseline, number_repetitions=50, alphas=[args.alpha]
+    )
+    unit_kwargs = []
     for test_clinic in test_clinics:
-        print(f"\n  Running marginal coverage for clinic {test_clinic}...")
-        results = run_marginal_experiment_one_clinic(
-            df=df,
-            X=X,
+        df_unit, X_unit = unit_data(df, X, group_rows, test_clinic)
+        unit_kwargs.append(dict(
+            df=df_unit,
+            X=X_unit,
             training_clinics=training_clinics,
             test_clinic=test_clinic,
             alpha=args.alpha,
             alpha_selection=0.5,
             n_subsample_rep=50,
             mu_method_baseline=mu_baseline,
-            mu_method_hcp=mu_hcp
-        )
-        all_results.append(results)
+            mu_method_hcp=mu_hcp,
+            calibration_context=calibration_context
+        ))
+
+    print(f"   {len(test_clinics)} clinics on {args.workers} worker(s); finished clinics are written to {output_dir / 'units'}")
+    all_results = run_test_units(
+        run_marginal_experiment_one_clinic,
+        unit_kwargs,
+        Z_calibration,
+        n_workers=args.workers,
+        seed=args.seed,
+        stream_dir=output_dir / 'units',
+        unit_names=[str(u) for u in test_clinics]
+    )
 
     # Combine results
     print("\n6. Combining and saving results...")
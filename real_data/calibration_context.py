@@ -0,0 +1,91 @@
+"""
+Calibration Context of a Real-Data Run
+
+The marginal runners evaluate every test unit (state, clinic) and every
+history length against the same calibration groups of the training units.
+Everything derived from those groups alone — the baseline split, baseline
+model, calibration scores and interval radii, and the global models of
+HCP++ / HCP.sample — is therefore computed once per run in a
+CalibrationContext and shared by all test units and percentiles.
+
+The context holds no calibration observations (only their fingerprint).
+When it is pickled for a worker process it carries the baseline model and
+the radii derived so far, but not the O(n) baseline calibration scores, so
+every level a worker asks for has to be passed as `alphas`. Workers
+receive the calibration data itself through shared memory.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+from grouped_data import as_grouped_data
+from methods.baseline_hcp import BaselineCalibration
+from methods.model_cache import GlobalModelCache
+
+
+class CalibrationContext:
+    """
+    Quantities derived from the fixed calibration groups of a run.
+
+    Parameters:
+    -----------
+    Z_calibration : GroupedData or list
+        Calibration groups of the training units
+    mu_method_baseline : dict
+        Baseline μ-method (only the global model is used)
+    number_repetitions : int
+        Repetitions of the repeated subsampling baseline (default: 50)
+    alphas : iterable of float
+        Levels whose radii are derived up front (default: none); deriving
+        them before the context is shared keeps the random subsampling
+        baselines independent of which unit asks first, and a pickled
+        context can only answer these levels
+    U_calibration : ndarray of shape (K, d), optional
+        Group-level covariates (default: the ones stored in Z_calibration)
+    rng : numpy.random.Generator, optional
+        Random number generator for the subsampling baselines
+        (default: the global np.random state)
+    repeated_mode : str
+        'sample' (default) or 'expected' radius of the repeated subsampling
+        baseline (see BaselineCalibration)
+
+    Attributes:
+    -----------
+    baseline : BaselineCalibration
+        Baseline model, calibration scores and radii (memoized per alpha)
+    model_cache : GlobalModelCache
+        Global models of HCP++ / HCP.sample, shared across units
+    fingerprint : str
+        Fingerprint of the calibration data the context was built from
+    """
+
+    def __init__(self, Z_calibration, mu_method_baseline, number_repetitions=50,
+                 alphas=(), U_calibration=None, rng=None, repeated_mode='sample'):
+        calibration = as_grouped_data(Z_calibration, U_calibration)
+        self.fingerprint = calibration.fingerprint()
+        self.n_groups = calibration.n_groups
+        self.n_obs = calibration.n_obs
+        self.baseline = BaselineCalibration(
+            calibration.U, calibration, mu_method_baseline,
+            number_repetitions=number_repetitions, rng=rng,
+            repeated_mode=repeated_mode
+        )
+        self.model_cache = GlobalModelCache()
+        for alpha in alphas:
+            self.radii(alpha)
+
+    def check(self, Z_calibration):
+        """Raise ValueError if Z_calibration is not the data of this context."""
+        if as_grouped_data(Z_calibration).fingerprint() != self.fingerprint:
+            raise ValueError("CalibrationContext: built from different calibration data")
+
+    def radii(self, alpha):
+        """Baseline radii at level alpha (derived on the first request of each alpha)."""
+        return self.baseline.radii(alpha)
+
+    def predict_baseline(self, x_vector, u_vector):
+        """Baseline point prediction μ̂(x) for one test observation."""
+        return self.baseline.predict(np.asarray(x_vector), u_vector)
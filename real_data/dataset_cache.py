@@ -0,0 +1,307 @@
+"""
+Content-Addressed Cache of Cleaned Data Sets
+
+Cleaning the ACS PUMS extract means parsing hundreds of MB of CSV on every
+run, although the cleaned frame and its design matrix only change when the
+source file or a filter parameter changes. DatasetCache stores both under a
+key derived from the source file's content hash and the cleaning parameters:
+the frame as Parquet (pickle if neither pyarrow nor fastparquet is installed)
+and the design matrix as a float64 .npy file, with the column dtypes recorded
+explicitly in a JSON manifest. The content hash of a source file is itself
+remembered by (path, size, mtime) so unchanged files are not re-hashed.
+
+The key also covers the source code of the cleaning and design-matrix
+routines, so editing them invalidates the entries they built. The fitted
+design-matrix schema (its definition and column names, i.e. the levels) is
+recorded in the manifest and checked against a schema refitted on the cached
+frame when the entry is loaded.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    FRAME_FORMAT = 'parquet'
+except ImportError:
+    try:
+        import fastparquet  # noqa: F401
+        FRAME_FORMAT = 'parquet'
+    except ImportError:  # dtypes are then preserved through pickle
+        FRAME_FORMAT = 'pickle'
+
+
+CACHE_VERSION = 1
+_DIGEST_INDEX = 'source_digests.json'
+_MANIFEST = 'manifest.json'
+
+
+def file_digest(path, chunk_size=1 << 24):
+    """blake2b hex digest of the content of a file."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _describe(value):
+    """JSON-compatible description of a cleaning parameter."""
+    if callable(value):
+        return f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', repr(value))}"
+    if isinstance(value, (list, tuple)):
+        return [_describe(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _describe(v) for k, v in sorted(value.items())}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def code_digest(*objects):
+    """
+    Hash of the source code of functions / classes (their bytecode if the
+    source is not available).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for obj in objects:
+        digest.update(f"{getattr(obj, '__module__', '')}.{getattr(obj, '__qualname__', '')}".encode())
+        try:
+            digest.update(inspect.getsource(obj).encode())
+        except (OSError, TypeError):
+            digest.update(getattr(getattr(obj, '__code__', None), 'co_code', repr(obj).encode()))
+    return digest.hexdigest()
+
+
+def describe_schema(schema):
+    """JSON description of a fitted DesignMatrixSchema (definition and columns)."""
+    if schema is None:
+        return None
+    return {
+        'numeric_columns': list(schema.numeric_columns),
+        'categorical_columns': list(schema.categorical_columns),
+        'prefixes': list(schema.prefixes),
+        'drop_first': bool(schema.drop_first),
+        'fill_missing': bool(schema.fill_missing),
+        'columns': [str(c) for c in schema.columns]
+    }
+
+
+def call_params(func, *args, **kwargs):
+    """
+    All parameters of a call to func, defaults included, so a data set
+    cleaned with explicit default values and one cleaned with omitted
+    defaults share a key.
+    """
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return dict(bound.arguments)
+
+
+class DatasetCache:
+    """
+    Cache of (cleaned frame, design matrix) pairs in a directory.
+
+    Parameters:
+    -----------
+    cache_dir : str or Path
+        Directory holding one subdirectory per cached data set
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+
+    def source_digest(self, path):
+        """
+        Content hash of a source file, re-hashed only when its size or
+        modification time changed since it was last hashed.
+        """
+        path = Path(path).resolve()
+        stat = path.stat()
+        index_path = self.cache_dir / _DIGEST_INDEX
+        index = {}
+        if index_path.exists():
+            try:
+                index = json.loads(index_path.read_text())
+            except ValueError:
+                index = {}
+
+        entry = index.get(str(path))
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['digest']
+
+        digest = file_digest(path)
+        index[str(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': digest}
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        _atomic_write_text(index_path, json.dumps(index, indent=1))
+        return digest
+
+    def key(self, source_path, loader, params, code=()):
+        """
+        Cache key of a data set.
+
+        Parameters:
+        -----------
+        source_path : str or Path
+            Raw data file the data set is built from
+        loader : str
+            Name of the cleaning routine (keeps ACS and BP entries apart)
+        params : dict
+            Cleaning parameters; callables are identified by module.qualname
+        code : iterable of functions / classes
+            Routines that build the data set; their source is part of the key
+
+        Returns:
+        --------
+        str : Hex key
+        """
+        description = {
+            'version': CACHE_VERSION,
+            'loader': loader,
+            'source': self.source_digest(source_path),
+            'params': _describe(params),
+            'code': code_digest(*code)
+        }
+        payload = json.dumps(description, sort_keys=True).encode()
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    def load(self, key, schema=None):
+        """
+        Cached (df, X) for key, or None if the key is not cached (or, with
+        schema, if the schema refitted on the cached frame does not match
+        the recorded one).
+
+        Parameters:
+        -----------
+        key : str
+            Cache key
+        schema : callable, optional
+            schema(df) -> fitted DesignMatrixSchema of the design matrix
+        """
+        entry = self.cache_dir / key
+        manifest_path = entry / _MANIFEST
+        if not manifest_path.exists():
+            return None
+        manifest = json.loads(manifest_path.read_text())
+
+        frame_path = entry / manifest['frame_file']
+        if manifest['frame_format'] == 'parquet':
+            if FRAME_FORMAT != 'parquet':
+                return None
+            df = pd.read_parquet(frame_path)
+        else:
+            df = pd.read_pickle(frame_path)
+        df = _restore_dtypes(df, manifest['dtypes'], manifest['categories'])
+
+        X = np.load(entry / 'X.npy')
+        if X.shape != tuple(manifest['X_shape']) or len(df) != X.shape[0]:
+            return None
+        if schema is not None and describe_schema(schema(df)) != manifest.get('schema'):
+            return None
+        return df, X
+
+    def store(self, key, df, X, params=None, schema=None):
+        """
+        Store (df, X) under key. The entry is written to a temporary directory
+        and renamed into place, so readers never see a partial entry.
+
+        schema (schema(df) -> fitted DesignMatrixSchema) is recorded in the
+        manifest so load can check it.
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        df = df.reset_index(drop=True)
+
+        tmp = Path(tempfile.mkdtemp(prefix=f'.{key}.', dir=self.cache_dir))
+        try:
+            if FRAME_FORMAT == 'parquet':
+                frame_file = 'frame.parquet'
+                df.to_parquet(tmp / frame_file, index=False)
+            else:
+                frame_file = 'frame.pkl'
+                df.to_pickle(tmp / frame_file)
+            np.save(tmp / 'X.npy', X)
+
+            manifest = {
+                'version': CACHE_VERSION,
+                'frame_file': frame_file,
+                'frame_format': FRAME_FORMAT,
+                'dtypes': {col: str(dtype) for col, dtype in df.dtypes.items()},
+                'categories': {
+                    col: {'categories': [_describe(c) for c in df[col].cat.categories],
+                          'ordered': bool(df[col].cat.ordered)}
+                    for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)
+                },
+                'X_shape': list(X.shape),
+                'X_dtype': str(X.dtype),
+                'params': _describe(params or {}),
+                'schema': describe_schema(schema(df)) if schema is not None else None
+            }
+            (tmp / _MANIFEST).write_text(json.dumps(manifest, indent=1))
+
+            entry = self.cache_dir / key
+            if entry.exists():
+                shutil.rmtree(entry)
+            os.replace(tmp, entry)
+        finally:
+            if tmp.exists():
+                shutil.rmtree(tmp)
+
+    def get_or_build(self, source_path, loader, params, build, code=(), schema=None):
+        """
+        Cached (df, X) for the data set, building and storing it on a miss.
+
+        Parameters:
+        -----------
+        source_path : str or Path
+            Raw data file the data set is built from
+        loader : str
+            Name of the cleaning routine
+        params : dict
+            Cleaning parameters
+        build : callable
+            build() -> (df, X), called on a cache miss
+        code : iterable of functions / classes
+            Routines that build the data set (part of the key)
+        schema : callable, optional
+            schema(df) -> fitted DesignMatrixSchema of X (recorded and checked)
+
+        Returns:
+        --------
+        tuple : (df, X, hit) with hit True if the data came from the cache
+        """
+        key = self.key(source_path, loader, params, code=code)
+        cached = self.load(key, schema=schema)
+        if cached is not None:
+            return cached[0], cached[1], True
+        df, X = build()
+        self.store(key, df, X, params=params, schema=schema)
+        return df.reset_index(drop=True), X, False
+
+
+def _restore_dtypes(df, dtypes, categories):
+    """Cast columns back to the dtypes recorded in the manifest."""
+    for col, dtype in dtypes.items():
+        if col in categories:
+            target = pd.CategoricalDtype(categories[col]['categories'],
+                                         ordered=categories[col]['ordered'])
+            if df[col].dtype != target:
+                df[col] = df[col].astype(target)
+        elif str(df[col].dtype) != dtype:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def _atomic_write_text(path, text):
+    fd, tmp = tempfile.mkstemp(prefix=f'.{path.name}.', dir=path.parent)
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
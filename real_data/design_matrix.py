@@ -0,0 +1,176 @@
+"""
+Schema-Driven Design Matrices
+
+pd.concat of numeric columns with pd.get_dummies frames followed by .values
+gives an object array whenever int and bool columns are mixed, and every
+μ-method then converts it to float again. DesignMatrixSchema records the
+column layout once (numeric columns, then one block of indicator columns per
+categorical variable) and encodes any frame with that layout directly into a
+contiguous float64 / float32 array or a sparse CSR matrix. New rows (e.g. a
+later data pull) are encoded consistently: levels unseen at fit time get all
+indicators 0 and missing numeric values are filled with the fitted means.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class DesignMatrixSchema:
+    """
+    Column layout of a design matrix.
+
+    Parameters:
+    -----------
+    numeric_columns : list of str
+        Columns copied as they are
+    categorical_columns : list of str
+        Columns expanded to indicator (one-hot) columns
+    prefixes : list of str, optional
+        Name prefix of each categorical block (default: the column names)
+    drop_first : bool
+        Drop the indicator of the first level of each categorical column
+        (default: True, as pd.get_dummies(drop_first=True))
+    fill_missing : bool
+        Replace missing numeric values by the column mean at fit time
+        (default: False)
+
+    Attributes (after fit):
+    -----------------------
+    levels : dict
+        Categorical column -> array of levels that get an indicator column
+    fill_values : dict
+        Numeric column -> fill value (only with fill_missing)
+    columns : list of str
+        Names of the design-matrix columns in order
+    """
+
+    def __init__(self, numeric_columns, categorical_columns=(), prefixes=None,
+                 drop_first=True, fill_missing=False):
+        self.numeric_columns = list(numeric_columns)
+        self.categorical_columns = list(categorical_columns)
+        if prefixes is None:
+            prefixes = self.categorical_columns
+        if len(prefixes) != len(self.categorical_columns):
+            raise ValueError("DesignMatrixSchema: one prefix per categorical column is required")
+        self.prefixes = list(prefixes)
+        self.drop_first = drop_first
+        self.fill_missing = fill_missing
+        self.levels = None
+        self.fill_values = {}
+
+    @property
+    def is_fitted(self):
+        return self.levels is not None
+
+    @property
+    def columns(self):
+        self._check_fitted()
+        names = list(self.numeric_columns)
+        for col, prefix in zip(self.categorical_columns, self.prefixes):
+            names.extend(f"{prefix}_{level}" for level in self.levels[col])
+        return names
+
+    @property
+    def n_features(self):
+        return len(self.columns)
+
+    def _check_fitted(self):
+        if not self.is_fitted:
+            raise ValueError("DesignMatrixSchema: call fit() before encoding")
+
+    def fit(self, df):
+        """
+        Record the levels of the categorical columns (and the numeric fill
+        values) from df. Levels follow pd.get_dummies: the category order of
+        a categorical column, otherwise the sorted observed values.
+
+        Returns:
+        --------
+        DesignMatrixSchema : self
+        """
+        self.levels = {}
+        for col in self.categorical_columns:
+            values = df[col]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                levels = np.asarray(values.cat.categories)
+            else:
+                levels = np.sort(values.dropna().unique())
+            self.levels[col] = levels[1:] if self.drop_first else levels
+
+        self.fill_values = {}
+        if self.fill_missing:
+            for col in self.numeric_columns:
+                self.fill_values[col] = float(df[col].astype(float).mean())
+        return self
+
+    def _numeric_block(self, df, dtype):
+        block = np.empty((len(df), len(self.numeric_columns)), dtype=dtype)
+        for k, col in enumerate(self.numeric_columns):
+            values = df[col].to_numpy(dtype=float, na_value=np.nan)
+            if col in self.fill_values:
+                values = np.where(np.isnan(values), self.fill_values[col], values)
+            block[:, k] = values
+        return block
+
+    def _indicator_codes(self, df):
+        """Per categorical column: the indicator column hit by each row (-1: none)."""
+        codes = []
+        for col in self.categorical_columns:
+            # -1 for values without an indicator column (the dropped first
+            # level, levels unseen at fit time) and for missing values
+            codes.append(pd.Index(self.levels[col]).get_indexer(df[col]))
+        return codes
+
+    def transform(self, df, dtype=np.float64, sparse=False):
+        """
+        Encode df with the fitted layout.
+
+        Parameters:
+        -----------
+        df : pd.DataFrame
+            Data with the schema's columns
+        dtype : numpy dtype
+            np.float64 (default) or np.float32
+        sparse : bool
+            Return a scipy.sparse CSR matrix instead of a dense array
+            (default: False)
+
+        Returns:
+        --------
+        np.ndarray (C-contiguous) or scipy.sparse.csr_matrix of shape (n, p)
+        """
+        self._check_fitted()
+        n = len(df)
+        p_numeric = len(self.numeric_columns)
+        codes = self._indicator_codes(df)
+        widths = [len(self.levels[col]) for col in self.categorical_columns]
+        starts = p_numeric + np.concatenate([[0], np.cumsum(widths)]).astype(np.int64)
+
+        if sparse:
+            from scipy import sparse as sp
+            numeric = sp.csr_matrix(self._numeric_block(df, dtype))
+            if len(codes) == 0:
+                return numeric
+            rows, cols = [], []
+            for k, code in enumerate(codes):
+                hit = np.flatnonzero(code >= 0)
+                rows.append(hit)
+                cols.append(starts[k] + code[hit])
+            rows = np.concatenate(rows)
+            cols = np.concatenate(cols)
+            indicators = sp.csr_matrix(
+                (np.ones(rows.shape[0], dtype=dtype), (rows, cols - p_numeric)),
+                shape=(n, int(starts[-1]) - p_numeric)
+            )
+            return sp.hstack([numeric, indicators], format='csr', dtype=dtype)
+
+        X = np.zeros((n, int(starts[-1])), dtype=dtype)
+        X[:, :p_numeric] = self._numeric_block(df, dtype)
+        for k, code in enumerate(codes):
+            hit = np.flatnonzero(code >= 0)
+            X[hit, starts[k] + code[hit]] = 1
+        return X
+
+    def fit_transform(self, df, dtype=np.float64, sparse=False):
+        """fit(df) followed by transform(df)."""
+        return self.fit(df).transform(df, dtype=dtype, sparse=sparse)
@@ -0,0 +1,357 @@
+"""
+Group Materialization for Real-Data Experiments
+
+The real-data runners build calibration and test groups (states, clinics)
+from a cleaned DataFrame and its design matrix. The row positions of every
+group are computed once with groupby().indices; groups are then materialized
+by fancy-indexing the response column and the design matrix, without any
+per-row DataFrame access.
+
+For data sets too large to copy into every process, write_group_layout
+stores X, y and the group offsets as .npy files with the rows sorted by
+group. open_group_layout maps them back read-only (np.load with mmap_mode),
+every group is then a contiguous row range, and groups and calibration sets
+of adjacent groups are zero-copy slices of the shared mapping. A layout
+records the key of the cached data set it was written from (and a few
+per-row columns the test units need, e.g. income), so open_cached_layout
+loads the cleaned DataFrame only to write the layout once; later runs and
+worker processes open just the mapped arrays.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from grouped_data import GroupedData, GroupView
+
+
+class GroupRows:
+    """
+    Positional row indices of every group of a DataFrame.
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        Data with one row per observation (rows of df line up with the rows
+        of the design matrix)
+    group_column : str
+        Column identifying the group (e.g. 'state_abb', 'clinic_id')
+    response_column : str
+        Response column (default: 'y')
+
+    Attributes:
+    -----------
+    indices : dict
+        Group label -> ascending array of row positions
+    y : ndarray of shape (n,)
+        Response column as float64
+    """
+
+    def __init__(self, df, group_column, response_column='y'):
+        self.group_column = group_column
+        self.indices = {
+            key: np.asarray(rows, dtype=np.int64)
+            for key, rows in df.groupby(group_column, sort=False).indices.items()
+        }
+        self.y = df[response_column].to_numpy(dtype=float)
+        self.ranges = {}
+
+    @classmethod
+    def from_offsets(cls, keys, offsets, y, group_column):
+        """
+        Row positions of a group-sorted layout: group keys[j] owns rows
+        offsets[j]:offsets[j + 1].
+        """
+        group_rows = cls.__new__(cls)
+        group_rows.group_column = group_column
+        group_rows.ranges = {
+            key: (int(offsets[j]), int(offsets[j + 1])) for j, key in enumerate(keys)
+        }
+        group_rows.indices = {
+            key: np.arange(start, stop, dtype=np.int64)
+            for key, (start, stop) in group_rows.ranges.items()
+        }
+        group_rows.y = y
+        return group_rows
+
+    def __contains__(self, key):
+        return key in self.indices
+
+    def rows(self, key):
+        """Row positions of group key (empty if the group has no rows)."""
+        return self.indices.get(key, np.zeros(0, dtype=np.int64))
+
+    def size(self, key):
+        """Number of rows of group key."""
+        return self.rows(key).shape[0]
+
+    def group(self, X, key, rows=None):
+        """
+        One group as a GroupView over (X[rows], y[rows]).
+
+        Parameters:
+        -----------
+        X : ndarray of shape (n, p)
+            Design matrix
+        key : hashable
+            Group label
+        rows : array-like of int, optional
+            Row positions in the desired order (default: all rows of the
+            group in data order)
+        """
+        if rows is None and key in self.ranges:
+            start, stop = self.ranges[key]
+            return GroupView(X[start:stop], self.y[start:stop])
+        rows = self.rows(key) if rows is None else np.asarray(rows, dtype=np.int64)
+        return GroupView(X[rows], self.y[rows])
+
+    def grouped_data(self, X, keys, min_size=1, U=None):
+        """
+        Calibration data for the groups in keys, in that order.
+
+        Parameters:
+        -----------
+        X : ndarray of shape (n, p)
+            Design matrix
+        keys : list
+            Group labels
+        min_size : int
+            Groups with fewer rows are skipped (default: 1)
+        U : ndarray of shape (K, d), optional
+            Group-level covariates of the used groups (default: one constant
+            zero column)
+
+        Returns:
+        --------
+        tuple : (GroupedData, list of the group labels used)
+        """
+        used = [key for key in keys if self.size(key) >= min_size]
+        if U is None:
+            U = np.zeros((len(used), 1))
+        data = GroupedData.from_rows(X, self.y, [self.rows(key) for key in used], U)
+        return data, used
+
+
+class GroupLayout:
+    """
+    Group-sorted data set opened from the .npy files of write_group_layout.
+
+    Attributes:
+    -----------
+    X : ndarray of shape (n, p)
+        Design matrix, rows sorted by group (read-only memory map)
+    y : ndarray of shape (n,)
+        Responses in the same row order (read-only memory map)
+    offsets : ndarray of shape (K + 1,)
+        Group keys[j] owns rows offsets[j]:offsets[j + 1]
+    keys : list
+        Group labels in layout order
+    positions : ndarray of shape (n,)
+        Row of the original DataFrame stored at each layout row
+    columns : dict
+        Name -> per-row column in layout order (read-only memory maps)
+    source_key : str or None
+        Key of the cached data set the layout was written from
+    """
+
+    def __init__(self, directory, mmap_mode='r'):
+        directory = Path(directory)
+        meta = json.loads((directory / 'layout.json').read_text())
+        self.directory = directory
+        self.group_column = meta['group_column']
+        self.keys = meta['keys']
+        self.fingerprint = meta['fingerprint']
+        self.X = np.load(directory / 'X.npy', mmap_mode=mmap_mode)
+        self.y = np.load(directory / 'y.npy', mmap_mode=mmap_mode)
+        self.offsets = np.load(directory / 'offsets.npy')
+        self.positions = np.load(directory / 'positions.npy', mmap_mode=mmap_mode)
+        self.columns = {
+            name: np.load(directory / f'column_{name}.npy', mmap_mode=mmap_mode)
+            for name in meta.get('columns', [])
+        }
+        self.source_key = meta.get('source_key')
+
+    def __reduce__(self):
+        # Pickled as its directory: a worker process reopens the mapping
+        return (open_group_layout, (self.directory,))
+
+    def group_rows(self):
+        """GroupRows over the layout (groups are contiguous row ranges)."""
+        return GroupRows.from_offsets(self.keys, self.offsets, self.y, self.group_column)
+
+    def group_sizes(self):
+        """Rows per group as a Series indexed by sorted group label, like df.groupby(...).size()."""
+        sizes = pd.Series(np.diff(self.offsets), index=pd.Index(self.keys, name=self.group_column))
+        return sizes.sort_index()
+
+    def unit_data(self, key, response_column='y'):
+        """
+        Rows of one group without the full DataFrame: (small frame with the
+        group column, the response and the stored columns, index reset; the
+        group's rows of X as a zero-copy slice of the mapping).
+        """
+        j = self.keys.index(key)
+        start, stop = int(self.offsets[j]), int(self.offsets[j + 1])
+        frame = pd.DataFrame({name: np.asarray(column[start:stop]) for name, column in self.columns.items()})
+        frame.insert(0, response_column, np.asarray(self.y[start:stop]))
+        frame.insert(0, self.group_column, key)
+        return frame, self.X[start:stop]
+
+
+def _layout_fingerprint(X, y, codes, positions, *columns):
+    h = hashlib.blake2b(digest_size=16)
+    for array in (positions, codes, y, X) + columns:
+        h.update(str(array.shape).encode())
+        h.update(np.ascontiguousarray(array).data)
+    return h.hexdigest()
+
+
+def write_group_layout(directory, df, X, group_column, response_column='y', group_order=None,
+                       columns=(), source_key=None):
+    """
+    Write X, y and the group offsets of df as .npy files with the rows sorted
+    by group (data order within a group). Nothing is rewritten when the
+    directory already holds the same layout, so concurrent runs and worker
+    processes can all call this and then open_group_layout.
+
+    Parameters:
+    -----------
+    directory : str or Path
+        Output directory
+    df : pd.DataFrame
+        Data with one row per observation, lined up with the rows of X
+    X : ndarray of shape (n, p)
+        Design matrix
+    group_column : str
+        Column identifying the group
+    response_column : str
+        Response column (default: 'y')
+    group_order : list, optional
+        Groups first in the layout, in this order (e.g. the calibration
+        groups, so the calibration set is one contiguous slice); remaining
+        groups follow in order of first appearance
+    columns : list of str
+        Numeric columns of df stored alongside X and y (default: none)
+    source_key : str, optional
+        Key of the cached data set df and X come from (see
+        dataset_cache.DatasetCache.key), used by open_cached_layout
+
+    Returns:
+    --------
+    Path : directory
+    """
+    directory = Path(directory)
+    group_rows = GroupRows(df, group_column, response_column)
+    keys = [key for key in (group_order or []) if key in group_rows]
+    keys += [key for key in group_rows.indices if key not in set(keys)]
+
+    positions = np.concatenate([group_rows.rows(key) for key in keys]) if keys else np.zeros(0, dtype=np.int64)
+    sizes = np.array([group_rows.size(key) for key in keys], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    X_sorted = np.ascontiguousarray(np.asarray(X, dtype=np.float64)[positions])
+    y_sorted = group_rows.y[positions]
+    codes = np.repeat(np.arange(len(keys), dtype=np.int64), sizes)
+    extra = {name: df[name].to_numpy()[positions] for name in columns}
+    fingerprint = _layout_fingerprint(X_sorted, y_sorted, codes, positions, *extra.values())
+
+    meta_path = directory / 'layout.json'
+    if meta_path.exists():
+        try:
+            existing = json.loads(meta_path.read_text())
+            if (existing.get('fingerprint') == fingerprint and existing.get('source_key') == source_key
+                    and existing.get('columns', []) == list(columns)):
+                return directory
+        except ValueError:
+            pass
+
+    directory.mkdir(parents=True, exist_ok=True)
+    arrays = [('X', X_sorted), ('y', y_sorted), ('offsets', offsets), ('positions', positions)]
+    arrays += [(f'column_{name}', array) for name, array in extra.items()]
+    for name, array in arrays:
+        tmp = directory / f'.{name}.{os.getpid()}.npy'
+        np.save(tmp, array)
+        os.replace(tmp, directory / f'{name}.npy')
+    meta = {
+        'group_column': group_column,
+        'keys': [key.item() if isinstance(key, np.generic) else key for key in keys],
+        'n_obs': int(offsets[-1]),
+        'n_features': int(X_sorted.shape[1]) if X_sorted.ndim == 2 else 0,
+        'columns': list(columns),
+        'source_key': source_key,
+        'fingerprint': fingerprint
+    }
+    tmp = directory / f'.layout.{os.getpid()}.json'
+    tmp.write_text(json.dumps(meta, indent=1))
+    os.replace(tmp, meta_path)
+    return directory
+
+
+def open_group_layout(directory, mmap_mode='r'):
+    """
+    Open a layout written by write_group_layout.
+
+    Parameters:
+    -----------
+    directory : str or Path
+        Layout directory
+    mmap_mode : str or None
+        np.load memory-map mode (default: 'r'; None reads into memory)
+
+    Returns:
+    --------
+    GroupLayout
+    """
+    return GroupLayout(directory, mmap_mode=mmap_mode)
+
+
+def open_cached_layout(directory, source_key, group_column, select_groups, load_data,
+                       response_column='y', columns=()):
+    """
+    Group layout of a cached data set, written from the data only when the
+    directory does not already hold it. On a hit nothing but the layout's
+    metadata is read; X, y and the columns are opened as memory maps.
+
+    Parameters:
+    -----------
+    directory : str or Path
+        Layout directory
+    source_key : str
+        Key of the cached data set (dataset_cache.DatasetCache.key)
+    group_column : str
+        Column identifying the group
+    select_groups : callable
+        select_groups(sizes) -> groups first in the layout (e.g. the
+        calibration groups), from the rows per group as a Series indexed by
+        sorted group label
+    load_data : callable
+        load_data() -> (df, X), called only when the layout is (re)written
+    response_column : str
+        Response column (default: 'y')
+    columns : list of str
+        Numeric columns of df the test units need (default: none)
+
+    Returns:
+    --------
+    tuple : (GroupLayout, groups first in the layout, True if the layout was reused)
+    """
+    directory = Path(directory)
+    try:
+        layout = open_group_layout(directory)
+    except (OSError, ValueError, KeyError):
+        layout = None
+    if (layout is not None and layout.source_key == source_key
+            and layout.group_column == group_column and set(columns) <= set(layout.columns)):
+        group_order = list(select_groups(layout.group_sizes()))
+        if layout.keys[:len(group_order)] == group_order:
+            return layout, group_order, True
+
+    df, X = load_data()
+    group_order = list(select_groups(df.groupby(group_column).size()))
+    write_group_layout(directory, df, X, group_column, response_column, group_order=group_order,
+                       columns=columns, source_key=source_key)
+    return open_group_layout(directory), group_order, False
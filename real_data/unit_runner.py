@@ -0,0 +1,127 @@
+"""
+Parallel Execution of Real-Data Test Units
+
+The real-data runners evaluate every test unit (state, clinic) against the
+same fixed calibration groups, and the units are otherwise independent.
+run_test_units dispatches them to a process pool:
+
+- every unit gets only its own rows of the data plus the calibration set,
+  which is published once in shared memory (shared_data.SharedGroupedData)
+  instead of being pickled into every task; a calibration set that is
+  already a view of memory-mapped files (a group layout) is not copied,
+  workers map the same files again (shared_data.MemmapDataHandle);
+- every unit seeds np.random from its own stream spawned from
+  SeedSequence(seed), so a unit's results do not depend on which units ran
+  before it or on which worker ran it;
+- finished units are written to disk as they complete, and the combined
+  results are returned in unit order, identical for any number of workers.
+"""
+
+import numpy as np
+import sys
+from contextlib import nullcontext
+from pathlib import Path
+
+from joblib import Parallel, delayed
+
+sys.path.append(str(Path(__file__).parent.parent))
+from resources import get_resources, resource_scope, worker_budget
+from shared_data import (SharedGroupedData, SharedDataHandle, MemmapDataHandle, memmap_handle,
+                         detach_all)
+
+
+def unit_seeds(seed, n_units):
+    """np.random seeds of n_units units, spawned from SeedSequence(seed)."""
+    streams = np.random.SeedSequence(seed).spawn(n_units)
+    return [int(stream.generate_state(1)[0]) for stream in streams]
+
+
+def unit_data(df, X, group_rows, key):
+    """
+    Rows of one test unit: (df restricted to the unit with its index reset,
+    matching rows of X).
+    """
+    rows = group_rows.rows(key)
+    return df.iloc[rows].reset_index(drop=True), np.asarray(X[rows])
+
+
+def _run_unit(index, run_unit, calibration, unit_seed, unit_kwargs, budget):
+    if isinstance(calibration, (SharedDataHandle, MemmapDataHandle)):
+        calibration = calibration.attach()
+    with resource_scope(**budget) if budget else nullcontext():
+        np.random.seed(unit_seed)
+        return index, run_unit(Z_calibration=calibration, **unit_kwargs)
+
+
+def run_test_units(run_unit, unit_kwargs, Z_calibration, n_workers=None, seed=None,
+                   stream_dir=None, unit_names=None):
+    """
+    Run run_unit once per test unit, in a process pool if n_workers > 1.
+
+    Parameters:
+    -----------
+    run_unit : callable
+        run_unit(Z_calibration=..., **unit_kwargs[i]) -> pd.DataFrame
+    unit_kwargs : list of dict
+        Keyword arguments of each unit (its own data rows, labels, settings)
+    Z_calibration : GroupedData
+        Calibration groups shared by all units
+    n_workers : int or None
+        Worker processes (1 runs in-process; -1 uses all cores; default: the
+        n_workers of resources.configure_resources). Each worker gets an
+        equal share of the cores for its BLAS / RF threads.
+    seed : int, optional
+        Root seed of the per-unit streams (default: None draws it from the
+        global np.random state, so np.random.seed still controls the run)
+    stream_dir : str or Path, optional
+        Directory to write each unit's results to as <unit name>.csv as soon
+        as the unit finishes (default: None = keep them in memory only)
+    unit_names : list of str, optional
+        File names of the units (default: 0, 1, ...)
+
+    Returns:
+    --------
+    list of pd.DataFrame : Results of every unit, in the order of unit_kwargs
+    """
+    n_units = len(unit_kwargs)
+    if seed is None:
+        seed = int(np.random.randint(0, 2**31 - 1))
+    seeds = unit_seeds(seed, n_units)
+    if unit_names is None:
+        unit_names = [str(i) for i in range(n_units)]
+    if stream_dir is not None:
+        stream_dir = Path(stream_dir)
+        stream_dir.mkdir(parents=True, exist_ok=True)
+
+    results = [None] * n_units
+
+    def finished(index, result):
+        results[index] = result
+        if stream_dir is not None:
+            path = stream_dir / f'{unit_names[index]}.csv'
+            tmp = path.with_name(f'.{path.name}.tmp')
+            result.to_csv(tmp, index=False)
+            tmp.replace(path)
+
+    if n_workers is None:
+        n_workers = get_resources()['n_workers']
+    if n_workers == 1:
+        for i in range(n_units):
+            finished(*_run_unit(i, run_unit, Z_calibration, seeds[i], unit_kwargs[i], None))
+        return results
+
+    budget = worker_budget(n_workers)
+    handle = memmap_handle(Z_calibration)
+    with SharedGroupedData(Z_calibration) if handle is None else nullcontext() as shared:
+        if handle is None:
+            handle = shared.handle
+        tasks = (
+            delayed(_run_unit)(i, run_unit, handle, seeds[i], unit_kwargs[i], budget)
+            for i in range(n_units)
+        )
+        for index, result in Parallel(n_jobs=n_workers, return_as='generator_unordered')(tasks):
+            finished(index, result)
+        # joblib reuses its workers across runs: release their attachments
+        # (a worker that misses this releases them on its next attach)
+        Parallel(n_jobs=n_workers)(delayed(detach_all)() for _ in range(n_workers))
+    return results
@@ -0,0 +1,126 @@
+"""
+Execution Resources
+
+Process-level parallelism (experiments in a process pool), Random Forest
+threads (n_jobs) and BLAS threads all compete for the same cores. This module
+keeps one global budget for the three so nested parallelism does not
+oversubscribe the machine: run_experiments_outer hands every worker process a
+share of the cores, and μ-methods created without an explicit n_jobs read
+their thread count from here at fit time.
+"""
+
+import os
+from contextlib import contextmanager
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # BLAS threads are then left alone
+    threadpool_limits = None
+
+
+_DEFAULT_RESOURCES = {
+    'total_cores': None,   # None: os.cpu_count()
+    'n_workers': 1,        # default worker processes for experiment loops
+    'rf_n_jobs': -1,       # Random Forest threads per process
+    'blas_threads': None   # BLAS threads per process (None: library default)
+}
+
+_resources = dict(_DEFAULT_RESOURCES)
+
+
+def available_cores():
+    """Number of cores in the budget (configured total_cores or os.cpu_count())."""
+    if _resources['total_cores'] is not None:
+        return _resources['total_cores']
+    return os.cpu_count() or 1
+
+
+def _resolve_workers(n_workers):
+    """Translate joblib-style worker counts (-1 = all cores) to a positive int."""
+    cores = available_cores()
+    if n_workers is None:
+        n_workers = _resources['n_workers']
+    if n_workers < 0:
+        n_workers = max(1, cores + 1 + n_workers)
+    return max(1, int(n_workers))
+
+
+def configure_resources(total_cores=None, n_workers=None, rf_n_jobs=None,
+                        blas_threads=None, reset=False):
+    """
+    Set the global execution budget. Arguments left as None keep their value.
+
+    Parameters:
+    -----------
+    total_cores : int, optional
+        Cores available to the whole run (default: os.cpu_count())
+    n_workers : int, optional
+        Default number of worker processes for experiment loops (-1: all cores)
+    rf_n_jobs : int, optional
+        Random Forest threads per process (-1: all cores)
+    blas_threads : int, optional
+        BLAS threads per process (applied through threadpoolctl if installed)
+    reset : bool
+        Restore the defaults before applying the arguments (default: False)
+
+    Returns:
+    --------
+    dict : The resulting configuration
+    """
+    if reset:
+        _resources.update(_DEFAULT_RESOURCES)
+    for key, value in (('total_cores', total_cores), ('n_workers', n_workers),
+                       ('rf_n_jobs', rf_n_jobs), ('blas_threads', blas_threads)):
+        if value is not None:
+            _resources[key] = value
+    if threadpool_limits is not None and blas_threads is not None:
+        threadpool_limits(limits=blas_threads, user_api='blas')
+    return get_resources()
+
+
+def get_resources():
+    """Copy of the current execution budget."""
+    return dict(_resources)
+
+
+def worker_budget(n_workers):
+    """
+    Budget for each of n_workers processes: the cores are split evenly and
+    every worker runs its RF and BLAS with that many threads.
+
+    Returns:
+    --------
+    dict : Keyword arguments for configure_resources in the worker
+    """
+    n_workers = _resolve_workers(n_workers)
+    threads = max(1, available_cores() // n_workers)
+    return {
+        'total_cores': threads,
+        'n_workers': 1,
+        'rf_n_jobs': threads,
+        'blas_threads': threads
+    }
+
+
+@contextmanager
+def resource_scope(**budget):
+    """
+    Temporarily apply a budget (as returned by worker_budget) to this process.
+    """
+    previous = get_resources()
+    _resources.update({k: v for k, v in budget.items() if v is not None})
+    blas_threads = budget.get('blas_threads')
+    try:
+        if threadpool_limits is not None and blas_threads is not None:
+            with threadpool_limits(limits=blas_threads, user_api='blas'):
+                yield get_resources()
+        else:
+            yield get_resources()
+    finally:
+        _resources.clear()
+        _resources.update(previous)
+
+
+def rf_n_jobs(n_jobs=None):
+    """RF thread count: an explicit n_jobs wins, otherwise the global budget."""
+    return _resources['rf_n_jobs'] if n_jobs is None else n_jobs
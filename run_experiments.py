@@ -27,11 +27,12 @@ from DGP import (
 from methods import (
     create_mu_method_random_forest_offset,
     create_mu_method_random_forest_global_only,
-    run_experiments_outer
+    create_mu_method_random_forest_group_bagged
 )
+from DGP.experiments import run_experiments_outer
 
 # Import summary and plotting
-from summary_and_plots import (
+from DGP.summary_and_plots import (
     summarize_methods,
     plot_effect_of_o_coverage_2x2,
     plot_effect_of_o_width_2x2,
@@ -40,6 +41,26 @@ from summary_and_plots import (
 )
 
 
+def create_mu_method_hcp(mu_method, ntree_rf, nodesize_rf):
+    """
+    μ-method of HCP++ / HCP.sample.
+
+    'rf' refits a Random Forest of ntree_rf trees on every S_comp;
+    'rf_group_bagged' fits one forest of 10 * ntree_rf group-bagged trees per
+    calibration set and masks it to the trees avoiding the excluded groups
+    (at least ntree_rf of them).
+    """
+    if mu_method == 'rf':
+        return create_mu_method_random_forest_offset(
+            ntree=ntree_rf, mtry=None, nodesize=nodesize_rf
+        )
+    if mu_method == 'rf_group_bagged':
+        return create_mu_method_random_forest_group_bagged(
+            ntree=10 * ntree_rf, min_trees=ntree_rf, mtry=None, nodesize=nodesize_rf
+        )
+    raise ValueError(f"Unknown mu_method: {mu_method}")
+
+
 def run_experiments_effect_of_o(o_vector=[1, 15, 20, 50],
                                 number_experiments=25,
                                 number_groups_k=20,
@@ -49,7 +70,9 @@ def run_experiments_effect_of_o(o_vector=[1, 15, 20, 50],
                                 alpha_selection=0.5,
                                 number_test_groups=100,
                                 ntree_rf=50,
-                                nodesize_rf=5):
+                                nodesize_rf=5,
+                                n_workers=1,
+                                mu_method='rf'):
     """
     Run experiments varying the number of observed points o.
 
@@ -75,6 +98,11 @@ def run_experiments_effect_of_o(o_vector=[1, 15, 20, 50],
         Number of trees in random forest
     nodesize_rf : int
         Minimum node size in random forest
+    n_workers : int
+        Number of worker processes for the experiments (default: 1)
+    mu_method : str
+        μ-method of HCP++ / HCP.sample: 'rf' or 'rf_group_bagged'
+        (see create_mu_method_hcp)
 
     Returns:
     --------
@@ -90,9 +118,7 @@ def run_experiments_effect_of_o(o_vector=[1, 15, 20, 50],
     mu_baseline = create_mu_method_random_forest_global_only(
         ntree=ntree_rf, mtry=None, nodesize=nodesize_rf
     )
-    mu_hcp = create_mu_method_random_forest_offset(
-        ntree=ntree_rf, mtry=None, nodesize=nodesize_rf
-    )
+    mu_hcp = create_mu_method_hcp(mu_method, ntree_rf, nodesize_rf)
 
     results_list = []
 
@@ -110,7 +136,8 @@ def run_experiments_effect_of_o(o_vector=[1, 15, 20, 50],
             number_test_groups=number_test_groups,
             mu_method_baseline=mu_baseline,
             mu_method_hcp=mu_hcp,
-            show_progress=True
+            show_progress=True,
+            n_workers=n_workers
         )
         res['test_sample_size_o'] = o_cur
         results_list.append(res)
@@ -127,7 +154,9 @@ def run_experiments_effect_of_mean_variance(number_experiments=25,
                                            alpha_selection=0.5,
                                            number_test_groups=100,
                                            ntree_rf=50,
-                                           nodesize_rf=5):
+                                           nodesize_rf=5,
+                                           n_workers=1,
+                                           mu_method='rf'):
     """
     Run experiments comparing different DGPs (default vs nonlinear).
 
@@ -153,6 +182,11 @@ def run_experiments_effect_of_mean_variance(number_experiments=25,
         Number of trees in random forest
     nodesize_rf : int
         Minimum node size in random forest
+    n_workers : int
+        Number of worker processes for the experiments (default: 1)
+    mu_method : str
+        μ-method of HCP++ / HCP.sample: 'rf' or 'rf_group_bagged'
+        (see create_mu_method_hcp)
 
     Returns:
     --------
@@ -173,9 +207,7 @@ def run_experiments_effect_of_mean_variance(number_experiments=25,
     mu_baseline = create_mu_method_random_forest_global_only(
         ntree=ntree_rf, mtry=None, nodesize=nodesize_rf
     )
-    mu_hcp = create_mu_method_random_forest_offset(
-        ntree=ntree_rf, mtry=None, nodesize=nodesize_rf
-    )
+    mu_hcp = create_mu_method_hcp(mu_method, ntree_rf, nodesize_rf)
 
     dgp_list = {
         'linearish': dgp_linearish,
@@ -198,7 +230,8 @@ def run_experiments_effect_of_mean_variance(number_experiments=25,
             number_test_groups=number_test_groups,
             mu_method_baseline=mu_baseline,
             mu_method_hcp=mu_hcp,
-            show_progress=True
+            show_progress=True,
+            n_workers=n_workers
         )
         res['dgp_name'] = name
         all_results.append(res)
@@ -210,8 +243,23 @@ def main():
     """
     Main function to run all experiments and generate results.
     """
-    # Set random seed for reproducibility
-    np.random.seed(123)
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run DGP experiments')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Number of worker processes (default: 1; -1 for all cores)')
+    parser.add_argument('--seed', type=int, default=123,
+                       help='Random seed')
+    parser.add_argument('--mu_method', choices=['rf', 'rf_group_bagged'], default='rf',
+                       help='mu-method of HCP++ / HCP.sample: refit a forest per donor set '
+                            '(rf, default) or mask one group-bagged forest (rf_group_bagged)')
+
+    args = parser.parse_args()
+
+    # Set random seed for reproducibility (each configuration draws the root
+    # seed of its per-experiment streams from it, so results do not depend on
+    # the number of workers)
+    np.random.seed(args.seed)
 
     # Create output directories if they don't exist
     Path("DGP/resultsDGP/files").mkdir(parents=True, exist_ok=True)
@@ -239,7 +287,9 @@ def main():
         alpha_selection=0.5,
         number_test_groups=number_test_groups,
         ntree_rf=50,
-        nodesize_rf=5
+        nodesize_rf=5,
+        n_workers=args.workers,
+        mu_method=args.mu_method
     )
 
     # Save raw results
@@ -287,7 +337,9 @@ def main():
         alpha_selection=0.5,
         number_test_groups=number_test_groups,
         ntree_rf=50,
-        nodesize_rf=5
+        nodesize_rf=5,
+        n_workers=args.workers,
+        mu_method=args.mu_method
     )
 
     # Save raw results
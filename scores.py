@@ -7,6 +7,13 @@ This module defines conformity score functions and weighted quantile computation
 import numpy as np
 
 
+# Cumulative weights within this distance below 1 - alpha count as reaching
+# it: the weights are sums of rationals such as 1 / (|S| n_j), so a CDF value
+# that equals 1 - alpha exactly can round to either side depending on the
+# summation order
+CDF_TOLERANCE = 1e-10
+
+
 def absolute_residual_score(y, mu):
     """
     Compute absolute residual score: |y - mu|
@@ -25,7 +32,36 @@ def absolute_residual_score(y, mu):
     return np.abs(y - mu)
 
 
-def weighted_quantile(values, weights, alpha):
+def infinite_quantile(alpha):
+    """np.inf, or an array of np.inf with the shape of a vector of alphas."""
+    return np.inf if np.ndim(alpha) == 0 else np.full(np.shape(alpha), np.inf)
+
+
+def symmetric_interval(center, radius):
+    """
+    Interval (center - radius, center + radius); (-inf, inf) for an infinite
+    radius. With a vector of radii the bounds are arrays.
+    """
+    if np.ndim(radius) == 0:
+        if np.isinf(radius):
+            return (-np.inf, np.inf)
+        return (center - radius, center + radius)
+    radius = np.asarray(radius, dtype=float)
+    return (center - radius, center + radius)
+
+
+def _point_mass_arrays(point_masses):
+    """Split [(value, total_weight), ...] into sorted value and weight arrays."""
+    if point_masses is None or len(point_masses) == 0:
+        return np.zeros(0), np.zeros(0)
+    atoms = np.asarray(point_masses, dtype=float).reshape(-1, 2)
+    if np.any(atoms[:, 1] < 0):
+        raise ValueError("point masses: negative weights not allowed")
+    order = np.argsort(atoms[:, 0], kind='stable')
+    return atoms[order, 0], atoms[order, 1]
+
+
+def weighted_quantile(values, weights, alpha, point_masses=None):
     """
     Compute weighted quantile using the weighted empirical CDF approach.
 
@@ -37,18 +73,25 @@ def weighted_quantile(values, weights, alpha):
         Values to compute quantile from
     weights : array-like
         Weights for each value (must be non-negative)
-    alpha : float
-        Miscoverage level (returns 1-alpha quantile)
+    alpha : float or array-like
+        Miscoverage level (returns 1-alpha quantile); a vector of levels is
+        answered from a single sort and cumsum
+    point_masses : list of (value, total_weight), optional
+        Atoms added to the distribution without expanding them into repeated
+        entries, e.g. [(np.inf, n_inf * w)] for n_inf infinite scores of
+        weight w; only `values` are sorted
 
     Returns:
     --------
-    float : The weighted quantile
+    float : The weighted quantile (ndarray of quantiles if alpha is a vector)
     """
-    if len(values) == 0:
-        return np.inf
+    atom_values, atom_weights = _point_mass_arrays(point_masses)
 
-    values = np.asarray(values)
-    weights = np.asarray(weights)
+    if len(values) == 0 and len(atom_values) == 0:
+        return infinite_quantile(alpha)
+
+    values = np.asarray(values, dtype=float).ravel()
+    weights = np.asarray(weights, dtype=float).ravel()
 
     if len(values) != len(weights):
         raise ValueError("weighted_quantile: length mismatch between values and weights")
@@ -61,14 +104,313 @@ def weighted_quantile(values, weights, alpha):
     sorted_values = values[sort_indices]
     sorted_weights = weights[sort_indices]
 
+    # Merge the (already sorted) atoms in without re-sorting
+    if len(atom_values) > 0:
+        positions = np.searchsorted(sorted_values, atom_values, side='right')
+        sorted_values = np.insert(sorted_values, positions, atom_values)
+        sorted_weights = np.insert(sorted_weights, positions, atom_weights)
+
     # Compute cumulative sum of weights
     cumsum_weights = np.cumsum(sorted_weights)
 
-    # Find the smallest value where cumsum >= 1 - alpha
-    threshold = 1 - alpha
+    # Find the smallest value where cumsum >= 1 - alpha (up to CDF_TOLERANCE)
+    if np.ndim(alpha) > 0:
+        threshold = 1 - np.asarray(alpha, dtype=float) - CDF_TOLERANCE
+        idx = np.searchsorted(cumsum_weights, threshold, side='left')
+        found = idx < len(sorted_values)
+        return np.where(found, sorted_values[np.minimum(idx, len(sorted_values) - 1)], np.inf)
+
+    threshold = 1 - alpha - CDF_TOLERANCE
     idx = np.searchsorted(cumsum_weights, threshold, side='left')
 
     if idx >= len(sorted_values):
         return np.inf
 
     return sorted_values[idx]
+
+
+def _search_segments(flat, lo, hi, values, side):
+    """
+    Vectorized searchsorted in many sorted segments at once.
+
+    Row a of lo / hi holds the bounds of K segments of flat (each sorted
+    ascending) to search for values[a]; the result holds the absolute
+    insertion positions, as np.searchsorted(flat[lo:hi], value, side) + lo
+    would. All rows and segments advance together, so the cost is
+    O(log n) NumPy operations on (A, K) arrays.
+    """
+    lo = lo.copy()
+    hi = hi.copy()
+    values = values[:, None]
+    while True:
+        active = lo < hi
+        if not np.any(active):
+            return lo
+        mid = (lo + hi) // 2
+        probe = flat[np.where(active, mid, 0)]
+        right = active & ((probe <= values) if side == 'right' else (probe < values))
+        lo = np.where(right, mid + 1, lo)
+        hi = np.where(active & ~right, mid, hi)
+
+
+class GroupedWeightedQuantile:
+    """
+    Weighted quantile over grouped scores with a common weight per group.
+
+    Scores are kept as one sorted array per group together with the weight
+    carried by each score of that group (e.g. 1 / (|S| * n_j) in HCP++). The
+    weighted CDF F(v) = sum_g w_g * #{scores of group g <= v} is one
+    searchsorted per group, done for all groups together, and a quantile is
+    found by bisection on the value: every step takes a pivot from the
+    remaining per-group windows of candidates (the weighted median of their
+    midpoints), evaluates F there and drops at least a quarter of the
+    remaining candidates. A query costs O(K log^2 n) array work, nothing is
+    re-sorted between queries, and a vector of levels is answered in the same
+    pass.
+
+    Quantiles agree with weighted_quantile on the concatenated scores and
+    expanded weights (up to rounding in the accumulated weights).
+
+    Parameters:
+    -----------
+    score_blocks : list of array-like
+        score_blocks[g] contains the scores of group g
+    group_weights : array-like of shape (len(score_blocks),)
+        Weight of each single score of group g (must be non-negative)
+    presorted : bool
+        Whether every block is already sorted ascending (default: False)
+    point_masses : list of (value, total_weight), optional
+        Atoms (e.g. infinite scores) represented in O(1) instead of as blocks
+    """
+
+    def __init__(self, score_blocks, group_weights, presorted=False, point_masses=None):
+        group_weights = np.asarray(group_weights, dtype=float).ravel()
+        if len(score_blocks) != len(group_weights):
+            raise ValueError("GroupedWeightedQuantile: one weight per group is required")
+        if np.any(group_weights < 0):
+            raise ValueError("GroupedWeightedQuantile: negative weights not allowed")
+
+        blocks = [np.asarray(b, dtype=float).ravel() for b in score_blocks]
+        if not presorted:
+            blocks = [np.sort(b) for b in blocks]
+
+        # Segments (flat sorted scores, start and end of every group); groups
+        # added by with_group go into their own segments, so the presorted
+        # calibration scores are shared and never copied
+        self._segments = [_make_segments(blocks)] if len(blocks) > 0 else []
+        self.group_weights = group_weights
+        self.atom_values, self.atom_weights = _point_mass_arrays(point_masses)
+
+    @property
+    def n_groups(self):
+        return self.group_weights.shape[0]
+
+    @property
+    def sorted_blocks(self):
+        """Sorted scores of every group (views)."""
+        return [flat[start:end] for flat, starts, ends in self._segments
+                for start, end in zip(starts, ends)]
+
+    def _copy(self):
+        new = GroupedWeightedQuantile.__new__(GroupedWeightedQuantile)
+        new._segments = list(self._segments)
+        new.group_weights = self.group_weights
+        new.atom_values = self.atom_values
+        new.atom_weights = self.atom_weights
+        return new
+
+    def with_group(self, scores, weight, presorted=False):
+        """
+        Return a new structure with one more group, sharing all presorted data
+        of this one (used for the test group, which changes between queries).
+
+        Parameters:
+        -----------
+        scores : array-like
+            Scores of the added group
+        weight : float
+            Weight of each score of the added group
+        presorted : bool
+            Whether scores is already sorted ascending (default: False)
+        """
+        if weight < 0:
+            raise ValueError("GroupedWeightedQuantile: negative weights not allowed")
+        block = np.asarray(scores, dtype=float).ravel()
+        if not presorted:
+            block = np.sort(block)
+        new = self._copy()
+        new._segments.append(_make_segments([block]))
+        new.group_weights = np.append(self.group_weights, float(weight))
+        return new
+
+    def with_point_mass(self, value, total_weight):
+        """
+        Return a new structure with one more atom of the given total weight
+        (e.g. the n_inf infinite scores of the test group), sharing all
+        presorted data of this one.
+        """
+        if total_weight < 0:
+            raise ValueError("GroupedWeightedQuantile: negative weights not allowed")
+        new = self._copy()
+        atom_values = np.append(self.atom_values, float(value))
+        atom_weights = np.append(self.atom_weights, float(total_weight))
+        order = np.argsort(atom_values, kind='stable')
+        new.atom_values, new.atom_weights = atom_values[order], atom_weights[order]
+        return new
+
+    def _check_weights(self, group_weights):
+        if group_weights is None:
+            return self.group_weights
+        group_weights = np.asarray(group_weights, dtype=float).ravel()
+        if group_weights.shape[0] != self.n_groups:
+            raise ValueError("GroupedWeightedQuantile: one weight per group is required")
+        if np.any(group_weights < 0):
+            raise ValueError("GroupedWeightedQuantile: negative weights not allowed")
+        return group_weights
+
+    def _counts(self, values, lo=None, hi=None, side='right'):
+        """
+        Insertion positions of values (A,) in every group, as (A, K)
+        positions into each group's segment, searching within lo:hi
+        (default: the whole groups).
+        """
+        A = values.shape[0]
+        columns = []
+        k = 0
+        for flat, starts, ends in self._segments:
+            width = starts.shape[0]
+            seg_lo = np.broadcast_to(starts, (A, width)) if lo is None else lo[:, k:k + width]
+            seg_hi = np.broadcast_to(ends, (A, width)) if hi is None else hi[:, k:k + width]
+            columns.append(_search_segments(flat, seg_lo, seg_hi, values, side))
+            k += width
+        if len(columns) == 0:
+            return np.zeros((A, 0), dtype=np.int64)
+        return np.hstack(columns)
+
+    def _starts(self):
+        if len(self._segments) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([starts for _, starts, _ in self._segments])
+
+    def _ends(self):
+        if len(self._segments) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([ends for _, _, ends in self._segments])
+
+    def _atom_cdf(self, values):
+        if len(self.atom_values) == 0:
+            return np.zeros(values.shape[0])
+        cumulative = np.concatenate([[0.0], np.cumsum(self.atom_weights)])
+        return cumulative[np.searchsorted(self.atom_values, values, side='right')]
+
+    def cdf(self, value, group_weights=None):
+        """
+        Weighted CDF: total weight of the scores <= value.
+
+        Parameters:
+        -----------
+        value : float or array-like
+            Evaluation point(s)
+        group_weights : array-like, optional
+            Per-group weights to use instead of the stored ones
+        """
+        w = self._check_weights(group_weights)
+        values = np.atleast_1d(np.asarray(value, dtype=float)).ravel()
+        counts = self._counts(values) - self._starts()
+        total = counts @ w + self._atom_cdf(values)
+        return float(total[0]) if np.ndim(value) == 0 else total.reshape(np.shape(value))
+
+    def quantile(self, alpha, group_weights=None, extra_cdf=None):
+        """
+        Smallest score v with F(v) >= 1 - alpha (np.inf if there is none);
+        F(v) within CDF_TOLERANCE below 1 - alpha counts as reaching it, as in
+        weighted_quantile.
+
+        Parameters:
+        -----------
+        alpha : float or array-like
+            Miscoverage level (returns 1-alpha quantile) or vector of levels
+        group_weights : array-like, optional
+            Per-group weights to use instead of the stored ones (reweighting
+            does not require re-sorting)
+        extra_cdf : callable, optional
+            extra_cdf(values) -> weight of scores kept elsewhere that are
+            <= values (non-decreasing), added to F; the result is then the
+            smallest of this structure's scores where the combined CDF
+            reaches 1 - alpha
+
+        Returns:
+        --------
+        float : The weighted quantile (ndarray of quantiles if alpha is a vector)
+        """
+        w = self._check_weights(group_weights)
+        thresholds = 1 - np.atleast_1d(np.asarray(alpha, dtype=float)).ravel() - CDF_TOLERANCE
+        A = thresholds.shape[0]
+        starts, ends = self._starts(), self._ends()
+
+        def F(values, counts):
+            total = (counts - starts) @ w + self._atom_cdf(values)
+            if extra_cdf is not None:
+                total = total + np.asarray(extra_cdf(values), dtype=float)
+            return total
+
+        best = np.full(A, np.inf)
+
+        # Atoms: F at every atom value, then the smallest atom reaching each level
+        if len(self.atom_values) > 0:
+            F_atoms = F(self.atom_values, self._counts(self.atom_values))
+            hit = F_atoms[None, :] >= thresholds[:, None]
+            first = np.argmax(hit, axis=1)
+            best = np.where(hit.any(axis=1), self.atom_values[first], best)
+
+        # Scores: per level, a window lo:hi of remaining candidates per group
+        lo = np.broadcast_to(starts, (A, starts.shape[0])).copy()
+        hi = np.broadcast_to(ends, (A, ends.shape[0])).copy()
+        rows = np.arange(A)
+        while True:
+            sizes = hi - lo
+            remaining = sizes.sum(axis=1) > 0
+            if not np.any(remaining):
+                break
+            # pivot: weighted median (by window size) of the window midpoints
+            mid = np.where(sizes > 0, (lo + hi) // 2, 0)
+            candidates = np.where(sizes > 0, self._values_at(mid), np.inf)
+            order = np.argsort(candidates, axis=1, kind='stable')
+            cumulative = np.cumsum(np.take_along_axis(sizes, order, axis=1), axis=1)
+            median = np.argmax(2 * cumulative >= cumulative[:, -1:], axis=1)
+            pivot = np.take_along_axis(candidates, order, axis=1)[rows, median]
+            pivot = np.where(remaining, pivot, 0.0)
+
+            upper = self._counts(pivot, lo, hi, side='right')
+            reached = remaining & (F(pivot, upper) >= thresholds)
+            best = np.where(reached, np.minimum(best, pivot), best)
+            # reached: the quantile is <= pivot, keep the scores below it;
+            # otherwise it is above pivot, keep the scores above it
+            below = self._counts(pivot, lo, hi, side='left')
+            hi = np.where(reached[:, None], below, hi)
+            lo = np.where(remaining[:, None] & ~reached[:, None], upper, lo)
+
+        return float(best[0]) if np.ndim(alpha) == 0 else best.reshape(np.shape(alpha))
+
+    def _values_at(self, positions):
+        """Scores at (A, K) positions, each relative to its group's segment."""
+        columns = []
+        k = 0
+        for flat, starts, _ in self._segments:
+            width = starts.shape[0]
+            if flat.shape[0] == 0:
+                columns.append(np.zeros((positions.shape[0], width)))
+            else:
+                columns.append(flat[positions[:, k:k + width]])
+            k += width
+        if len(columns) == 0:
+            return np.zeros(positions.shape)
+        return np.hstack(columns)
+
+
+def _make_segments(blocks):
+    """(flat scores, starts, ends) of sorted blocks."""
+    sizes = np.array([b.shape[0] for b in blocks], dtype=np.int64)
+    ends = np.cumsum(sizes)
+    flat = np.concatenate(blocks) if len(blocks) > 0 else np.zeros(0)
+    return flat, ends - sizes, ends
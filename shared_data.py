@@ -0,0 +1,300 @@
+"""
+Shared-Memory Calibration Data for Worker Processes
+
+Passing a calibration set to every task of a process pool pickles all of it
+(and, for the legacy list-of-dict representation, tens of thousands of small
+objects) once per task. SharedGroupedData copies the columnar arrays of a
+GroupedData (X, Y, offsets, U) once into a single
+multiprocessing.shared_memory block and hands out a SharedDataHandle: a few
+hundred bytes holding the block name, the array layout and the fingerprint.
+Workers call handle.attach() and get a GroupedData whose arrays are read-only
+views of the shared block, without copying; a worker attaches to a block once
+and reuses it for all later tasks of the run. A worker keeps one attachment:
+attaching to another block (the next run on a reused pool) releases the
+previous one, and run_test_units detaches the workers after each run.
+
+Cleanup: the owner unlinks the block when the `with` block exits (also on
+exceptions), when it is garbage collected and at interpreter exit. If the
+owner dies without running Python cleanup (SIGKILL, SIGTERM), the
+multiprocessing resource tracker, which outlives it, unlinks the block.
+
+Calibration data whose X and Y are already views of read-only memory-mapped
+files (e.g. a slice of a group layout, see real_data/grouping.py) is not
+copied: memmap_handle returns a MemmapDataHandle holding the file names and
+byte offsets, and workers map the same files again.
+"""
+
+import os
+import sys
+import threading
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from grouped_data import GroupedData, as_grouped_data
+
+
+_ALIGNMENT = 64
+_FIELDS = ('X', 'Y', 'offsets', 'U')
+
+# Blocks attached in this (worker) process: name -> (SharedMemory, GroupedData)
+_attached = {}
+
+# Memory-mapped files opened in this (worker) process: handle state -> GroupedData
+_mapped = {}
+
+# Serializes this module's SharedMemory calls while resource_tracker.register
+# is patched (Python < 3.13), so a block created by another thread in the
+# meantime is still registered
+_tracker_lock = threading.Lock()
+
+
+def _unlink(shm, owner_pid):
+    """Close and unlink a block owned by this process (idempotent)."""
+    if os.getpid() != owner_pid:  # a forked child must not unlink the owner's block
+        return
+    _release(shm.name)
+    try:
+        shm.close()
+    except BufferError:  # views still alive; the mapping goes with the process
+        pass
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _attach_untracked(name):
+    """
+    Open an existing block without registering it with the resource tracker:
+    only the owner may unlink it. A registration from a worker would make the
+    worker's tracker unlink the block when the worker exits, or (with a
+    tracker shared with the owner) cancel the owner's crash cleanup.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    with _tracker_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class SharedDataHandle:
+    """
+    Picklable reference to a GroupedData published in shared memory.
+
+    Attributes:
+    -----------
+    name : str
+        Name of the shared memory block
+    layout : tuple
+        (field, byte offset, shape, dtype) of X, Y, offsets and U
+    fingerprint : str
+        GroupedData.fingerprint() of the published data
+    """
+
+    __slots__ = ('name', 'layout', 'fingerprint')
+
+    def __init__(self, name, layout, fingerprint):
+        self.name = name
+        self.layout = layout
+        self.fingerprint = fingerprint
+
+    def __getstate__(self):
+        return (self.name, self.layout, self.fingerprint)
+
+    def __setstate__(self, state):
+        self.name, self.layout, self.fingerprint = state
+
+    def __repr__(self):
+        return f"SharedDataHandle(name={self.name!r}, fingerprint={self.fingerprint!r})"
+
+    def attach(self):
+        """
+        GroupedData over the shared block (read-only, zero-copy). The block
+        is attached once per process and reused by later calls; blocks
+        attached before are released.
+        """
+        cached = _attached.get(self.name)
+        if cached is not None:
+            return cached[1]
+        detach_all()
+
+        shm = _attach_untracked(self.name)
+
+        arrays = {
+            field: np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+            for field, offset, shape, dtype in self.layout
+        }
+        data = GroupedData(arrays['X'], arrays['Y'], arrays['offsets'], arrays['U'])
+        data._fingerprint = self.fingerprint
+        _attached[self.name] = (shm, data)
+        return data
+
+
+def _file_view(array):
+    """
+    (file name, byte offset, shape, dtype) of an array that is a C-contiguous
+    view of a read-only file memory map, or None.
+    """
+    if not isinstance(array, np.ndarray) or not array.flags.c_contiguous:
+        return None
+    root = array
+    while isinstance(root, np.ndarray) and not (isinstance(root, np.memmap) and not isinstance(root.base, np.ndarray)):
+        root = root.base
+    if not isinstance(root, np.memmap) or root.filename is None or root.mode != 'r':
+        return None
+    start = array.__array_interface__['data'][0] - root.__array_interface__['data'][0]
+    return (root.filename, int(root.offset + start), tuple(array.shape), array.dtype.str)
+
+
+class MemmapDataHandle:
+    """
+    Picklable reference to a GroupedData whose X and Y are views of
+    read-only memory-mapped files (offsets and U are small and travel along).
+
+    Attributes:
+    -----------
+    X, Y : tuple
+        (file name, byte offset, shape, dtype) of X and Y
+    offsets, U : ndarray
+        Group offsets and group-level covariates
+    fingerprint : str
+        GroupedData.fingerprint() of the data
+    """
+
+    __slots__ = ('X', 'Y', 'offsets', 'U', 'fingerprint')
+
+    def __init__(self, X, Y, offsets, U, fingerprint):
+        self.X = X
+        self.Y = Y
+        self.offsets = offsets
+        self.U = U
+        self.fingerprint = fingerprint
+
+    def __getstate__(self):
+        return (self.X, self.Y, self.offsets, self.U, self.fingerprint)
+
+    def __setstate__(self, state):
+        self.X, self.Y, self.offsets, self.U, self.fingerprint = state
+
+    def __repr__(self):
+        return f"MemmapDataHandle(X={self.X[0]!r}, fingerprint={self.fingerprint!r})"
+
+    def attach(self):
+        """
+        GroupedData over the mapped files (read-only, zero-copy). The files
+        are mapped once per process and reused by later calls; files mapped
+        before are released.
+        """
+        key = (self.X, self.Y, self.fingerprint)
+        cached = _mapped.get(key)
+        if cached is not None:
+            return cached
+        detach_all()
+
+        X, Y = (
+            np.memmap(filename, dtype=np.dtype(dtype), mode='r', offset=offset, shape=shape)
+            for filename, offset, shape, dtype in (self.X, self.Y)
+        )
+        data = GroupedData(X, Y, self.offsets, self.U)
+        data._fingerprint = self.fingerprint
+        _mapped[key] = data
+        return data
+
+
+def memmap_handle(data):
+    """
+    MemmapDataHandle of a GroupedData whose X and Y are views of read-only
+    memory-mapped files, or None if they are not.
+    """
+    X, Y = _file_view(data.X), _file_view(data.Y)
+    if X is None or Y is None:
+        return None
+    return MemmapDataHandle(X, Y, data.offsets, data.U, data.fingerprint())
+
+
+class SharedGroupedData:
+    """
+    Owner of a GroupedData published in shared memory.
+
+    Parameters:
+    -----------
+    data : GroupedData or list
+        Calibration data (legacy list-of-lists is converted)
+    U : ndarray of shape (K, d), optional
+        Group-level covariates (see grouped_data.as_grouped_data)
+
+    Usage:
+    ------
+        with SharedGroupedData(Z_calibration, U_calibration) as shared:
+            Parallel(n_jobs=4)(delayed(task)(shared.handle, s) for s in states)
+
+        def task(handle, s):
+            Z_calibration = handle.attach()
+    """
+
+    def __init__(self, data, U=None):
+        data = as_grouped_data(data, U)
+
+        layout = []
+        size = 0
+        for field in _FIELDS:
+            array = getattr(data, field)
+            size = -(-size // _ALIGNMENT) * _ALIGNMENT
+            layout.append((field, size, tuple(array.shape), array.dtype.str))
+            size += array.nbytes
+
+        with _tracker_lock:
+            self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.owner_pid = os.getpid()
+        self._finalizer = weakref.finalize(self, _unlink, self._shm, self.owner_pid)
+        for field, offset, shape, dtype in layout:
+            target = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._shm.buf, offset=offset)
+            target[...] = getattr(data, field)
+            del target
+
+        self.handle = SharedDataHandle(self._shm.name, tuple(layout), data.fingerprint())
+        self.nbytes = size
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+    def close(self):
+        """Release and unlink the shared block (safe to call repeatedly)."""
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def _release(name):
+    """Drop this process's attachment to a block, if any."""
+    entry = _attached.pop(name, None)
+    if entry is None:
+        return
+    shm, data = entry
+    del data
+    try:
+        shm.close()
+    except BufferError:  # arrays still referenced; unmapped when released
+        pass
+
+
+def detach_all():
+    """
+    Drop the shared blocks attached in this process (worker side). Blocks
+    whose arrays are still referenced stay mapped until those are released.
+    """
+    for name in list(_attached):
+        _release(name)
+    _mapped.clear()
@@ -0,0 +1,78 @@
+"""
+Checks of the shared baseline calibration context.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+from grouped_data import GroupedData
+from methods import create_mu_method_ols_global_only
+from methods.baseline_hcp import BaselineCalibration, compute_repeated_subsampling_interval_radius
+from scores import weighted_quantile
+
+
+def test_single_calibration_group_is_scored_without_a_fit():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(20, 2))
+    calibration = GroupedData(X, X[:, 0] + rng.normal(size=20), np.array([0, 20]), np.zeros((1, 1)))
+    mu_method = create_mu_method_ols_global_only()
+
+    baseline = BaselineCalibration(np.zeros((1, 1)), calibration, mu_method)
+    expected_model = mu_method['fit_global'](U_matrix=np.zeros((1, 1)), Z_list=calibration,
+                                             group_index_vector=[])
+    assert (baseline.model is None) == (expected_model is None)
+    assert baseline.train_index == [] and baseline.calib_index == [0]
+    assert np.isfinite(baseline.radii(0.1)['Pooling'])
+
+
+def test_pickled_calibration_keeps_model_and_radii_only():
+    rng = np.random.default_rng(1)
+    offsets = np.arange(0, 121, 20)
+    X = rng.normal(size=(120, 2))
+    calibration = GroupedData(X, X[:, 0] + rng.normal(size=120), offsets, np.zeros((6, 1)))
+    baseline = BaselineCalibration(np.zeros((6, 1)), calibration,
+                                   create_mu_method_ols_global_only(),
+                                   rng=np.random.default_rng(2))
+    radii = baseline.radii(0.1)
+
+    # μ-methods are closures, so workers receive them through cloudpickle
+    cloudpickle = pytest.importorskip('cloudpickle')
+    copy = cloudpickle.loads(cloudpickle.dumps(baseline))
+    assert copy.scores_list is None and copy.rng is None
+    assert copy.radii(0.1) == radii
+    assert copy.predict(np.ones(2), np.zeros(1)) == baseline.predict(np.ones(2), np.zeros(1))
+    with pytest.raises(ValueError):
+        copy.radii(0.2)
+
+
+def _scores_list(seed):
+    rng = np.random.default_rng(seed)
+    return [np.abs(rng.normal(size=int(rng.integers(5, 30)))) for _ in range(12)] + [np.zeros(0)]
+
+
+def test_repeated_subsampling_matches_the_per_draw_loop():
+    scores_list = _scores_list(3)
+    K, repetitions = len(scores_list), 50
+    for alpha in (0.1, [0.05, 0.2]):
+        np.random.seed(7)
+        sampled = [np.random.choice(scores) for _ in range(repetitions)
+                   for scores in scores_list if len(scores) > 0]
+        expected = weighted_quantile(sampled, np.full(len(sampled), 1.0 / (repetitions * (K + 1))),
+                                     alpha, point_masses=[(np.inf, 1.0 / (K + 1))])
+        np.random.seed(7)
+        radius = compute_repeated_subsampling_interval_radius(scores_list, alpha, repetitions)
+        np.testing.assert_array_equal(radius, expected)
+
+
+def test_expected_mode_is_the_limit_of_many_repetitions():
+    scores_list = _scores_list(4)
+    alphas = np.array([0.1, 0.2, 0.3])
+    expected = compute_repeated_subsampling_interval_radius(scores_list, alphas, 0, mode='expected')
+    monte_carlo = compute_repeated_subsampling_interval_radius(
+        scores_list, alphas, 20000, rng=np.random.default_rng(5)
+    )
+    np.testing.assert_allclose(monte_carlo, expected, rtol=0.02)
@@ -0,0 +1,50 @@
+"""
+Checks that the data-set cache misses when the code or schema behind an
+entry changes.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent / 'real_data'))
+from dataset_cache import DatasetCache
+from design_matrix import DesignMatrixSchema
+
+
+def clean_v1(df):
+    return df
+
+
+def clean_v2(df):
+    return df[df['x'] > 0]
+
+
+def test_cache_key_covers_code_and_schema(tmp_path):
+    source = tmp_path / 'raw.csv'
+    raw = pd.DataFrame({'x': [1.0, 2.0, 3.0, -1.0], 'c': ['a', 'b', 'a', 'c']})
+    raw.to_csv(source, index=False)
+    cache = DatasetCache(tmp_path / 'cache')
+
+    def schema(categorical):
+        return lambda df: DesignMatrixSchema(['x'], categorical).fit(df)
+
+    def build():
+        df = pd.read_csv(source)
+        return df, schema(['c'])(df).transform(df)
+
+    _, X, hit = cache.get_or_build(source, 'test', {}, build, code=(clean_v1,), schema=schema(['c']))
+    assert not hit
+    _, X_cached, hit = cache.get_or_build(source, 'test', {}, build, code=(clean_v1,), schema=schema(['c']))
+    assert hit
+    np.testing.assert_array_equal(X, X_cached)
+
+    # Different cleaning code: different key
+    _, _, hit = cache.get_or_build(source, 'test', {}, build, code=(clean_v2,), schema=schema(['c']))
+    assert not hit
+
+    # Same key but a different design-matrix schema: the entry is rebuilt
+    _, _, hit = cache.get_or_build(source, 'test', {}, build, code=(clean_v1,), schema=schema([]))
+    assert not hit
@@ -0,0 +1,39 @@
+"""
+Checks of the schema-driven design matrices.
+"""
+
+import sys
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent / 'real_data'))
+from design_matrix import DesignMatrixSchema
+
+
+def test_encoding_matches_get_dummies_without_warnings():
+    df = pd.DataFrame({
+        'age': [30, 41, 52, 63, 28],
+        'educ': pd.Categorical(['hs', 'ba', 'ma', 'hs', 'ba'], categories=['hs', 'ba', 'ma']),
+        'cow': [1.0, 2.0, 3.0, 2.0, np.nan]
+    })
+    schema = DesignMatrixSchema(['age'], ['educ', 'cow'])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        X = schema.fit_transform(df)
+        X_sparse = schema.transform(df, sparse=True)
+
+    expected = pd.concat(
+        [df[['age']], pd.get_dummies(df[['educ', 'cow']], columns=['educ', 'cow'], drop_first=True)],
+        axis=1
+    ).to_numpy(dtype=float)
+    np.testing.assert_array_equal(X, expected)
+    assert X.dtype == np.float64 and X.flags.c_contiguous
+    assert X_sparse.format == 'csr'
+    np.testing.assert_array_equal(X_sparse.toarray(), X)
+
+    # unseen level: no indicator set
+    new = pd.DataFrame({'age': [50], 'educ': ['phd'], 'cow': [9.0]})
+    np.testing.assert_array_equal(schema.transform(new), [[50, 0, 0, 0, 0]])
@@ -0,0 +1,81 @@
+"""
+Checks of the memory-mapped group layout of the real-data runners.
+"""
+
+import sys
+from pathlib import Path
+
+import pickle
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / 'real_data'))
+from grouping import GroupRows, open_cached_layout
+from shared_data import memmap_handle, detach_all
+
+
+def make_frame(n, rng):
+    df = pd.DataFrame({
+        'state_abb': rng.choice(['AA', 'BB', 'CC', 'DD'], n),
+        'income': rng.uniform(1e4, 1e5, n),
+        'y': rng.normal(size=n)
+    })
+    return df, rng.normal(size=(n, 3))
+
+
+def select(sizes):
+    return [key for key in sizes.sort_values(ascending=False).index if key != 'DD']
+
+
+def test_cached_layout_is_written_once(tmp_path):
+    df, X = make_frame(200, np.random.default_rng(0))
+    calls = []
+
+    def load_data():
+        calls.append(1)
+        return df, X
+
+    layout, order, reused = open_cached_layout(tmp_path, 'key-1', 'state_abb', select, load_data,
+                                               columns=['income'])
+    assert not reused and len(calls) == 1
+    assert layout.keys[:len(order)] == order
+
+    # Same data set: opened without loading the frame
+    layout, order_again, reused = open_cached_layout(tmp_path, 'key-1', 'state_abb', select, load_data,
+                                                     columns=['income'])
+    assert reused and len(calls) == 1 and order_again == order
+
+    group_rows = GroupRows(df, 'state_abb')
+    for key in ['AA', 'DD']:
+        frame, X_unit = layout.unit_data(key)
+        rows = group_rows.rows(key)
+        np.testing.assert_array_equal(X_unit, X[rows])
+        np.testing.assert_array_equal(frame['income'], df['income'].to_numpy()[rows])
+        np.testing.assert_array_equal(frame['y'], df['y'].to_numpy()[rows])
+        assert (frame['state_abb'] == key).all()
+
+    # Another data set: rewritten
+    _, _, reused = open_cached_layout(tmp_path, 'key-2', 'state_abb', select, load_data, columns=['income'])
+    assert not reused and len(calls) == 2
+
+
+def test_layout_calibration_is_passed_as_file_handle(tmp_path):
+    df, X = make_frame(200, np.random.default_rng(1))
+    layout, order, _ = open_cached_layout(tmp_path, 'key', 'state_abb', select, lambda: (df, X))
+    Z_calibration, _ = layout.group_rows().grouped_data(layout.X, order)
+
+    handle = memmap_handle(Z_calibration)
+    assert handle is not None
+    assert len(pickle.dumps(handle)) < 2000
+    attached = pickle.loads(pickle.dumps(handle)).attach()
+    np.testing.assert_array_equal(attached.X, Z_calibration.X)
+    np.testing.assert_array_equal(attached.Y, Z_calibration.Y)
+    np.testing.assert_array_equal(attached.offsets, Z_calibration.offsets)
+    assert attached.fingerprint() == Z_calibration.fingerprint()
+    detach_all()
+
+    # Arrays in memory are published in shared memory instead
+    in_memory, _ = GroupRows(df, 'state_abb').grouped_data(X, order)
+    assert memmap_handle(in_memory) is None
@@ -0,0 +1,40 @@
+"""
+Checks of the online HCP++ intervals for a streaming test group.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+from grouped_data import GroupedData, GroupView
+from methods import create_mu_method_ols_offset
+from methods.hcp_online import OnlineHCPPlus
+from methods.hcp_plus import compute_hcp_plus_interval
+
+
+def test_online_matches_batch_with_bounded_models():
+    rng = np.random.default_rng(0)
+    sizes = rng.integers(5, 40, 12)
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    X = rng.normal(size=(offsets[-1], 2))
+    Y = X @ np.array([1.0, -2.0]) + rng.normal(size=offsets[-1])
+    U = np.zeros((12, 1))
+    calibration = GroupedData(X, Y, offsets, U)
+    X_test = rng.normal(size=(30, 2))
+    Y_test = X_test @ np.array([1.0, -2.0]) + 0.5 + rng.normal(size=30)
+    mu_method = create_mu_method_ols_offset()
+
+    online = OnlineHCPPlus(U, calibration, np.zeros((1, 1)), 0.1, 0.5, mu_method,
+                           rng=np.random.default_rng(1), max_models=2)
+    batch_rng = np.random.default_rng(1)
+    for o in range(X_test.shape[0] - 1):
+        result = online.predict_interval(X_test[o])
+        expected = compute_hcp_plus_interval(
+            U, calibration, np.zeros((1, 1)), GroupView(X_test[:o + 1], Y_test[:o + 1]),
+            o, 0.1, 0.5, mu_method, rng=batch_rng
+        )
+        np.testing.assert_allclose(result['interval'], expected['interval'], rtol=1e-9, atol=1e-9)
+        online.update(X_test[o], Y_test[o])
+        assert len(online._states) <= 2
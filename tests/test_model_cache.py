@@ -0,0 +1,115 @@
+"""
+Checks of the bounded model and score caches.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+from grouped_data import GroupedData
+from methods import create_mu_method_ols_offset
+from methods.hcp_online import OnlineHCPPlus
+from methods.model_cache import GlobalModelCache, ScoreCache
+
+
+def make_calibration(n_groups=6, seed=0):
+    rng = np.random.default_rng(seed)
+    offsets = np.arange(0, 10 * n_groups + 1, 10)
+    X = rng.normal(size=(offsets[-1], 2))
+    return GroupedData(X, X[:, 0] + rng.normal(size=offsets[-1]), offsets, np.zeros((n_groups, 1)))
+
+
+def counting_mu_method(fits):
+    def fit_global(U_matrix, Z_list, group_index_vector):
+        fits.append(tuple(group_index_vector))
+        return object()
+
+    return {'fit_global': fit_global, 'predict_group_mu_batch': None}
+
+
+class Blocks:
+    """Stand-in for cached scores: only the size estimate reads it."""
+
+    def __init__(self, n):
+        self.sorted_blocks = [np.zeros(n)]
+
+
+def test_global_model_cache_counts_and_evicts_least_recently_used():
+    calibration = make_calibration()
+    fits = []
+    mu_method = counting_mu_method(fits)
+    cache = GlobalModelCache(max_entries=2)
+
+    first = cache.get_or_fit(mu_method, calibration.U, calibration, [0, 1])
+    cache.get_or_fit(mu_method, calibration.U, calibration, [2, 3])
+    assert cache.get_or_fit(mu_method, calibration.U, calibration, [1, 0]) is first
+    # [2, 3] is now the least recently used entry and makes room for [4, 5]
+    cache.get_or_fit(mu_method, calibration.U, calibration, [4, 5])
+    assert cache.get_or_fit(mu_method, calibration.U, calibration, [0, 1]) is first
+    cache.get_or_fit(mu_method, calibration.U, calibration, [2, 3])
+
+    assert fits == [(0, 1), (2, 3), (4, 5), (2, 3)]
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (2, 4, 2)
+    assert stats['hit_rate'] == 2 / 6
+    assert [sorted(key[2]) for key in cache._entries] == [[0, 1], [2, 3]]
+
+
+def test_evicted_model_takes_its_scores_along():
+    calibration = make_calibration()
+    mu_method = counting_mu_method([])
+    cache = GlobalModelCache(max_entries=1)
+
+    model = cache.get_or_fit(mu_method, calibration.U, calibration, [0])
+    cache.scores.get_or_compute(mu_method, calibration, model, 3, lambda: Blocks(4))
+    assert cache.stats()['score_entries'] == 1
+    cache.get_or_fit(mu_method, calibration.U, calibration, [1])
+    assert cache.stats()['score_entries'] == 0 and cache.scores.nbytes == 0
+
+
+def test_score_cache_evicts_by_entries_and_bytes():
+    calibration = make_calibration()
+    mu_method = counting_mu_method([])
+    models = [object() for _ in range(4)]
+
+    scores = ScoreCache(max_entries=2)
+    for tau, model in enumerate(models[:3]):
+        scores.get_or_compute(mu_method, calibration, model, tau, lambda: Blocks(1))
+    assert [key[3] for key in scores._entries] == [1, 2]
+    assert scores.get_or_compute(mu_method, calibration, models[2], 2, lambda: None) is not None
+    assert scores.stats() == {'hits': 1, 'misses': 3, 'hit_rate': 0.25, 'entries': 2, 'nbytes': 16}
+
+    # 10 floats per entry: two entries fit into 200 bytes, three do not
+    scores = ScoreCache(max_entries=None, max_bytes=200)
+    for tau, model in enumerate(models):
+        scores.get_or_compute(mu_method, calibration, model, tau, lambda: Blocks(10))
+        if tau == 1:
+            # refresh tau 0, so tau 1 goes first
+            scores.get_or_compute(mu_method, calibration, models[0], 0, lambda: None)
+    assert [key[3] for key in scores._entries] == [2, 3]
+    assert scores.nbytes == 160 and (scores.hits, scores.misses) == (1, 4)
+
+    # the most recent entry stays even if it alone exceeds max_bytes
+    scores = ScoreCache(max_entries=None, max_bytes=10)
+    scores.get_or_compute(mu_method, calibration, models[0], 0, lambda: Blocks(10))
+    assert len(scores) == 1
+
+
+def test_online_keeps_max_models_states():
+    calibration = make_calibration()
+    cache = GlobalModelCache()
+    online = OnlineHCPPlus(calibration.U, calibration, np.zeros((1, 1)), 0.1, 0.5,
+                           create_mu_method_ols_offset(), model_cache=cache,
+                           rng=np.random.default_rng(0), max_models=2)
+
+    for S_comp in (frozenset({0, 1}), frozenset({2, 3}), frozenset({0, 1}), frozenset({4, 5})):
+        online._state(S_comp)
+    assert list(online._states) == [frozenset({0, 1}), frozenset({4, 5})]
+    assert cache.stats()['misses'] == 3
+
+    # a dropped state is rebuilt from the shared model cache without a refit
+    online._state(frozenset({2, 3}))
+    assert list(online._states) == [frozenset({4, 5}), frozenset({2, 3})]
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 3)
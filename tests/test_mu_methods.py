@@ -0,0 +1,122 @@
+"""
+Checks of the μ-methods' fast fitting paths.
+"""
+
+import sys
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression
+
+sys.path.append(str(Path(__file__).parent.parent))
+import methods.mu_methods as mu_methods
+from grouped_data import GroupedData
+
+
+def make_grouped(n_groups, rng, constant_U=True):
+    sizes = rng.integers(20, 60, n_groups)
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    X = rng.normal(size=(offsets[-1], 4))
+    Y = X @ rng.normal(size=4) + rng.normal(size=offsets[-1])
+    U = np.zeros((n_groups, 1)) if constant_U else rng.normal(size=(n_groups, 1))
+    return GroupedData(X, Y, offsets, U)
+
+
+def test_ols_downdate_is_used_with_constant_U(monkeypatch):
+    rng = np.random.default_rng(0)
+    data = make_grouped(34, rng)
+    direct = mu_methods.create_mu_method_ols_offset()
+    downdate = mu_methods.create_mu_method_ols_offset(downdate=True)
+
+    def no_fallback(stats, group_index_vector):
+        raise AssertionError("downdate fell back to the direct sum")
+
+    monkeypatch.setattr(mu_methods, '_ols_from_group_statistics', no_fallback)
+    X_new = rng.normal(size=(10, 4))
+    for _ in range(20):
+        excluded = rng.choice(34, int(rng.integers(1, 6)), replace=False)
+        S_comp = [j for j in range(34) if j not in excluded]
+        expected = direct['predict_global_batch'](direct['fit_global'](data.U, data, S_comp), X_new, [0.0])
+        fitted = downdate['predict_global_batch'](downdate['fit_global'](data.U, data, S_comp), X_new, [0.0])
+        np.testing.assert_allclose(fitted, expected, rtol=1e-9, atol=1e-9)
+
+
+def test_ols_statistics_are_shared_by_equal_data(monkeypatch):
+    rng = np.random.default_rng(2)
+    data = make_grouped(8, rng, constant_U=False)
+    mu = mu_methods.create_mu_method_ols_offset(sufficient_statistics=True)
+    computed = []
+    statistics = mu_methods._ols_group_statistics
+
+    def counting(data):
+        computed.append(data.fingerprint())
+        return statistics(data)
+
+    monkeypatch.setattr(mu_methods, '_ols_group_statistics', counting)
+    for _ in range(3):
+        # a U override builds a fresh GroupedData on every call
+        mu['fit_global'](data.U + 1.0, data, [0, 1, 2])
+        mu['fit_global'](None, GroupedData(data.X.copy(), data.Y.copy(), data.offsets, data.U), [3, 4])
+    assert len(computed) == 2
+
+
+def test_group_bagged_forest_masks_hcp_plus_sized_exclusions():
+    rng = np.random.default_rng(1)
+    data = make_grouped(34, rng, constant_U=False)
+    mu = mu_methods.create_mu_method_random_forest_group_bagged(ntree=200, min_trees=20)
+    X_new = rng.normal(size=(10, 4))
+    u_new = data.U[0]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)  # no fallback refits
+        for _ in range(10):
+            excluded = rng.choice(34, 17, replace=False)
+            S_comp = [j for j in range(34) if j not in excluded]
+            model = mu['fit_global'](data.U, data, S_comp)
+            assert isinstance(model, mu_methods._TreeSubsetForest)
+            assert len(model.estimators_) >= 20
+
+            # the masked model never saw the excluded groups
+            Y_perturbed = data.Y.copy()
+            for j in excluded:
+                Y_perturbed[data.offsets[j]:data.offsets[j + 1]] += 100.0
+            perturbed = GroupedData(data.X, Y_perturbed, data.offsets, data.U)
+            model_perturbed = mu['fit_global'](perturbed.U, perturbed, S_comp)
+            np.testing.assert_array_equal(
+                mu['predict_global_batch'](model, X_new, u_new),
+                mu['predict_global_batch'](model_perturbed, X_new, u_new)
+            )
+
+
+def test_group_bag_fraction_requires_more_than_twice_min_trees():
+    assert 0.0 < mu_methods.group_bag_fraction(101, 50, 10) < 1.0
+    with pytest.raises(ValueError):
+        mu_methods.group_bag_fraction(100, 50, 10)
+    with pytest.raises(ValueError):
+        mu_methods.create_mu_method_random_forest_group_bagged(ntree=100, min_trees=50)
+    mu_methods.create_mu_method_random_forest_group_bagged(ntree=100, min_trees=50,
+                                                          group_fraction=0.5)
+
+
+def test_ols_statistics_match_sklearn_on_collinear_designs():
+    rng = np.random.default_rng(3)
+    n = 400
+    X = rng.normal(size=(n, 3))
+    levels = np.eye(3)[rng.integers(0, 3, n)]
+    designs = [
+        np.column_stack([X, 3 * X[:, 0]]),             # duplicated column
+        np.column_stack([X, X[:, 0] + 2 * X[:, 1]]),   # linear combination
+        np.column_stack([X, levels])                   # indicators with an intercept
+    ]
+    for design in designs:
+        y = design @ rng.normal(size=design.shape[1]) + rng.normal(size=n)
+        mean_f = design.mean(axis=0)
+        centered = design - mean_f
+        model = mu_methods._ols_solve(mean_f, y.mean(), centered.T @ centered,
+                                      centered.T @ (y - y.mean()))
+        reference = LinearRegression().fit(design, y)
+        # new points off the collinear subspace expose the choice of solution
+        X_new = rng.normal(size=(50, design.shape[1]))
+        np.testing.assert_allclose(model.predict(X_new), reference.predict(X_new), atol=1e-9)
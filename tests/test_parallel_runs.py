@@ -0,0 +1,49 @@
+"""
+Checks that the process-pool runners give the same results for any number
+of workers.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent))
+from DGP import create_dgp_specification_default
+from DGP.experiments import run_experiments_outer
+from grouped_data import GroupedData
+from methods import create_mu_method_ols_offset
+from real_data.unit_runner import run_test_units
+
+
+def test_experiments_do_not_depend_on_the_worker_count():
+    kwargs = dict(
+        number_experiments=3, number_groups_k=30, lambda_Poisson=10,
+        dgp_specification=create_dgp_specification_default(dimension=2), o_observed=2,
+        number_subsampling_repetitions=5, alpha_selection=0.5, number_test_groups=3,
+        mu_method_baseline=create_mu_method_ols_offset(),
+        mu_method_hcp=create_mu_method_ols_offset(), show_progress=False, seed=11
+    )
+    sequential = run_experiments_outer(n_workers=1, **kwargs)
+    parallel = run_experiments_outer(n_workers=2, **kwargs)
+    pd.testing.assert_frame_equal(sequential, parallel)
+
+
+def residual_quantiles(Z_calibration, shift):
+    # uses the calibration data and the unit's np.random stream
+    noise = np.random.normal(size=Z_calibration.n_obs)
+    return pd.DataFrame({'q': np.quantile(Z_calibration.Y + noise + shift, [0.1, 0.5, 0.9])})
+
+
+def test_units_do_not_depend_on_the_worker_count():
+    rng = np.random.default_rng(0)
+    offsets = np.arange(0, 41, 10)
+    calibration = GroupedData(rng.normal(size=(40, 2)), rng.normal(size=40), offsets, np.zeros((4, 1)))
+    unit_kwargs = [{'shift': float(s)} for s in range(4)]
+
+    sequential = run_test_units(residual_quantiles, unit_kwargs, calibration, n_workers=1, seed=3)
+    parallel = run_test_units(residual_quantiles, unit_kwargs, calibration, n_workers=2, seed=3)
+    assert len(parallel) == len(unit_kwargs)
+    for expected, result in zip(sequential, parallel):
+        pd.testing.assert_frame_equal(expected, result)
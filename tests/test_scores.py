@@ -0,0 +1,55 @@
+"""
+Regression checks of the weighted quantiles at the exact 1 - alpha boundary.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+from scores import weighted_quantile, GroupedWeightedQuantile
+from methods.baseline_hcp import compute_hcp_interval_radius, compute_pooling_interval_radius
+
+
+def test_hcp_radius_at_exact_boundary():
+    # 9 equal groups carry exactly 0.9 of finite weight: at alpha = 0.1 the
+    # radius is the largest finite score, not the point mass at infinity
+    scores_list = [np.array([1.0, 2.0, 3.0])] * 9
+    assert compute_hcp_interval_radius(scores_list, 0.1) == 3.0
+    assert np.array_equal(compute_hcp_interval_radius(scores_list, [0.1, 0.05]), [3.0, np.inf])
+
+
+def test_pooling_radius_at_exact_boundary():
+    scores_list = [np.arange(1.0, 11.0)] * 3
+    # cumulative weight reaches exactly 0.7 at score 7
+    assert compute_pooling_interval_radius(scores_list, 0.3) == 7.0
+
+
+def test_grouped_and_flat_quantiles_agree_on_ties():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        K = int(rng.integers(1, 12))
+        blocks = [rng.integers(0, 4, int(rng.integers(1, 7))).astype(float) for _ in range(K)]
+        weights = [1.0 / ((K + 1) * len(b)) for b in blocks]
+        point_masses = [(np.inf, 1.0 / (K + 1))]
+        values = np.concatenate(blocks)
+        flat_weights = np.concatenate([np.full(len(b), w) for b, w in zip(blocks, weights)])
+        for alpha in (0.05, 0.1, 0.2, 0.25, 0.5):
+            grouped = GroupedWeightedQuantile(blocks, weights, point_masses=point_masses)
+            assert grouped.quantile(alpha) == weighted_quantile(
+                values, flat_weights, alpha, point_masses=point_masses
+            )
+
+
+def test_quantile_at_rounded_boundary():
+    # the CDF at score 6 rounds to 0.49999999999999994 < 0.5; the tolerance
+    # keeps the quantile at 6 (it was 7 before CDF_TOLERANCE)
+    values = np.arange(1.0, 13.0)
+    weights = np.full(12, 1 / 12)
+    assert np.cumsum(weights)[5] < 0.5
+    assert weighted_quantile(values, weights, 0.5) == 6.0
+    grouped = GroupedWeightedQuantile([values[:5], values[5:]], [1 / 12, 1 / 12])
+    assert grouped.quantile(0.5) == 6.0
+    assert np.array_equal(grouped.quantile(np.array([0.5, 0.25])),
+                          [6.0, weighted_quantile(values, weights, 0.25)])
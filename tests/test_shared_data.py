@@ -0,0 +1,33 @@
+"""
+Checks of the worker-side attachments to shared calibration data.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+import shared_data
+from grouped_data import GroupedData
+from shared_data import SharedGroupedData, detach_all
+
+
+def _calibration(seed):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(30, 2))
+    return GroupedData(X, rng.normal(size=30), np.array([0, 10, 30]), np.zeros((2, 1)))
+
+
+def test_attaching_another_block_releases_the_previous_one():
+    with SharedGroupedData(_calibration(0)) as first, SharedGroupedData(_calibration(1)) as second:
+        data = first.handle.attach()
+        assert first.handle.attach() is data
+        assert np.array_equal(data.Y, _calibration(0).Y)
+        del data
+
+        second.handle.attach()
+        assert list(shared_data._attached) == [second.handle.name]
+
+        detach_all()
+        assert shared_data._attached == {}